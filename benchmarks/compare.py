@@ -0,0 +1,74 @@
+"""
+compare two reports of benchmarks.micro or benchmarks.e2e:
+
+    python -m benchmarks.compare BASELINE CURRENT [--threshold 0.1]
+
+A benchmark regresses if its seconds grow by more than threshold, relative
+to the baseline. The exit status is 1 if any benchmark regresses, so that it
+can be a gate of hot-path changes.
+"""
+import argparse
+import json
+from collections import namedtuple
+from typing import Dict, List
+
+# comparison of one benchmark, change is the relative change of seconds and
+# it is None if the benchmark is missing in one of reports.
+Comparison = namedtuple('Comparison', ('name', 'baseline', 'current',
+                                       'change', 'regressed'))
+
+
+def compare(baseline: Dict, current: Dict, threshold: float = 0.1) \
+        -> List[Comparison]:
+    """
+    :param baseline: report of baseline
+    :param current: report of current tree
+    :param threshold: relative growth of seconds which is a regression
+    """
+    ret = []
+    baseline_results = baseline['results']
+    current_results = current['results']
+    names = list(baseline_results) + [name for name in current_results
+                                      if name not in baseline_results]
+    for name in names:
+        base = baseline_results.get(name, {}).get('seconds')
+        cur = current_results.get(name, {}).get('seconds')
+        if not base or cur is None:
+            ret.append(Comparison(name, base, cur, None, False))
+            continue
+        change = cur / base - 1
+        ret.append(Comparison(name, base, cur, change, change > threshold))
+    return ret
+
+
+def print_comparison(comparison: List[Comparison]):
+    print('{:<60} {:>12} {:>12} {:>8}'.format(
+        'benchmark', 'baseline', 'current', 'change'))
+    for c in comparison:
+        print('{:<60} {:>12} {:>12} {:>8} {}'.format(
+            c.name,
+            '-' if c.baseline is None else '{:.6f}'.format(c.baseline),
+            '-' if c.current is None else '{:.6f}'.format(c.current),
+            '-' if c.change is None else '{:+.1%}'.format(c.change),
+            'REGRESSED' if c.regressed else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative growth of seconds, default is 0.1')
+    args = parser.parse_args()
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    comparison = compare(baseline, current, args.threshold)
+    print_comparison(comparison)
+    if any(c.regressed for c in comparison):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
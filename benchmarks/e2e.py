@@ -0,0 +1,149 @@
+"""
+end-to-end benchmark of update_quarter and update_day on the synthetic
+dataset, see benchmarks/synthetic.py:
+
+    python -m benchmarks.synthetic generate
+    python -m benchmarks.e2e --label my-change
+
+Every run starts from an empty destination, then times full updates, appends
+the delta of --days days to the source and times incremental updates. The
+rows/s of every pipeline stage are taken from progress status files. Results
+are written to results.dir as json, they can be compared by
+benchmarks.compare.
+"""
+import argparse
+import datetime
+import json
+import os
+import shutil
+import subprocess
+import time
+from collections import OrderedDict
+from typing import Callable, Dict
+
+from fdhandle import update_day, update_quarter
+from fdhandle.conn import MySQLDictCursorWrapper
+from fdhandle.generation import next_name, prev_name
+from fdhandle.progress import aggregate
+from config import get_dest_backend, get_dest_connect, get_progress_conf
+from benchmarks.synthetic import DEFAULT_CONFIG, advance, init_benchmark, \
+    results_conf, synthetic_conf
+
+# tables of destination, they are dropped before every run
+_DEST_TABLES = ('research_quarter', 'prepare_quarter', 'strategy_quarter',
+                'strategy_quarter_metrics', 'orig_day', 'recal_day')
+_STATE_TABLES = ('sync_watermark', 'recal_job', 'quarter_checkpoint',
+                 'recal_divergence')
+
+
+def _reset_dest():
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        for name in _DEST_TABLES:
+            for table in (name, next_name(name), prev_name(name)):
+                cursor.execute('DROP TABLE IF EXISTS `{}`'.format(table))
+        for name in _STATE_TABLES:
+            cursor.execute('DROP TABLE IF EXISTS `{}`'.format(name))
+    connect.close()
+
+
+def current_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run_phase(name: str, action: Callable, status_dir: str) -> Dict:
+    """
+    run one phase and measure it.
+
+    :return: key is phase name or "<phase>/<stage>", value is seconds, rows
+             read, rows written and rows/s.
+    """
+    shutil.rmtree(status_dir, ignore_errors=True)
+    os.makedirs(status_dir)
+    print(datetime.datetime.now(), 'benchmark', name, 'started.')
+    started = time.time()
+    action()
+    seconds = time.time() - started
+    ret = OrderedDict()
+    rows_written = 0
+    for stage, counters in sorted(aggregate(status_dir).items()):
+        elapsed = max(counters['updated_at'] - counters['started_at'], 1e-6)
+        rows_written += counters['rows_written']
+        ret[name + '/' + stage] = {
+            'seconds': elapsed,
+            'rows_read': counters['rows_read'],
+            'rows_written': counters['rows_written'],
+            'rows_per_second': counters['rows_written'] / elapsed,
+        }
+    ret[name] = {'seconds': seconds, 'rows_written': rows_written,
+                 'rows_per_second': rows_written / seconds}
+    ret.move_to_end(name, last=False)
+    return ret
+
+
+def run(conf, label: str, days: int) -> Dict:
+    """:param conf: benchmark config, see synthetic.init_benchmark()"""
+    conf = synthetic_conf(conf)
+    status_dir = get_progress_conf().get('dir')
+    if not status_dir:
+        raise ValueError("progress.dir must be set for benchmarks")
+    _reset_dest()
+    results = OrderedDict()
+    results.update(_run_phase('update_quarter.full',
+                              lambda: update_quarter(first=True), status_dir))
+    results.update(_run_phase('update_day.full',
+                              lambda: update_day(first=True), status_dir))
+    advance(conf, days)
+    results.update(_run_phase('update_quarter.incremental', update_quarter,
+                              status_dir))
+    results.update(_run_phase('update_day.incremental', update_day,
+                              status_dir))
+    return OrderedDict((
+        ('label', label),
+        ('commit', current_commit()),
+        ('created_at', datetime.datetime.now().isoformat()),
+        ('settings', OrderedDict((
+            ('synthetic', conf),
+            ('days', days),
+            ('dest', get_dest_backend()),
+        ))),
+        ('results', results),
+    ))
+
+
+def _print(report: Dict):
+    print('{:<60} {:>10} {:>12} {:>12}'.format(
+        'benchmark', 'seconds', 'rows', 'rows/s'))
+    for name, result in report['results'].items():
+        print('{:<60} {:>10.2f} {:>12} {:>12.1f}'.format(
+            name, result['seconds'], result['rows_written'],
+            result['rows_per_second']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--config', default=DEFAULT_CONFIG)
+    parser.add_argument('--label', default='e2e')
+    parser.add_argument('--days', type=int, default=5,
+                        help='calendar days of the incremental delta')
+    args = parser.parse_args()
+    conf = init_benchmark(args.config)
+    report = run(conf, args.label, args.days)
+    _print(report)
+    results_dir = results_conf(conf).get('dir', 'benchmark/results')
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, '{}-{}.json'.format(
+        args.label, datetime.datetime.now().strftime('%Y%m%d%H%M%S')))
+    with open(path, mode='wt') as f:
+        json.dump(report, f, indent=2)
+    print(datetime.datetime.now(), 'results are written to', path)
+
+
+if __name__ == '__main__':
+    main()
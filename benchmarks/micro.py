@@ -0,0 +1,233 @@
+"""
+micro-benchmarks of the inner functions of recalculation, they dominate the
+profiles of update_quarter and update_day:
+
+    python -m benchmarks.micro --label my-change
+    python -m benchmarks.micro --compare benchmarks/baselines/micro.json
+    python -m benchmarks.micro --save-baseline
+
+Every benchmark runs on fixture data which is generated from a fixed seed,
+so results of different commits are measured on the same input. No database
+is needed, the queries of the measured functions are replaced by fixtures.
+A result is the fastest of --repeat rounds, see benchmarks.compare.
+"""
+import argparse
+import datetime
+import json
+import os
+import timeit
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Tuple
+from unittest import mock
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from fdhandle import codemap
+from fdhandle.fixtures import COMCODE, Fixture
+from fdhandle.metrics import Income
+from fdhandle.recal import QuarterMetrics, RecalDayMetrics, _latest_enddates
+from fdhandle.update import ResearchQuarter
+from benchmarks.compare import compare, print_comparison
+from benchmarks.e2e import current_commit
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baselines', 'micro.json')
+
+_ORDER_BOOK_ID = '000001.XSHE'
+_STRAIGHT_METRICS = ['net_profit', 'cash_flow_from_operating_activities',
+                     'cash', 'cash_equivalent', 'cash_equivalent_inc_net']
+_LATEST_METRICS = ['cash_flow_from_operating_activities', 'cash',
+                   'cash_equivalent', 'revenue', 'operating_revenue',
+                   'net_profit_parent_company', 'cash_equivalent_inc_net']
+# ratio helpers of RecalDayMetrics in the order of compute()
+_RATIOS = ('pe_ratio', 'pcf_ratio', 'pcf_ratio_1', 'ps_ratio', 'pe_ratio_2',
+           'ev', 'ev2', 'ev_to_ebit', 'pe_ratio_1', 'pcf_ratio_3',
+           'pcf_ratio_2')
+
+
+@contextmanager
+def _queries_of(fixture: Fixture):
+    """queries of measured functions return fixture data"""
+    def quarter_metrics(order_book_id, session=None):
+        return fixture.reports
+
+    with mock.patch('fdhandle.recal._quarter_metrics', quarter_metrics), \
+            mock.patch.object(codemap, '_comcode_orderbookid_map',
+                              {COMCODE: _ORDER_BOOK_ID}):
+        yield
+
+
+def bench_latest_enddates(fixture: Fixture) -> Tuple[Callable, int]:
+    tradedates = fixture.tradedates
+
+    def run():
+        for tradedate in tradedates:
+            _latest_enddates(tradedate)
+    return run, len(tradedates)
+
+
+def bench_quarter_metrics_get(fixture: Fixture) -> Tuple[Callable, int]:
+    """the walk of compute(), trading dates in descending order"""
+    quarter_metrics = QuarterMetrics(_ORDER_BOOK_ID)
+    tradedates = fixture.tradedates
+
+    def run():
+        quarter_metrics._cur_index = -1
+        quarter_metrics._clear()
+        for tradedate in tradedates:
+            quarter_metrics.get(tradedate)
+    return run, len(tradedates)
+
+
+def _bench_quarters(fixture: Fixture, method: str, metric_names: List[str]) \
+        -> Tuple[Callable, int]:
+    """calculation of every quarter, cache is cleared before each one"""
+    quarter_metrics = QuarterMetrics(_ORDER_BOOK_ID)
+    indexes = range(len(quarter_metrics._quarter_metrics))
+    calculate = getattr(quarter_metrics, method)
+
+    def run():
+        for index in indexes:
+            quarter_metrics._cur_index = index
+            quarter_metrics._clear()
+            calculate(metric_names)
+    return run, len(indexes)
+
+
+def bench_four_straight_quarter(fixture: Fixture) -> Tuple[Callable, int]:
+    return _bench_quarters(fixture, '_four_straight_quarter',
+                           _STRAIGHT_METRICS)
+
+
+def bench_four_latest_quarter(fixture: Fixture) -> Tuple[Callable, int]:
+    return _bench_quarters(fixture, '_four_latest_quarter', _LATEST_METRICS)
+
+
+def bench_get_and_fill(fixture: Fixture) -> Tuple[Callable, int]:
+    quarter_metrics = QuarterMetrics(_ORDER_BOOK_ID)
+
+    return quarter_metrics._get_and_fill, len(fixture.reports)
+
+
+def bench_ratios(fixture: Fixture) -> Tuple[Callable, int]:
+    """
+    ratio helpers of compute() on every day record. Records are copied
+    before each round because helpers change them.
+    """
+    recal_day_metrics = RecalDayMetrics(_ORDER_BOOK_ID)
+    quarter_metrics = QuarterMetrics(_ORDER_BOOK_ID)
+    inputs = [(record, quarter_metrics.get(tradedate), tradedate,
+               fixture.closing_prices[record['tradedate']])
+              for record, tradedate in zip(fixture.day_records,
+                                           fixture.tradedates)]
+    helpers = [getattr(recal_day_metrics, name) for name in _RATIOS]
+    peg_ratio = recal_day_metrics.peg_ratio
+    pb_ratio = recal_day_metrics.pb_ratio
+
+    def run():
+        for record, metrics, tradedate, closing_price in inputs:
+            record = dict(record)
+            for helper in helpers:
+                helper(record, metrics)
+            peg_ratio(record, metrics, tradedate)
+            pb_ratio(record, metrics, closing_price)
+    return run, len(inputs)
+
+
+def bench_day_clear_record(fixture: Fixture) -> Tuple[Callable, int]:
+    records = fixture.day_records
+    clear_record = RecalDayMetrics._clear_record
+
+    def run():
+        for record in records:
+            clear_record(record)
+    return run, len(records)
+
+
+def bench_quarter_clear_records(fixture: Fixture) -> Tuple[Callable, int]:
+    plan = Income.row_plan(fixture.quarter_columns)
+    rows = fixture.quarter_rows
+
+    def run():
+        for _ in ResearchQuarter._clear_records(plan, rows):
+            pass
+    return run, len(rows)
+
+
+# benchmarks, key is benchmark name and value builds its function and the
+# count of items processed by one call
+BENCHMARKS = OrderedDict((
+    ('_latest_enddates', bench_latest_enddates),
+    ('QuarterMetrics.get', bench_quarter_metrics_get),
+    ('QuarterMetrics._four_straight_quarter', bench_four_straight_quarter),
+    ('QuarterMetrics._four_latest_quarter', bench_four_latest_quarter),
+    ('QuarterMetrics._get_and_fill', bench_get_and_fill),
+    ('RecalDayMetrics.ratios', bench_ratios),
+    ('RecalDayMetrics._clear_record', bench_day_clear_record),
+    ('ResearchQuarter._clear_records', bench_quarter_clear_records),
+))
+
+
+def run(label: str, repeat: int = 5, names: List[str] = None) -> Dict:
+    """
+    :param names: names of benchmarks to run, all benchmarks if it is None
+    :return: report in the same format as benchmarks.e2e, seconds of a
+             result are seconds of one call.
+    """
+    fixture = Fixture()
+    results = OrderedDict()
+    with _queries_of(fixture):
+        for name, build in BENCHMARKS.items():
+            if names and name not in names:
+                continue
+            function, items = build(fixture)
+            timer = timeit.Timer(function)
+            number, _ = timer.autorange()
+            seconds = min(timer.repeat(repeat=repeat, number=number)) / number
+            results[name] = {'seconds': seconds, 'items': items,
+                             'items_per_second': items / seconds}
+            print(datetime.datetime.now(), 'benchmark', name,
+                  '{:.1f} us, {:.0f} items/s'.format(seconds * 1e6,
+                                                     items / seconds))
+    return OrderedDict((
+        ('label', label),
+        ('commit', current_commit()),
+        ('created_at', datetime.datetime.now().isoformat()),
+        ('settings', OrderedDict((
+            ('repeat', repeat),
+            ('years', fixture.end_year - fixture.start_year + 1),
+        ))),
+        ('results', results),
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--label', default='micro')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--benchmark', action='append', dest='names',
+                        choices=list(BENCHMARKS))
+    parser.add_argument('--output', help='path of json report')
+    parser.add_argument('--compare', metavar='BASELINE',
+                        help='compare with baseline report')
+    parser.add_argument('--threshold', type=float, default=0.1)
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='write the report to ' + BASELINE)
+    args = parser.parse_args()
+    report = run(args.label, args.repeat, args.names)
+    path = BASELINE if args.save_baseline else args.output
+    if path:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, mode='wt') as f:
+            json.dump(report, f, indent=2)
+        print(datetime.datetime.now(), 'results are written to', path)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparison = compare(baseline, report, args.threshold)
+        print_comparison(comparison)
+        if any(c.regressed for c in comparison):
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
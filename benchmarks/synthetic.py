@@ -0,0 +1,422 @@
+"""
+synthetic pgenius dataset for benchmarks. It builds the source tables read by
+the pipeline and the instruments files for N stocks x M years:
+
+    python -m benchmarks.synthetic generate [--config benchmark.yaml]
+    python -m benchmarks.synthetic advance --days 5
+
+Source reads are compiled for mysql, so the stand-in of pgenius is a local
+mysql database given by data.source of benchmark config, such as
+pgenius_bench. Its tables are dropped and created again by generate. The
+dataset is deterministic for the same synthetic settings.
+"""
+import argparse
+import csv
+import datetime
+import os
+import random
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import yaml
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from config import RQConfig, init_with, get_inst_files, get_source_confs
+from fdhandle.conn import create_conn
+from fdhandle.metrics import Balance, CashFlow, Day, Income, Indicator, \
+    QUARTER_ENDDATE_MAP, RPT_SRC, RPT_TYPE, day_fd, stk_code, stk_market, \
+    table_name
+
+DEFAULT_CONFIG = os.path.join(os.path.dirname(__file__), 'benchmark.yaml')
+
+# columns which are not metrics, key is column name and value is its type
+_KEY_COLUMNS = OrderedDict((
+    ('comcode', 'INT NOT NULL'),
+    ('inner_code', 'INT NOT NULL'),
+    ('a_stockcode', 'VARCHAR(10)'),
+    ('stockcode', 'VARCHAR(10)'),
+    ('enddate', 'DATE'),
+    ('declaredate', 'DATE'),
+    ('rpt_date', 'DATE'),
+    ('startdate', 'DATE'),
+    ('rpt_src', 'VARCHAR(20)'),
+    ('rpt_type', 'VARCHAR(20)'),
+    ('trd_date', 'DATE'),
+    ('tradedate', 'DATE'),
+    ('isvalid', 'INT NOT NULL'),
+    ('mtime', 'DATETIME NOT NULL'),
+))
+_METRIC_TYPE = 'DECIMAL(20,4)'
+# columns filtered by the pipeline, see filter_conditions_ of metrics
+_QUARTER_KEYS = ('comcode', 'a_stockcode', 'enddate', 'declaredate',
+                 'rpt_date', 'startdate', 'rpt_src', 'rpt_type', 'isvalid',
+                 'mtime')
+# day metrics which are market values, the others are ratios
+_CAP_COLUMNS = {'TCAP_1', 'TCAP_2', 'A_TCAP_1', 'A_TCAP_2', 'SRV', 'EV1',
+                'EV2'}
+# days between end date and announce date of every quarter
+_ANNOUNCE_LAG = {1: (20, 30), 2: (40, 60), 3: (20, 30), 4: (80, 115)}
+# records of other report type, which are filtered out by the pipeline
+_OTHER_TYPE_RATIO = 0.05
+_INSERT_BATCH = 1000
+_INSTRUMENT_COLUMNS = ('OrderBookID', 'Symbol', 'ListedDate', 'DeListedDate')
+
+
+class OverlayConfig(object):
+    """
+    config of fdhandle.yaml overridden by benchmark config, the dictionaries
+    of both are merged.
+    """
+
+    def __init__(self, path: str):
+        self._base = RQConfig()
+        with open(path, mode='rb') as f:
+            self._overrides = yaml.safe_load(f) or {}
+
+    @staticmethod
+    def _merge(base, override):
+        if not isinstance(base, dict) or not isinstance(override, dict):
+            return override
+        ret = dict(base)
+        for key, value in override.items():
+            ret[key] = OverlayConfig._merge(base.get(key), value)
+        return ret
+
+    def get(self, path):
+        try:
+            base = self._base.get(path)
+        except KeyError:
+            base = None
+        override = self._overrides
+        for element in path.split('.'):
+            if not isinstance(override, dict) or element not in override:
+                if base is None:
+                    raise KeyError(path)
+                return base
+            override = override[element]
+        return self._merge(base, override)
+
+
+def init_benchmark(config_path: str = None) -> OverlayConfig:
+    conf = OverlayConfig(config_path or DEFAULT_CONFIG)
+    init_with(conf)
+    return conf
+
+
+def _section(conf, path: str) -> Dict:
+    try:
+        return conf.get(path) or {}
+    except KeyError:
+        return {}
+
+
+def synthetic_conf(conf) -> Dict:
+    """size of synthetic dataset, see synthetic section of benchmark.yaml"""
+    ret = {'stocks': 100, 'years': 10, 'start_year': 2010, 'seed': 1}
+    ret.update(_section(conf, 'synthetic'))
+    return ret
+
+
+def results_conf(conf) -> Dict:
+    return _section(conf, 'results')
+
+
+def _source_columns() -> Dict[str, List[str]]:
+    """columns read by the pipeline, key is source table name"""
+    ret = OrderedDict()
+    for clazz in (Income, Balance, CashFlow, Indicator):
+        name = clazz.name_()
+        ret.setdefault(name, list(_QUARTER_KEYS))
+        for field in clazz.metrics():
+            # metrics of one class may be read from other quarter tables
+            field = getattr(field, '_expr', field)
+            columns = ret.setdefault(table_name(field._prefix),
+                                     list(_QUARTER_KEYS))
+            if field._name._name not in columns:
+                columns.append(field._name._name)
+    day_columns = ['stockcode', 'trd_date', 'inner_code', 'isvalid', 'mtime']
+    for field in Day.metrics():
+        column = getattr(field, '_expr', field)._name._name
+        if column not in day_columns:
+            day_columns.append(column)
+    ret[table_name(day_fd)] = day_columns
+    ret[table_name(stk_market)] = ['inner_code', 'tradedate', 'tclose',
+                                   'isvalid', 'mtime']
+    ret[table_name(stk_code)] = ['comcode', 'inner_code', 'stockcode']
+    return ret
+
+
+def _create_sql(name: str, columns: Sequence[str]) -> List[str]:
+    definitions = ['`{}` {}'.format(c, _KEY_COLUMNS.get(c, _METRIC_TYPE))
+                   for c in columns]
+    if name == table_name(stk_code):
+        indexes = [('stockcode',)]
+    elif 'trd_date' in columns:
+        indexes = [('inner_code', 'trd_date'), ('mtime',)]
+    elif 'tradedate' in columns:
+        indexes = [('inner_code', 'tradedate'), ('mtime',)]
+    else:
+        indexes = [('comcode', 'enddate'), ('mtime',)]
+    definitions += ['INDEX `{}_{}` ({})'.format(
+        name, '_'.join(index), ', '.join('`%s`' % c for c in index))
+        for index in indexes]
+    return ['DROP TABLE IF EXISTS `{}`'.format(name),
+            'CREATE TABLE `{}` (\n  {}\n) DEFAULT CHARSET=utf8'.format(
+                name, ',\n  '.join(definitions))]
+
+
+class Stock(object):
+    """one synthetic stock, its rows are generated by its own random seed"""
+
+    def __init__(self, index: int, seed: int):
+        self.index = index
+        if index % 2 == 0:
+            self.stockcode = '{:06d}'.format(index // 2 + 1)
+            self.exchange = 'XSHE'
+        else:
+            self.stockcode = '{:06d}'.format(600000 + index // 2)
+            self.exchange = 'XSHG'
+        self.order_book_id = self.stockcode + '.' + self.exchange
+        self.comcode = 1000000 + index
+        self.inner_code = 2000000 + index
+        self._seed = seed * 1000003 + index
+
+    def _random(self, kind: str) -> random.Random:
+        return random.Random('{}.{}'.format(self._seed, kind))
+
+    def quarter_reports(self, start_year: int, end_year: int) \
+            -> Iterator[Tuple[datetime.date, datetime.date, str, bool]]:
+        """
+        :return: (end date, announce date, report source, is other report
+                 type) of the reports from start_year to end_year
+        """
+        rng = self._random('quarter')
+        for year in range(start_year, end_year + 1):
+            for quarter in range(1, 5):
+                end_date = datetime.datetime.strptime(
+                    str(year) + QUARTER_ENDDATE_MAP[quarter], '%Y%m%d').date()
+                announce_date = end_date + datetime.timedelta(
+                    days=rng.randint(*_ANNOUNCE_LAG[quarter]))
+                yield (end_date, announce_date, RPT_SRC[quarter - 1],
+                       rng.random() < _OTHER_TYPE_RATIO)
+
+    def quarter_rows(self, name: str, columns: Sequence[str], start_year: int,
+                     end_year: int, since: datetime.date,
+                     until: datetime.date) -> Iterator[Tuple]:
+        """rows of quarter table announced in (since, until]"""
+        rng = self._random(name)
+        scale = rng.lognormvariate(20, 1)
+        for end_date, announce_date, rpt_src, other in self.quarter_reports(
+                start_year, end_year):
+            values = [round(scale * rng.uniform(0.2, 1.5), 4)
+                      for _ in columns]
+            if not (since is None or announce_date > since) or \
+                    announce_date > until:
+                continue
+            row = dict(zip(columns, values))
+            row.update({
+                'comcode': self.comcode,
+                'a_stockcode': self.stockcode,
+                'enddate': end_date,
+                'declaredate': announce_date,
+                'rpt_date': end_date,
+                'startdate': datetime.date(end_date.year, 1, 1),
+                'rpt_src': rpt_src,
+                'rpt_type': '母公司' if other else RPT_TYPE,
+                'isvalid': 1,
+                'mtime': datetime.datetime.combine(
+                    announce_date, datetime.time(18)),
+            })
+            yield tuple(row[c] for c in columns)
+
+    def day_rows(self, day_columns: Sequence[str],
+                 trading_dates: Sequence[datetime.date],
+                 since: datetime.date) -> Iterator[Tuple[Tuple, Tuple]]:
+        """
+        :return: (row of ana_stk_val_idx, row of stk_mkt) of trading dates
+                 after since
+        """
+        rng = self._random('day')
+        price = rng.uniform(5, 50)
+        shares = rng.uniform(1e8, 1e10)
+        for date in trading_dates:
+            price = max(0.5, price * (1 + rng.gauss(0, 0.02)))
+            ratios = [round(rng.uniform(1, 60), 4) for _ in day_columns]
+            if since is not None and date <= since:
+                continue
+            mtime = datetime.datetime.combine(date, datetime.time(18))
+            row = dict(zip(day_columns, ratios))
+            for column in _CAP_COLUMNS:
+                row[column] = round(price * shares, 4)
+            row.update({
+                'stockcode': self.stockcode,
+                'trd_date': date,
+                'inner_code': self.inner_code,
+                'isvalid': 1,
+                'mtime': mtime,
+            })
+            yield (tuple(row[c] for c in day_columns),
+                   (self.inner_code, date, round(price, 4), 1, mtime))
+
+
+def trading_dates(start: datetime.date, end: datetime.date) \
+        -> List[datetime.date]:
+    """weekdays between start and end"""
+    ret = []
+    date = start
+    while date <= end:
+        if date.weekday() < 5:
+            ret.append(date)
+        date += datetime.timedelta(days=1)
+    return ret
+
+
+def stocks(conf: Dict) -> List[Stock]:
+    return [Stock(i, conf['seed']) for i in range(conf['stocks'])]
+
+
+def write_instruments(conf: Dict, files: Sequence[str]):
+    """instruments files of stocks, one file for every exchange"""
+    by_exchange = {}
+    for stock in stocks(conf):
+        by_exchange.setdefault(stock.exchange, []).append(stock)
+    for path in files:
+        exchange = os.path.basename(path).split('_')[0]
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, mode='wt', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(_INSTRUMENT_COLUMNS)
+            for stock in by_exchange.get(exchange, ()):
+                writer.writerow((stock.order_book_id, 'S' + stock.stockcode,
+                                 '{}-01-01'.format(conf['start_year'] - 1),
+                                 '0000-00-00'))
+
+
+def _insert(cursor, name: str, columns: Sequence[str], rows: Iterator[Tuple]):
+    sql = 'INSERT INTO `{}` ({}) VALUES ({})'.format(
+        name, ', '.join('`%s`' % c for c in columns),
+        ', '.join(['%s'] * len(columns)))
+    batch = []
+    count = 0
+    for row in rows:
+        batch.append(row)
+        if len(batch) == _INSERT_BATCH:
+            cursor.executemany(sql, batch)
+            count += len(batch)
+            batch = []
+    if len(batch) != 0:
+        cursor.executemany(sql, batch)
+        count += len(batch)
+    return count
+
+
+def _span(conf: Dict) -> Tuple[int, int]:
+    """first and last year of generated data"""
+    return conf['start_year'], conf['start_year'] + conf['years'] - 1
+
+
+def _load(cnx, conf: Dict, since: datetime.date, until: datetime.date):
+    """insert the records of stocks announced or traded in (since, until]"""
+    start_year, end_year = _span(conf)
+    columns = _source_columns()
+    day_columns = columns[table_name(day_fd)]
+    dates = trading_dates(datetime.date(start_year, 1, 1), until)
+    cursor = cnx.cursor()
+    counts = OrderedDict((name, 0) for name in columns)
+    for stock in stocks(conf):
+        for clazz in (Income, Balance, CashFlow, Indicator):
+            name = clazz.name_()
+            counts[name] += _insert(cursor, name, columns[name],
+                                    stock.quarter_rows(
+                                        name, columns[name], start_year,
+                                        end_year + 1, since, until))
+        day_rows = list(stock.day_rows(day_columns, dates, since))
+        counts[table_name(day_fd)] += _insert(
+            cursor, table_name(day_fd), day_columns,
+            (r for r, _ in day_rows))
+        counts[table_name(stk_market)] += _insert(
+            cursor, table_name(stk_market), columns[table_name(stk_market)],
+            (r for _, r in day_rows))
+        cnx.commit()
+    cursor.close()
+    return counts
+
+
+def _source_connect(with_database=True):
+    conf = dict(get_source_confs()[0])
+    if not with_database:
+        conf.pop('database', None)
+    return create_conn(conf)
+
+
+def generate(conf: Dict) -> Dict[str, int]:
+    """
+    create source tables and instruments files, the records are generated
+    until the end of last year.
+
+    :return: number of records of every table
+    """
+    database = get_source_confs()[0]['database']
+    cnx = _source_connect(with_database=False)
+    cursor = cnx.cursor()
+    cursor.execute('CREATE DATABASE IF NOT EXISTS `{}` '
+                   'DEFAULT CHARSET utf8'.format(database))
+    cursor.close()
+    cnx.close()
+
+    cnx = _source_connect()
+    cursor = cnx.cursor()
+    for name, columns in _source_columns().items():
+        for sql in _create_sql(name, columns):
+            cursor.execute(sql)
+    _insert(cursor, table_name(stk_code), ('comcode', 'inner_code',
+                                          'stockcode'),
+            ((s.comcode, s.inner_code, s.stockcode) for s in stocks(conf)))
+    cnx.commit()
+    cursor.close()
+    write_instruments(conf, get_inst_files())
+    counts = _load(cnx, conf, None, datetime.date(_span(conf)[1], 12, 31))
+    cnx.close()
+    return counts
+
+
+def _latest_date(cnx) -> datetime.date:
+    cursor = cnx.cursor()
+    cursor.execute('SELECT MAX(trd_date) FROM `{}`'.format(
+        table_name(day_fd)))
+    ret = cursor.fetchall()[0][0]
+    cursor.close()
+    return ret
+
+
+def advance(conf: Dict, days: int) -> Dict[str, int]:
+    """
+    append the records of next trading days and the reports announced in
+    them, such as the daily delta of pgenius.
+    """
+    cnx = _source_connect()
+    since = _latest_date(cnx)
+    until = since + datetime.timedelta(days=days)
+    counts = _load(cnx, conf, since, until)
+    cnx.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('command', choices=('generate', 'advance'))
+    parser.add_argument('--config', default=DEFAULT_CONFIG)
+    parser.add_argument('--days', type=int, default=5,
+                        help='calendar days appended by advance')
+    args = parser.parse_args()
+    conf = synthetic_conf(init_benchmark(args.config))
+    if args.command == 'generate':
+        counts = generate(conf)
+    else:
+        counts = advance(conf, args.days)
+    for name, count in counts.items():
+        print(datetime.datetime.now(), name, count, 'records.')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,25 @@
+import datetime
+import os
+import time
+import zlib
 import yaml
-from mysql.connector.pooling import PooledMySQLConnection
-from typing import List
+from typing import List, Dict
 
-from fdhandle.conn import create_conn_pool, create_conn
+from mysql.connector.errors import Error, PoolError
+
+from fdhandle.conn import create_conn_pool, create_conn, PooledConnection, \
+    create_sqlite_conn
 
 _config = None
-_src_cnx_pool = None
+# one pool for each source replica
+_src_cnx_pools = None
 _dest_cnx_pool = None
 
+# replica which failed to connect is tried after the others during this seconds
+_REPLICA_RETRY_SECONDS = 30
+# key is replica index, value is the time until which the replica is down
+_src_down_until = {}
+
 
 def _default_conf():
     import os
@@ -18,7 +30,8 @@ class RQConfig:
     def __init__(self, config_file=None):
         if not config_file:
             config_file = _default_conf()
-        self._conf = yaml.load(open(config_file, "rb"))
+        with open(config_file, "rb") as f:
+            self._conf = yaml.safe_load(f)
 
     def get(self, path):
         """
@@ -48,29 +61,134 @@ def _check_inited(func):
     return wrap
 
 
+def _optional_section(path: str, default):
+    """
+    :return: value of optional config path, default if it is missing or
+             has no value.
+    """
+    try:
+        value = _config.get(path)
+    except KeyError:
+        return default
+    return value if value is not None else default
+
+
+@_check_inited
+def get_pool_conf(endpoint: str) -> Dict:
+    """
+    :param endpoint: "source" or "dest"
+    :return: pool settings of endpoint, see pool section in fdhandle.yaml
+    """
+    pool_conf = _optional_section("pool", {})
+    ret = dict(pool_conf.get(endpoint) or {})
+    if 'use_pure' in pool_conf:
+        ret.setdefault('use_pure', pool_conf['use_pure'])
+    return ret
+
+
 @_check_inited
-def get_source_connect() -> PooledMySQLConnection:
-    global _config, _src_cnx_pool
+def get_source_confs() -> List[Dict]:
+    """
+    :return: connection arguments of every source replica, data.source is
+             either one replica or a list of replicas.
+    """
+    global _config
     conf = _config.get("data.source")
+    if isinstance(conf, list):
+        return conf
+    return [conf]
+
+
+def _replica_order(partition, count: int) -> List[int]:
+    # worker indexes are spread evenly, other keys are hashed stably
+    if not isinstance(partition, int):
+        partition = zlib.crc32(str(partition).encode())
+    first = partition % count
+    order = [(first + i) % count for i in range(count)]
+    now = time.time()
+    # replicas which are down are tried last, the order of others is kept.
+    order.sort(key=lambda i: _src_down_until.get(i, 0) > now)
+    return order
+
 
-    if _src_cnx_pool is None:
-        _src_cnx_pool = create_conn_pool(conf, 'src_pool')
-    return _src_cnx_pool.get_connection()
+@_check_inited
+def get_source_connect(partition=None) -> PooledConnection:
+    """
+    get connection of one source replica. The reads of one partition always
+    go to the same replica while it is up, and fail over to the next replica
+    if it can not be connected.
+
+    :param partition: partition of reads, such as index of day worker. If it
+                      is None, current process id is used.
+    """
+    global _src_cnx_pools
+    if _src_cnx_pools is None:
+        pool_conf = get_pool_conf('source')
+        _src_cnx_pools = [
+            create_conn_pool(conf, 'src_pool_%d' % i, pool_conf)
+            for i, conf in enumerate(get_source_confs())]
+
+    if partition is None:
+        partition = os.getpid()
+    error = None
+    for i in _replica_order(partition, len(_src_cnx_pools)):
+        try:
+            cnx = _src_cnx_pools[i].get_connection()
+        except PoolError:
+            raise
+        except Error as e:
+            print(datetime.datetime.now(), 'source replica', i, 'is down:',
+                  e)
+            _src_down_until[i] = time.time() + _REPLICA_RETRY_SECONDS
+            error = e
+            continue
+        _src_down_until.pop(i, None)
+        return cnx
+    raise error
+
+
+@_check_inited
+def get_dest_backend() -> str:
+    """:return: "mysql" or "sqlite", see data.dest in fdhandle.yaml"""
+    global _config
+    return _config.get("data.dest").get("backend", "mysql")
 
 
 @_check_inited
-def get_dest_connect(from_pool=True) -> PooledMySQLConnection:
+def get_dest_connect(from_pool=True) -> PooledConnection:
+    """
+    :return: connection of destination. For sqlite backend, it is a new
+             SQLiteConnection which is closed by close().
+    """
     global _config, _dest_cnx_pool
-    conf = _config.get("data.dest")
+    conf = dict(_config.get("data.dest"))
+    if conf.pop("backend", "mysql") == "sqlite":
+        return create_sqlite_conn(conf)
 
     if from_pool:
         if _dest_cnx_pool is None:
-            _dest_cnx_pool = create_conn_pool(conf, 'dest_pool')
+            _dest_cnx_pool = create_conn_pool(conf, 'dest_pool',
+                                              get_pool_conf('dest'))
         return _dest_cnx_pool.get_connection()
     else:
         return create_conn(conf)
 
 
+@_check_inited
+def set_dest_session(variables: Dict):
+    """
+    set session variables of dest connections checked out from now on, and
+    of the connections of processes forked from now on. It only works for
+    mysql backend.
+    """
+    global _dest_cnx_pool
+    if get_dest_backend() != "mysql":
+        return
+    if _dest_cnx_pool is None:
+        get_dest_connect().close()
+    _dest_cnx_pool.set_session(variables)
+
+
 @_check_inited
 def get_timeslot() -> int:
     global _config
@@ -81,3 +199,48 @@ def get_timeslot() -> int:
 def get_inst_files() -> List:
     global _config
     return _config.get("instruments")
+
+
+@_check_inited
+def get_inst_cache() -> str:
+    return _optional_section("instrument_cache", None)
+
+
+@_check_inited
+def get_progress_conf() -> Dict:
+    return _optional_section("progress", {})
+
+
+@_check_inited
+def get_profile_conf() -> Dict:
+    return _optional_section("profile", {})
+
+
+@_check_inited
+def get_bulk_load_conf() -> Dict:
+    return _optional_section("bulk_load", {})
+
+
+@_check_inited
+def get_snapshot_conf() -> Dict:
+    return _optional_section("snapshot", {})
+
+
+@_check_inited
+def get_rebuild_conf() -> Dict:
+    return _optional_section("rebuild", {})
+
+
+@_check_inited
+def get_job_queue_conf() -> Dict:
+    return _optional_section("job_queue", {})
+
+
+@_check_inited
+def get_supervisor_conf() -> Dict:
+    return _optional_section("supervisor", {})
+
+
+@_check_inited
+def get_divergence_conf() -> Dict:
+    return _optional_section("divergence", {})
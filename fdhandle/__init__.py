@@ -2,6 +2,7 @@ from config import RQConfig, init_with
 
 from .update import update_quarter
 from .recal import update_day
+from .daily import update_day_by_date, update_day_revisions
 
 
 def init(config_path=None):
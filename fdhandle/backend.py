@@ -0,0 +1,212 @@
+import re
+from collections import OrderedDict
+from typing import Dict, Sequence, Tuple
+
+from sqlbuilder.smartsql import Q, Result, Field, FieldList, ExprList, \
+    Insert, Update, Parentheses, Query, SPACE, func
+from sqlbuilder.smartsql.compilers.sqlite import compile as _sqlite_compile
+
+from config import get_dest_backend
+from .metrics import query as mysql_query
+
+# sqlite does not accept table prefix in the columns of INSERT and the SET
+# clause of UPDATE, so these columns are compiled without prefix.
+sqlite_compile = _sqlite_compile.create_child()
+
+
+def _column(field):
+    return field._name if isinstance(field, Field) else field
+
+
+@sqlite_compile.when(Insert)
+def _compile_insert(compile, expr, state):
+    state.sql.append("INSERT ")
+    state.sql.append("INTO ")
+    compile(expr._table, state)
+    state.sql.append(SPACE)
+    compile(Parentheses(FieldList(*[_column(f) for f in expr._fields])),
+            state)
+    if isinstance(expr._values, Query):
+        state.sql.append(SPACE)
+        compile(expr._values, state)
+    else:
+        state.sql.append(" VALUES ")
+        compile(ExprList(*expr._values).join(', '), state)
+    if expr._ignore:
+        state.sql.append(" ON CONFLICT DO NOTHING")
+    elif expr._on_duplicate_key_update:
+        state.sql.append(" ON CONFLICT DO UPDATE SET ")
+        first = True
+        for f, v in expr._on_duplicate_key_update:
+            if first:
+                first = False
+            else:
+                state.sql.append(", ")
+            compile(_column(f), state)
+            state.sql.append(" = ")
+            compile(v, state)
+
+
+@sqlite_compile.when(Update)
+def _compile_update(compile, expr, state):
+    state.sql.append("UPDATE ")
+    compile(expr._table, state)
+    state.sql.append(" SET ")
+    first = True
+    for f, v in zip(expr._fields, expr._values):
+        if first:
+            first = False
+        else:
+            state.sql.append(", ")
+        compile(_column(f), state)
+        state.sql.append(" = ")
+        compile(v, state)
+    if expr._where:
+        state.sql.append(" WHERE ")
+        compile(expr._where, state)
+
+
+class MySQLBackend(object):
+    """mysql destination, the tables are MyISAM tables of sql/*.sql"""
+    name = 'mysql'
+    query = mysql_query
+
+    @staticmethod
+    def create_sql(create_sql: str) -> str:
+        return create_sql
+
+    @staticmethod
+    def inserted(field: Field):
+        """value of field in the inserted record, used by upsert"""
+        return func.VALUES(field)
+
+    @staticmethod
+    def index_columns(cursor, table: str) -> Dict[str, Tuple[str, ...]]:
+        """:return: columns of every index of table, key is index name"""
+        cursor.execute('SHOW INDEX FROM `{}`'.format(table))
+        ret = OrderedDict()
+        for r in sorted(cursor.fetchall(),
+                        key=lambda r: (r['Key_name'], r['Seq_in_index'])):
+            ret[r['Key_name']] = ret.get(r['Key_name'], ()) + \
+                (r['Column_name'],)
+        return ret
+
+    @staticmethod
+    def create_index(cursor, table: str, name: str, columns: Sequence[str]):
+        # index names are unique in one table only
+        cursor.execute(create_index_sql(table, name, columns))
+
+    @staticmethod
+    def table_exists(cursor, table: str) -> bool:
+        cursor.execute('SHOW TABLES LIKE %s', (table,))
+        return len(cursor.fetchall()) != 0
+
+    @staticmethod
+    def rename_tables(cursor, renames: Sequence[Tuple[str, str]]):
+        """rename tables in one atomic statement, renames are (old, new)"""
+        cursor.execute('RENAME TABLE ' + ', '.join(
+            '`{}` TO `{}`'.format(old, new) for old, new in renames))
+
+    @staticmethod
+    def disable_keys(cursor, table: str,
+                     indexes: Sequence[Tuple[str, Sequence[str]]]):
+        """stop updating secondary indexes of table during bulk load"""
+        cursor.execute('ALTER TABLE `{}` DISABLE KEYS'.format(table))
+
+    @staticmethod
+    def enable_keys(cursor, table: str,
+                    indexes: Sequence[Tuple[str, Sequence[str]]]):
+        """rebuild secondary indexes of table after bulk load"""
+        cursor.execute('ALTER TABLE `{}` ENABLE KEYS'.format(table))
+
+
+class SQLiteBackend(object):
+    """
+    embedded sqlite destination in one database file. The mysql table options
+    of sql/*.sql are dropped, and upsert is compiled to ON CONFLICT DO UPDATE
+    which needs sqlite 3.35 or later.
+    """
+    name = 'sqlite'
+    query = Q(result=Result(compile=sqlite_compile))
+
+    _TABLE_OPTIONS = re.compile(r'\)\s*ENGINE\s*=[^;]*;', re.IGNORECASE)
+
+    @classmethod
+    def create_sql(cls, create_sql: str) -> str:
+        return cls._TABLE_OPTIONS.sub(');', create_sql)
+
+    @staticmethod
+    def inserted(field: Field):
+        return Field(_column(field), 'excluded')
+
+    @staticmethod
+    def index_columns(cursor, table: str) -> Dict[str, Tuple[str, ...]]:
+        cursor.execute('PRAGMA index_list(`{}`)'.format(table))
+        ret = OrderedDict()
+        for name in sorted(r['name'] for r in cursor.fetchall()):
+            cursor.execute('PRAGMA index_info(`{}`)'.format(name))
+            ret[name] = tuple(r['name'] for r in sorted(
+                cursor.fetchall(), key=lambda r: r['seqno']))
+        return ret
+
+    @staticmethod
+    def create_index(cursor, table: str, name: str, columns: Sequence[str]):
+        # index names are unique in the whole database, and renamed tables
+        # keep the names of their indexes, so the name may have been taken.
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+        taken = {r['name'] for r in cursor.fetchall()}
+        unique_name, i = name, 1
+        while unique_name in taken:
+            unique_name, i = '{}_{}'.format(name, i), i + 1
+        cursor.execute(create_index_sql(table, unique_name, columns))
+
+    @staticmethod
+    def table_exists(cursor, table: str) -> bool:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                       "AND name = ?", (table,))
+        return len(cursor.fetchall()) != 0
+
+    @staticmethod
+    def rename_tables(cursor, renames: Sequence[Tuple[str, str]]):
+        # atomic if it is executed in the transaction of connection
+        for old, new in renames:
+            cursor.execute('ALTER TABLE `{}` RENAME TO `{}`'.format(old, new))
+
+    @staticmethod
+    def disable_keys(cursor, table: str,
+                     indexes: Sequence[Tuple[str, Sequence[str]]]):
+        # sqlite can not disable indexes, they are dropped and created again.
+        for name, _ in indexes:
+            cursor.execute('DROP INDEX IF EXISTS `{}`'.format(name))
+
+    @classmethod
+    def enable_keys(cls, cursor, table: str,
+                    indexes: Sequence[Tuple[str, Sequence[str]]]):
+        for name, columns in indexes:
+            cls.create_index(cursor, table, name, columns)
+
+
+def create_index_sql(table: str, name: str, columns: Sequence[str]) -> str:
+    return 'CREATE INDEX `{}` ON `{}` ({})'.format(
+        name, table, ', '.join('`{}`'.format(c) for c in columns))
+
+
+_BACKENDS = {
+    MySQLBackend.name: MySQLBackend,
+    SQLiteBackend.name: SQLiteBackend,
+}
+
+
+def dest_backend():
+    """backend of destination, it is chosen by data.dest.backend"""
+    name = get_dest_backend()
+    ret = _BACKENDS.get(name)
+    if ret is None:
+        raise ValueError("unknown destination backend {}, it should be one "
+                         "of {}".format(name, sorted(_BACKENDS)))
+    return ret
+
+
+def dest_query():
+    """query builder compiled by the dialect of destination"""
+    return dest_backend().query
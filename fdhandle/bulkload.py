@@ -0,0 +1,50 @@
+import datetime
+from contextlib import contextmanager
+from typing import Sequence
+
+from sqlbuilder.smartsql import T
+
+from config import get_bulk_load_conf, get_dest_connect, set_dest_session
+from .backend import dest_backend
+from .conn import MySQLDictCursorWrapper
+from .createtable import existing_managed_indexes, managed_indexes
+from .metrics import table_name
+
+
+def _alter_keys(tables: Sequence[str], enable: bool):
+    backend = dest_backend()
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        for table in tables:
+            if enable:
+                print(datetime.datetime.now(), 'rebuild indexes of', table)
+                backend.enable_keys(cursor, table, managed_indexes(table))
+            else:
+                backend.disable_keys(
+                    cursor, table, existing_managed_indexes(cursor, table))
+    connect.close()
+
+
+@contextmanager
+def bulk_load(tables: Sequence[T], enabled=True):
+    """
+    load tables in bulk if enabled is set, such as full build. Secondary
+    indexes of tables are not maintained during the load and are rebuilt at
+    the end, and dest connections checked out during the load use the session
+    variables of bulk_load.session.
+    Primary keys are kept, so duplicated records are still rejected.
+
+    The processes forked in this context inherit the session variables.
+    """
+    if not enabled:
+        yield
+        return
+    names = [table_name(table) for table in tables]
+    variables = get_bulk_load_conf().get('session') or {}
+    _alter_keys(names, enable=False)
+    set_dest_session(variables)
+    try:
+        yield
+    finally:
+        set_dest_session({name: 'DEFAULT' for name in variables})
+        _alter_keys(names, enable=True)
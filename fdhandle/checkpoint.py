@@ -0,0 +1,206 @@
+import datetime
+import json
+from collections import OrderedDict
+from typing import Optional
+
+from sqlbuilder.smartsql import T, func
+
+from config import get_dest_connect
+from .backend import dest_backend
+from .conn import MySQLDictCursorWrapper
+from .createtable import create_quarter_checkpoint
+from .metrics import quarter_checkpoint
+
+# stage of the marker of whole run
+_RUN = 'run'
+# stock of the marker of whole stage or table
+_COMPLETE = ''
+# stock of the state kept by stage between attempts
+_STATE = '@state'
+
+# table states, see table_state()
+COMPLETE = 'complete'
+CHANGED = 'changed'
+PARTIAL = 'partial'
+
+# checkpointed run of current process, None if checkpoints are not used
+_run_id = None
+
+
+def start_run(run_id: Optional[str]):
+    """
+    checkpoint the stages of run_id, so that the run can be resumed by
+    running again with the same run_id. If run_id is None, nothing is
+    checkpointed.
+    """
+    global _run_id
+    _run_id = run_id
+    if run_id is not None:
+        create_quarter_checkpoint()
+
+
+def _put(stage: str, stock: str, data: str = None):
+    dest = dest_backend()
+    record = OrderedDict((
+        (quarter_checkpoint.run_id, _run_id),
+        (quarter_checkpoint.stage, stage),
+        (quarter_checkpoint.stock, stock),
+        (quarter_checkpoint.data, data),
+        (quarter_checkpoint.updated_at, datetime.datetime.now()),
+    ))
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        cursor.execute(*dest.query.fields(*record.keys()).tables(
+            quarter_checkpoint
+        ).insert(
+            values=[list(record.values())],
+            on_duplicate_key_update=OrderedDict(
+                (f, dest.inserted(f)) for f in (quarter_checkpoint.data,
+                                                quarter_checkpoint.updated_at))
+        ))
+    connect.close()
+
+
+def _get(stage: str):
+    """:return: dictionary, key is stock and value is data"""
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        cursor.execute(*dest_backend().query.fields(
+            quarter_checkpoint.stock, quarter_checkpoint.data
+        ).tables(quarter_checkpoint).where(
+            (quarter_checkpoint.run_id == _run_id) &
+            (quarter_checkpoint.stage == stage)
+        ).select())
+        ret = {r['stock']: r['data'] for r in cursor.fetchall()}
+    connect.close()
+    return ret
+
+
+class StageCheckpoint(object):
+    """
+    per-stock progress of one stage of checkpointed run. The stocks marked
+    by mark() are skipped when the run is resumed, and the whole stage is
+    skipped after finish(). Without checkpointed run, nothing is skipped.
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+        rows = _get(stage) if _run_id is not None else {}
+        self.complete = _COMPLETE in rows
+        self._state = rows.pop(_STATE, None)
+        rows.pop(_COMPLETE, None)
+        self._done = set(rows)
+
+    @property
+    def resumed(self) -> bool:
+        """whether the stage was started by previous attempt of the run"""
+        return len(self._done) != 0 or self._state is not None
+
+    def done(self, stock) -> bool:
+        return str(stock) in self._done
+
+    def mark(self, stock):
+        if _run_id is not None:
+            _put(self.stage, str(stock))
+
+    def finish(self):
+        if _run_id is not None:
+            _put(self.stage, _COMPLETE)
+
+    def state(self):
+        """:return: state saved by save_state(), None if it was not saved"""
+        return json.loads(self._state) if self._state is not None else None
+
+    def save_state(self, state):
+        """keep json serializable state of the stage for resumed attempts"""
+        self._state = json.dumps(state)
+        if _run_id is not None:
+            _put(self.stage, _STATE, self._state)
+
+
+def stage_checkpoint(stage: str) -> StageCheckpoint:
+    return StageCheckpoint(stage)
+
+
+def _fingerprint(table_name: str) -> Optional[str]:
+    """
+    aggregates of the keys and announce dates of quarter table, they are
+    changed if the table is rebuilt or modified by others.
+    """
+    table = getattr(T, table_name)
+    backend = dest_backend()
+    connect = get_dest_connect()
+    ret = None
+    with MySQLDictCursorWrapper(connect) as cursor:
+        if backend.table_exists(cursor, table_name):
+            cursor.execute(*backend.query.fields(
+                func.COUNT(table.stockcode).as_('records'),
+                func.SUM(table.end_date).as_('end_date'),
+                func.SUM(table.announce_date).as_('announce_date'),
+                func.SUM(table.announce_to).as_('announce_to'),
+            ).tables(table).select())
+            row = cursor.fetchall()[0]
+            ret = json.dumps([int(row[k] or 0) for k in (
+                'records', 'end_date', 'announce_date', 'announce_to')])
+    connect.close()
+    return ret
+
+
+def table_state(table_name: str) -> str:
+    """
+    :return: COMPLETE if all stages of table were finished and the table has
+             not been changed since then, CHANGED if the table was finished
+             but changed, otherwise PARTIAL.
+    """
+    if _run_id is None:
+        return PARTIAL
+    rows = _get(table_name)
+    if _COMPLETE not in rows:
+        return PARTIAL
+    return COMPLETE if rows[_COMPLETE] == _fingerprint(table_name) \
+        else CHANGED
+
+
+def finish_table(table_name: str):
+    """mark all stages of table as finished with the fingerprint of table"""
+    if _run_id is not None:
+        _put(table_name, _COMPLETE, _fingerprint(table_name))
+
+
+def reset_table(table_name: str):
+    """drop the checkpoints of table and its stages, they are run again"""
+    if _run_id is None:
+        return
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        cursor.execute(*dest_backend().query.tables(quarter_checkpoint).where(
+            (quarter_checkpoint.run_id == _run_id) &
+            ((quarter_checkpoint.stage == table_name) |
+             quarter_checkpoint.stage.startswith(table_name + '.'))
+        ).delete())
+    connect.close()
+
+
+def run_started() -> bool:
+    """whether checkpointed run was attempted before"""
+    if _run_id is None:
+        return False
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        cursor.execute(*dest_backend().query.fields(
+            quarter_checkpoint.stage
+        ).tables(quarter_checkpoint).where(
+            quarter_checkpoint.run_id == _run_id
+        ).limit(1).select())
+        ret = len(cursor.fetchall()) != 0
+    connect.close()
+    return ret
+
+
+def run_complete() -> bool:
+    return _run_id is not None and _COMPLETE in _get(_RUN)
+
+
+def finish_run():
+    if _run_id is not None:
+        _put(_RUN, _COMPLETE)
@@ -5,6 +5,7 @@ _comcode_map = None
 _stockcode_map = None
 _innercode_map = None
 _orderbookid_map = None
+_comcode_orderbookid_map = None
 
 
 def comecode_map():
@@ -37,3 +38,28 @@ def orderbookid_map():
         for inner_code, stockcode in innercodes_map.items():
             _orderbookid_map[stockcodes_map[stockcode]] = inner_code
     return _orderbookid_map
+
+
+def comcode_orderbookid_map():
+    global _comcode_orderbookid_map
+    if not _comcode_orderbookid_map:
+        _comcode_orderbookid_map = {}
+        stockcodes_map = stockcode_map()
+        for comcode, stockcode in comecode_map().items():
+            order_book_id = stockcodes_map.get(stockcode)
+            if not order_book_id:
+                raise ValueError(
+                    "Impossible to get none stockcode from stockcode map")
+            _comcode_orderbookid_map[comcode] = order_book_id
+    return _comcode_orderbookid_map
+
+
+def reset_code_maps():
+    """drop the code maps of current process, such as the shard is changed"""
+    global _comcode_map, _stockcode_map, _innercode_map, _orderbookid_map, \
+        _comcode_orderbookid_map
+    _comcode_map = None
+    _stockcode_map = None
+    _innercode_map = None
+    _orderbookid_map = None
+    _comcode_orderbookid_map = None
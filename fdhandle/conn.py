@@ -1,35 +1,354 @@
+import datetime
+import os
+import queue
+import sqlite3
+import time
+from contextlib import contextmanager, nullcontext
+from decimal import Decimal
 from typing import Dict
 
-from multiprocessing import current_process
-from mysql.connector import pooling, connect
-from mysql.connector.cursor import MySQLCursorDict
+from mysql.connector import connect
+from mysql.connector.errors import Error, PoolError
 
-_cnx_pool = dict()
+# connections inherited from parent process. They are kept but never used or
+# closed in child process, since closing them would also close the sockets
+# still used by parent process.
+_inherited_connections = []
 
 
-def create_conn_pool(conf: Dict, name: str):
-    _pool = pooling.MySQLConnectionPool(pool_name=name,
-                                        pool_size=5,
-                                        buffered=False,
-                                        autocommit=True,
-                                        # raise_on_warnings=True,
-                                        **conf)
-    print(current_process().pid, 'create pool', name)
-    # traceback.print_stack()
-    return _pool
+class PooledConnection(object):
+    """
+    connection checked out from ConnectionPool. It works like the underlying
+    mysql connection, except that close() returns the connection to its pool.
+    """
+
+    def __init__(self, pool, cnx, created, session_version):
+        self._pool = pool
+        self._cnx = cnx
+        self._created = created
+        self._session_version = session_version
+
+    def __getattr__(self, attr):
+        return getattr(self._cnx, attr)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def prepared(self):
+        """whether hot statements run as server-side prepared statements"""
+        return self._pool.prepared
+
+    @staticmethod
+    def transaction():
+        # MyISAM tables are not transactional, every statement is committed
+        # by itself.
+        return nullcontext()
+
+    def close(self):
+        if self._cnx is None:
+            return
+        cnx, self._cnx = self._cnx, None
+        self._pool.put_connection(cnx, self._created, self._session_version)
+
+    def invalidate(self):
+        """close the broken connection instead of returning it to pool"""
+        if self._cnx is None:
+            return
+        cnx, self._cnx = self._cnx, None
+        self._pool.discard_connection(cnx)
+
+
+class ConnectionPool(object):
+    """
+    fork-safe pool of mysql connections of one endpoint.
+
+    - get_connection() waits at most timeout seconds for an idle connection
+      if all size connections are checked out, then raises PoolError.
+    - connections older than recycle seconds are reconnected, and connections
+      idle longer than health_check seconds are pinged before checkout.
+    - if the pool is used in a forked child process, the connections inherited
+      from parent process are abandoned and the pool is rebuilt.
+    - session variables set by set_session() are applied to every connection
+      when it is checked out.
+    """
+
+    def __init__(self, conf: Dict, name: str, size=5, timeout=30,
+                 recycle=3600, health_check=30, use_pure=True,
+                 buffered=False, prepared=True):
+        self._conf = dict(conf)
+        self._name = name
+        self._size = size
+        self._timeout = timeout
+        self._recycle = recycle
+        self._health_check = health_check
+        self._use_pure = use_pure
+        self._buffered = buffered
+        self._prepared = prepared
+        self._session_sql = None
+        self._session_version = 0
+        self._reset()
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def prepared(self):
+        return self._prepared
+
+    def _reset(self):
+        self._pid = os.getpid()
+        # every slot is an idle connection tuple (cnx, created, last_used,
+        # session_version), or None which means the connection has not been
+        # created yet.
+        self._slots = queue.LifoQueue(maxsize=self._size)
+        for _ in range(self._size):
+            self._slots.put(None)
+
+    def _check_fork(self):
+        if self._pid == os.getpid():
+            return
+        while True:
+            try:
+                slot = self._slots.get_nowait()
+            except queue.Empty:
+                break
+            if slot is not None:
+                _inherited_connections.append(slot[0])
+        self._reset()
+
+    def _connect(self):
+        return connect(autocommit=True, buffered=self._buffered,
+                       use_pure=self._use_pure, **self._conf)
+
+    def get_connection(self) -> PooledConnection:
+        self._check_fork()
+        try:
+            slot = self._slots.get(timeout=self._timeout)
+        except queue.Empty:
+            raise PoolError("connection pool {} is exhausted, no idle "
+                            "connection in {} seconds"
+                            .format(self._name, self._timeout))
+        cnx = None
+        try:
+            now = time.time()
+            if slot is not None:
+                cnx, created, last_used, _ = slot
+                if now - created > self._recycle:
+                    self._close(cnx)
+                    slot = None
+                elif now - last_used > self._health_check and \
+                        not cnx.is_connected():
+                    self._close(cnx)
+                    slot = None
+            if slot is None:
+                cnx, created, version = self._connect(), now, -1
+            else:
+                cnx, created, _, version = slot
+            if self._session_sql is not None and \
+                    version != self._session_version:
+                cursor = cnx.cursor()
+                cursor.execute(self._session_sql)
+                cursor.close()
+                version = self._session_version
+            return PooledConnection(self, cnx, created, version)
+        except BaseException:
+            # the connection may be half set up, such as SET SESSION failed.
+            if cnx is not None:
+                self._close(cnx)
+            # give the slot back, otherwise the pool shrinks.
+            self._slots.put(None)
+            raise
+
+    def set_session(self, variables: Dict):
+        """
+        set session variables of the connections checked out from now on, the
+        connections which are being used keep their sessions.
+
+        :param variables: key is variable name, value is integer or "DEFAULT"
+        """
+        assignments = []
+        for name, value in variables.items():
+            if not name.isidentifier() or \
+                    not (isinstance(value, int) or value == 'DEFAULT'):
+                raise ValueError("invalid session variable {} = {}"
+                                 .format(name, value))
+            assignments.append('{} = {}'.format(name, value))
+        self._session_sql = 'SET SESSION ' + ', '.join(assignments) \
+            if len(assignments) != 0 else None
+        self._session_version += 1
+
+    def put_connection(self, cnx, created, session_version):
+        if self._pid != os.getpid():
+            # connection of parent process was closed in child process.
+            return
+        try:
+            if cnx.unread_result:
+                cnx.consume_results()
+            slot = (cnx, created, time.time(), session_version)
+        except Error:
+            self._close(cnx)
+            slot = None
+        self._slots.put(slot)
+
+    def discard_connection(self, cnx):
+        if self._pid != os.getpid():
+            return
+        self._close(cnx)
+        self._slots.put(None)
+
+    @staticmethod
+    def _close(cnx):
+        try:
+            cnx.close()
+        except Error:
+            pass
+
+
+def create_conn_pool(conf: Dict, name: str, pool_conf: Dict = None):
+    """
+    :param conf: connection arguments of mysql.connector
+    :param name: pool name
+    :param pool_conf: pool settings, see pool section in fdhandle.yaml
+    """
+    return ConnectionPool(conf, name, **(pool_conf or {}))
 
 
 def create_conn(conf: Dict):
-    print(conf)
     return connect(**conf)
 
 
-class MySQLDictCursorWrapper(MySQLCursorDict):
-    def __init__(self, connection):
-        super().__init__(connection)
+# decimal and datetime columns are read back as the types returned by mysql
+sqlite3.register_adapter(Decimal, str)
+sqlite3.register_adapter(datetime.datetime, lambda v: v.isoformat(' '))
+sqlite3.register_converter('decimal', lambda v: Decimal(v.decode()))
+sqlite3.register_converter(
+    'datetime', lambda v: datetime.datetime.fromisoformat(v.decode()))
+
+
+class SQLiteCursor(object):
+    """cursor of SQLiteConnection, rows are tuples or dictionaries"""
+
+    def __init__(self, cursor: sqlite3.Cursor, dictionary=False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+        self._columns = ()
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield self._row(row)
+
+    @property
+    def column_names(self):
+        return self._columns
+
+    def _row(self, row):
+        if self._dictionary and row is not None:
+            return dict(zip(self._columns, row))
+        return row
+
+    def _described(self):
+        description = self._cursor.description
+        self._columns = tuple(d[0] for d in description) \
+            if description is not None else ()
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(sql, params)
+        self._described()
+
+    def executemany(self, sql, seq_params):
+        self._cursor.executemany(sql, seq_params)
+        self._described()
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+
+class SQLiteConnection(object):
+    """
+    connection of embedded sqlite destination. It works like mysql connection
+    for the code of destination: statements are autocommitted unless they are
+    executed in transaction(), and the database is in WAL mode so that workers
+    can read while one worker is writing.
+    """
+    # sqlite3 caches compiled statements of every connection by itself
+    prepared = False
+
+    def __init__(self, path: str, timeout=60):
+        self._cnx = sqlite3.connect(path, timeout=timeout,
+                                    isolation_level=None,
+                                    detect_types=sqlite3.PARSE_DECLTYPES)
+        self._cnx.execute('PRAGMA journal_mode=WAL')
+        self._cnx.execute('PRAGMA synchronous=NORMAL')
 
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.close()
+
+    def cursor(self, dictionary=False, **kwargs):
+        return SQLiteCursor(self._cnx.cursor(), dictionary)
+
+    @contextmanager
+    def transaction(self):
+        """
+        execute the statements in this context in one transaction, which is
+        much faster than committing every statement for bulk writes.
+        """
+        if self._cnx.in_transaction:
+            yield
+            return
+        # take write lock at first, so that waiting for other writers is
+        # handled by busy timeout.
+        self._cnx.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self._cnx.rollback()
+            raise
+        self._cnx.commit()
+
+    def close(self):
+        self._cnx.close()
+
+
+def create_sqlite_conn(conf: Dict) -> SQLiteConnection:
+    """:param conf: data.dest of sqlite backend, path is the database file"""
+    return SQLiteConnection(conf['path'], conf.get('timeout', 60))
+
+
+class MySQLDictCursorWrapper(object):
+    """
+    dictionary cursor of connection which can be used as context manager. It
+    works for both pure python and C extension connections, and for
+    SQLiteConnection of sqlite destination.
+    """
+
+    def __init__(self, connection):
+        self._cursor = connection.cursor(dictionary=True)
+
+    def __getattr__(self, attr):
+        return getattr(self._cursor, attr)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._cursor.close()
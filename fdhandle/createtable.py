@@ -1,43 +1,155 @@
 from pkg_resources import resource_filename
 
+from typing import List, Sequence, Tuple
+
 from config import get_dest_connect
+from fdhandle.backend import dest_backend
 from fdhandle.conn import MySQLDictCursorWrapper
+from fdhandle.generation import base_table_name, target_name
+
+# managed secondary indexes, (index name suffix, columns). The primary keys
+# are (stockcode, end_date) and (stockcode, tradedate), these indexes serve
+# the queries of all stocks on one date.
+_QUARTER_INDEXES = (
+    ('announce_date', ('stockcode', 'announce_date')),
+)
+_DAY_INDEXES = (
+    ('tradedate', ('tradedate',)),
+)
+_TABLE_INDEXES = {
+    'research_quarter': _QUARTER_INDEXES,
+    'prepare_quarter': _QUARTER_INDEXES,
+    'strategy_quarter': _QUARTER_INDEXES,
+    'orig_day': _DAY_INDEXES,
+    'recal_day': _DAY_INDEXES,
+}
+
+
+def managed_indexes(table_name: str) -> List[Tuple[str, Sequence[str]]]:
+    """
+    :return: managed indexes of table, index name is prefixed by table name
+             since sqlite index names are unique in the whole database. The
+             shadow and previous tables have the indexes of their live table.
+    """
+    return [('{}_{}'.format(table_name, suffix), columns)
+            for suffix, columns in _TABLE_INDEXES.get(
+                base_table_name(table_name), ())]
+
+
+def existing_managed_indexes(cursor, table_name: str) \
+        -> List[Tuple[str, Sequence[str]]]:
+    """
+    :return: managed indexes which exist on table. They are matched by columns
+             instead of name, since renamed tables keep their index names.
+    """
+    managed = {tuple(columns) for _, columns in managed_indexes(table_name)}
+    return [(name, columns) for name, columns in
+            dest_backend().index_columns(cursor, table_name).items()
+            if columns in managed]
+
+
+def ensure_indexes(table_name: str):
+    """create the managed indexes of table which do not exist"""
+    indexes = managed_indexes(table_name)
+    if len(indexes) == 0:
+        return
+    backend = dest_backend()
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        existing = {columns for _, columns in
+                    existing_managed_indexes(cursor, table_name)}
+        for name, columns in indexes:
+            if tuple(columns) not in existing:
+                print('create index', name, 'on', table_name)
+                backend.create_index(cursor, table_name, name, columns)
+    connect.close()
 
 
 def _create_quarter(quarter_name: str):
     with open(resource_filename("fdhandle", "sql/quarter.sql"),
               mode="rt") as f:
-        create_sql = f.read() % quarter_name
-        connect = get_dest_connect(False)
+        create_sql = dest_backend().create_sql(f.read() % quarter_name)
+        connect = get_dest_connect()
         with MySQLDictCursorWrapper(connect) as cursor:
             cursor.execute(create_sql)
         connect.close()
+    ensure_indexes(quarter_name)
 
 
 def _create_day(day_name: str):
     with open(resource_filename("fdhandle", "sql/day.sql"), mode="rt") as f:
-        create_sql = f.read() % day_name
-        connect = get_dest_connect(False)
+        create_sql = dest_backend().create_sql(f.read() % day_name)
+        connect = get_dest_connect()
+        with MySQLDictCursorWrapper(connect) as cursor:
+            cursor.execute(create_sql)
+        connect.close()
+    ensure_indexes(day_name)
+
+
+def _create_quarter_metrics(table_name: str):
+    with open(resource_filename("fdhandle", "sql/quarter_metrics.sql"),
+              mode="rt") as f:
+        create_sql = dest_backend().create_sql(f.read() % table_name)
+        connect = get_dest_connect()
+        with MySQLDictCursorWrapper(connect) as cursor:
+            cursor.execute(create_sql)
+        connect.close()
+
+
+def _create_state(state_name: str):
+    with open(resource_filename("fdhandle", "sql/watermark.sql"),
+              mode="rt") as f:
+        create_sql = dest_backend().create_sql(f.read() % state_name)
+        connect = get_dest_connect()
+        with MySQLDictCursorWrapper(connect) as cursor:
+            cursor.execute(create_sql)
+        connect.close()
+
+
+def _create_from_sql(sql_file: str, name: str):
+    with open(resource_filename("fdhandle", sql_file), mode="rt") as f:
+        create_sql = dest_backend().create_sql(f.read() % name)
+        connect = get_dest_connect()
         with MySQLDictCursorWrapper(connect) as cursor:
             cursor.execute(create_sql)
         connect.close()
 
 
 def create_research_quarter():
-    _create_quarter("research_quarter")
+    _create_quarter(target_name("research_quarter"))
 
 
 def create_prepare_quarter():
-    _create_quarter("prepare_quarter")
+    _create_quarter(target_name("prepare_quarter"))
 
 
 def create_strategy_quarter():
-    _create_quarter("strategy_quarter")
+    _create_quarter(target_name("strategy_quarter"))
+
+
+def create_strategy_quarter_metrics():
+    _create_quarter_metrics(target_name("strategy_quarter_metrics"))
 
 
 def create_orig_day():
-    _create_day("orig_day")
+    _create_day(target_name("orig_day"))
 
 
 def create_recal_day():
-    _create_day("recal_day")
+    _create_day(target_name("recal_day"))
+
+
+def create_sync_watermark():
+    _create_state("sync_watermark")
+
+
+def create_recal_job():
+    _create_from_sql("sql/job.sql", "recal_job")
+
+
+def create_quarter_checkpoint():
+    _create_from_sql("sql/checkpoint.sql", "quarter_checkpoint")
+
+
+def create_recal_divergence():
+    _create_from_sql("sql/divergence.sql", "recal_divergence")
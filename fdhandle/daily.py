@@ -0,0 +1,480 @@
+import datetime
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+import numpy as np
+from pandas import DataFrame
+
+from config import get_timeslot
+from .backend import dest_query
+from .codemap import orderbookid_map, reset_code_maps
+from .createtable import create_orig_day, create_recal_day, \
+    create_sync_watermark
+from .generation import target
+from .metrics import Day, DAY_COLUMNS, QUARTER_METRICS_COLUMNS, day_fd, \
+    orig_day, query, recal_day, stk_market, strategy_quarter_metrics, \
+    table_name
+from .progress import StageProgress, reset_progress
+from .recal import QuarterMetrics, INSERT_BATCH, insert_day_records, int_date
+from .session import Session, SOURCE, DEST
+from .shard import set_shard, shard_key
+from .stocks import get_orderbookids
+from .update import get_start_date
+from .watermark import load_watermarks, max_mtime, save_watermark
+
+# progress stage name of date-major recalculation
+_DATE_STAGE = 'recal_day.by_date'
+# progress stage name of recalculation of revised source records
+_REVISION_STAGE = 'recal_day.revisions'
+# years of quarter reports preloaded before the first trade date, the
+# straight four quarters of a trade date go back about two years.
+_QUARTER_YEARS = 3
+
+# values of quarter snapshot used by the ratios, see QuarterMetrics.get().
+# annual_net_profit_parent_company is of latest annual report for peg_ratio.
+_SNAPSHOT_COLUMNS = (
+    'straight_net_profit', 'straight_cash_flow_from_operating_activities',
+    'straight_cash_equivalent_inc_net',
+    'latest_cash_flow_from_operating_activities', 'latest_revenue',
+    'latest_operating_revenue', 'latest_net_profit_parent_company',
+    'latest_cash_equivalent_inc_net', 'interest_bearing_debt', 'cash_total',
+    'ebitda', 'net_profit_parent_company', 'book_value_per_share',
+    'annual_net_profit_parent_company',
+)
+# ratios by market_cap / quarter metric, see _four_quarter_metric()
+_FOUR_QUARTER_RATIOS = OrderedDict((
+    ('pe_ratio', 'straight_net_profit'),
+    ('pcf_ratio', 'straight_cash_flow_from_operating_activities'),
+    ('pcf_ratio_1', 'latest_cash_flow_from_operating_activities'),
+    ('pe_ratio_2', 'latest_net_profit_parent_company'),
+    ('pe_ratio_1', 'net_profit_parent_company'),
+    ('pcf_ratio_3', 'straight_cash_equivalent_inc_net'),
+    ('pcf_ratio_2', 'latest_cash_equivalent_inc_net'),
+))
+
+
+def _date(tradedate: int) -> datetime.date:
+    return datetime.datetime.strptime(str(tradedate), '%Y%m%d').date()
+
+
+def _latest_tradedate(session: Session):
+    """latest trade date of orig_day, None if it is empty"""
+    ret = session.fetchone(DEST, *dest_query().fields(
+        orig_day.tradedate
+    ).tables(orig_day).order_by(
+        orig_day.tradedate.desc()
+    ).limit(1).select())
+    return ret.get('tradedate') if ret is not None else None
+
+
+def _day_metrics(session: Session, condition) -> List[Dict]:
+    """
+    day metrics of all stocks in one query.
+
+    :param condition: condition of ana_stk_val_idx, such as a date range
+    """
+    return session.fetchall(SOURCE, *query.fields(
+        day_fd.inner_code, *Day.metrics()
+    ).tables(day_fd).where(
+        Day.filter_conditions_() & condition
+    ).select())
+
+
+def _closing_prices(session: Session, condition) -> Dict:
+    """
+    closing prices of all stocks in one query.
+
+    :param condition: condition of stk_mkt, such as a date range
+    :return: key is (inner code, trade date)
+    """
+    rows = session.fetchall(SOURCE, *query.fields(
+        stk_market.inner_code,
+        stk_market.tradedate,
+        stk_market.tclose
+    ).tables(stk_market).where(
+        (stk_market.isvalid == 1) & condition
+    ).select())
+    return {(r['inner_code'], r['tradedate']): r['tclose'] for r in rows
+            if None not in (r['tradedate'], r['tclose'])}
+
+
+def _quarter_index(session: Session, start: int) -> Dict[str, List[Dict]]:
+    """
+    quarter metrics of all stocks which are visible since start, in one
+    query.
+
+    :return: key is order_book_id, value is its quarter metrics in end_date
+             descending order like recal._quarter_metrics().
+    """
+    since = (start // 10000 - _QUARTER_YEARS) * 10000 + 101
+    rows = session.fetchall(DEST, *dest_query().fields(
+        *[getattr(strategy_quarter_metrics, column)
+          for column in QUARTER_METRICS_COLUMNS]
+    ).tables(strategy_quarter_metrics).where(
+        strategy_quarter_metrics.end_date >= since
+    ).order_by(
+        strategy_quarter_metrics.stockcode,
+        strategy_quarter_metrics.end_date.desc()
+    ).select())
+    ret = {}
+    for row in rows:
+        ret.setdefault(row['stockcode'], []).append(row)
+    return ret
+
+
+def _snapshots(order_book_id: str, reports: List[Dict],
+               tradedates: Iterable[int]) -> Dict[int, Dict]:
+    """
+    quarter snapshots of one stock which are visible at trade dates.
+
+    :return: key is trade date, value has _SNAPSHOT_COLUMNS if they are known
+    """
+    quarter_obj = QuarterMetrics(order_book_id, raw_reports=reports)
+    ret = {}
+    # QuarterMetrics walks trade dates in descending order
+    for tradedate in sorted(set(tradedates), reverse=True):
+        snapshot = quarter_obj.get(tradedate)
+        annual_report = quarter_obj.latest_annual_report(tradedate)
+        if annual_report is not None:
+            snapshot['annual_net_profit_parent_company'] = annual_report.get(
+                'net_profit_parent_company')
+        ret[tradedate] = snapshot
+    return ret
+
+
+def _floats(df: DataFrame, column: str) -> np.ndarray:
+    if column not in df.columns:
+        return np.full(len(df), np.nan)
+    return df[column].astype(float).to_numpy()
+
+
+def _divide(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """a / b rounded like the ratio helpers, NaN if b is missing or zero"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.round(np.where(b != 0, a / b, np.nan), 4)
+
+
+def recal_frame(df: DataFrame) -> DataFrame:
+    """
+    recalculate the ratios of day records of many stocks at once, the same
+    as the ratio helpers of RecalDayMetrics.compute().
+
+    :param df: day metrics with closing price in tclose and the values of
+               quarter snapshot in _SNAPSHOT_COLUMNS, missing value is NaN
+    :return: df with recalculated ratios, missing ratio is NaN
+    """
+    df = df.copy()
+    market_cap = _floats(df, 'market_cap')
+    q = {column: _floats(df, column) for column in _SNAPSHOT_COLUMNS}
+    for ratio, column in _FOUR_QUARTER_RATIOS.items():
+        df[ratio] = _divide(market_cap, q[column])
+
+    revenue = q['latest_revenue']
+    revenue = np.where(np.isnan(revenue) | (revenue == 0),
+                       q['latest_operating_revenue'], revenue)
+    df['ps_ratio'] = _divide(market_cap, revenue)
+
+    ev = np.nan_to_num(_floats(df, 'val_of_stk_right')) + \
+        np.nan_to_num(q['interest_bearing_debt'])
+    df['ev'] = ev
+    df['ev_2'] = ev - np.nan_to_num(q['cash_total'])
+    df['ev_to_ebit'] = _divide(ev, q['ebitda'])
+
+    annual = q['annual_net_profit_parent_company']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.where(
+            annual != 0,
+            (q['latest_net_profit_parent_company'] - annual) / annual * 100,
+            np.nan)
+    df['peg_ratio'] = _divide(df['pe_ratio_2'].to_numpy(), growth)
+
+    # zero book value is missing, the ratio helper fails on it.
+    df['pb_ratio'] = _divide(_floats(df, 'tclose'),
+                             q['book_value_per_share'])
+    return df
+
+
+def _orig_record(record: Dict) -> Dict:
+    """record of orig_day, see RecalDayMetrics._clear_record()"""
+    return {key: value for key, value in record.items() if value is not None}
+
+
+def recalculate(day_metrics: List[Dict], closing_prices: Dict,
+                quarter_index: Dict[str, List[Dict]], stocks: Dict) \
+        -> Tuple[List[Dict], List[Dict]]:
+    """
+    recalculate day metrics of all stocks, no query is executed.
+
+    :param day_metrics: day metrics of all stocks with their inner_code
+    :param closing_prices: key is (inner code, trade date)
+    :param quarter_index: quarter metrics of all stocks, see _quarter_index()
+    :param stocks: map from inner code to order_book_id of the stocks to
+                   recalculate, the other records are skipped.
+    :return: (records of orig_day, records of recal_day)
+    """
+    records = []
+    tradedates = {}
+    for record in day_metrics:
+        record = dict(record)
+        order_book_id = stocks.get(record.pop('inner_code'))
+        if order_book_id is None:
+            continue
+        record['stockcode'] = order_book_id
+        records.append(record)
+        tradedates.setdefault(order_book_id, []).append(
+            int_date(record['tradedate']))
+    if len(records) == 0:
+        return [], []
+
+    inner_codes = {order_book_id: inner_code
+                   for inner_code, order_book_id in stocks.items()}
+    snapshots = {order_book_id: _snapshots(
+        order_book_id, quarter_index.get(order_book_id, []), dates)
+        for order_book_id, dates in tradedates.items()}
+    rows = []
+    orig_records = []
+    for record in records:
+        order_book_id = record['stockcode']
+        tradedate = int_date(record['tradedate'])
+        row = dict(record)
+        row.update(snapshots[order_book_id][tradedate])
+        row['tclose'] = closing_prices.get(
+            (inner_codes[order_book_id], record['tradedate']))
+        row['tradedate'] = tradedate
+        rows.append(row)
+        orig_records.append(_orig_record(dict(record, tradedate=tradedate)))
+
+    df = recal_frame(DataFrame(rows))
+    df = df[list(DAY_COLUMNS)].astype(object)
+    df = df.where(df.notna(), None)
+    return orig_records, df.to_dict('records')
+
+
+def _delete_dates(session: Session, table, order_book_ids: List[str],
+                  start: int, end: int):
+    """delete the records of stocks between start and end"""
+    for i in range(0, len(order_book_ids), INSERT_BATCH):
+        session.execute(DEST, *dest_query().tables(table).where(
+            table.stockcode.in_(tuple(order_book_ids[i:i + INSERT_BATCH])) &
+            (table.tradedate >= start) & (table.tradedate <= end)
+        ).delete())
+
+
+def _stocks() -> Dict:
+    """map from inner code to order_book_id of the stocks of current run"""
+    innercodes = orderbookid_map()
+    return {innercodes[order_book_id]: order_book_id
+            for order_book_id in get_orderbookids()
+            if order_book_id in innercodes}
+
+
+def update_day_by_date(start: int = None, end: int = None,
+                       order_book_ids: List[str] = None) -> int:
+    """
+    recalculate day tables date by date. It is for the daily update of a few
+    trade dates, update_day() is for long history.
+
+    Instead of five queries for every stock, day metrics and closing prices
+    of all stocks between start and end are read by one query each, and the
+    quarter metrics of all stocks by one query of strategy_quarter_metrics.
+    The ratios of all stocks are recalculated together by vectorized
+    arithmetic, and written in one transaction. The records of these dates
+    are replaced, so a date range can be recalculated again.
+
+    The transaction holds only on the sqlite backend. The day tables of mysql
+    are MyISAM, whose transaction() commits every statement by itself, so
+    readers may see the dates missing between the delete and the inserts.
+
+    :param start: first trade date such as 20160104, it is the day after
+                  latest trade date of orig_day if it is None.
+    :param end: last trade date, it is today if it is None.
+    :param order_book_ids: stocks to recalculate, all stocks if it is None.
+    :return: number of records of recal_day which are written.
+    """
+    set_shard(0, 1, order_book_ids)
+    reset_code_maps()
+    stocks = _stocks()
+    create_orig_day()
+    create_recal_day()
+    reset_progress(_DATE_STAGE)
+    progress = StageProgress(_DATE_STAGE, len(stocks))
+
+    with Session() as session:
+        if start is None:
+            latest = _latest_tradedate(session)
+            if latest is None:
+                raise RuntimeError("orig_day is empty, please run "
+                                   "update_day(True) at first.")
+            start = int_date(_date(latest) + datetime.timedelta(days=1))
+        if end is None:
+            end = int_date(datetime.date.today())
+        if start > end:
+            print(datetime.datetime.now(), 'recal_day is up to date',
+                  start, end)
+            return 0
+        print(datetime.datetime.now(), 'recalculate day tables from',
+              start, 'to', end)
+
+        day_metrics = _day_metrics(session, (
+            day_fd.trd_date >= _date(start)) & (day_fd.trd_date <= _date(end)))
+        closing_prices = _closing_prices(session, (
+            stk_market.tradedate >= _date(start)) &
+            (stk_market.tradedate <= _date(end)))
+        quarter_index = _quarter_index(session, start)
+        progress.read(len(day_metrics) + len(closing_prices))
+        orig_records, recal_records = recalculate(
+            day_metrics, closing_prices, quarter_index, stocks)
+
+        with session.transaction(DEST):
+            for table, records in ((target(orig_day), orig_records),
+                                   (target(recal_day), recal_records)):
+                _delete_dates(session, table, sorted(stocks.values()),
+                              start, end)
+                insert_day_records(session, table, records)
+    progress.written(len(orig_records) + len(recal_records))
+    progress.stock_done(len({r['stockcode'] for r in recal_records}))
+    progress.finish()
+    print(datetime.datetime.now(), 'recal_day of', start, 'to', end, ':',
+          len(recal_records), 'records')
+    return len(recal_records)
+
+
+def _key_conditions(keys: Iterable[Tuple], stock_field, date_field) \
+        -> Iterator:
+    """
+    conditions which select exactly the (stock, date) keys by few
+    statements. Keys are grouped by date if there are fewer dates than
+    stocks, such as new trade dates of all stocks, otherwise by stock, such
+    as revised history of a few stocks.
+    """
+    by_stock = {}
+    by_date = {}
+    for stock, date in keys:
+        by_stock.setdefault(stock, set()).add(date)
+        by_date.setdefault(date, set()).add(stock)
+    if len(by_date) < len(by_stock):
+        groups, group_field, in_field = by_date, date_field, stock_field
+    else:
+        groups, group_field, in_field = by_stock, stock_field, date_field
+    for value, values in sorted(groups.items()):
+        values = sorted(values)
+        for i in range(0, len(values), INSERT_BATCH):
+            yield (group_field == value) & \
+                in_field.in_(tuple(values[i:i + INSERT_BATCH]))
+
+
+def _delete_keys(session: Session, table, keys: Set[Tuple[str, int]]):
+    """delete the records of (order_book_id, trade date) keys"""
+    for condition in _key_conditions(keys, table.stockcode, table.tradedate):
+        session.execute(DEST, *dest_query().tables(table).where(
+            condition).delete())
+
+
+def _revised_keys(session: Session, table, inner_code, tradedate, condition) \
+        -> Set[Tuple]:
+    """
+    (inner code, trade date) of source records which are modified under
+    condition. Invalidated records are included, their day records are
+    deleted.
+    """
+    rows = session.fetchall(SOURCE, *query.fields(
+        inner_code.as_('inner_code'), tradedate.as_('tradedate')
+    ).tables(table).where(condition).select())
+    return {(r['inner_code'], r['tradedate']) for r in rows}
+
+
+def update_day_revisions(order_book_ids: List[str] = None) -> int:
+    """
+    capture the records of ana_stk_val_idx and stk_mkt which were revised by
+    the vendor, and recalculate only their (stock, trade date) records of
+    orig_day and recal_day.
+
+    Like ResearchQuarter._update_by_mtime(), the revisions are the records
+    modified since the high-water mark of each source table in
+    sync_watermark, and the mark is moved to the maximum mtime read before
+    the update after the records are written. New trade dates are captured
+    as well. If a table has no high-water mark yet, the records modified in
+    latest timeslot days are captured, or if timeslot is negative, nothing
+    is captured and its mark starts from now, since full rehandle of day
+    tables is update_day(True).
+
+    The revised keys of each day table are deleted and inserted again in one
+    transaction on the sqlite backend. The day tables of mysql are MyISAM,
+    whose transaction() commits every statement by itself, so readers may
+    see the revised keys missing between the delete and the inserts.
+
+    :param order_book_ids: stocks to recalculate, all stocks if it is None.
+    :return: number of revised (stock, trade date) keys.
+    """
+    set_shard(0, 1, order_book_ids)
+    reset_code_maps()
+    stocks = _stocks()
+    create_orig_day()
+    create_recal_day()
+    create_sync_watermark()
+    full_update = get_timeslot() < 0
+    watermarks = load_watermarks()
+    start_date = get_start_date()
+    reset_progress(_REVISION_STAGE)
+    progress = StageProgress(_REVISION_STAGE, len(stocks))
+
+    high_mtimes = {}
+    keys = set()
+    with Session() as session:
+        for table, inner_code, tradedate in (
+                (day_fd, day_fd.inner_code, day_fd.trd_date),
+                (stk_market, stk_market.inner_code, stk_market.tradedate)):
+            name = table_name(table)
+            # unsharded mark also covers the records of this shard
+            low_mtime = watermarks.get(shard_key(name), watermarks.get(name))
+            # fix the upper bound before reading, records modified during
+            # this update will be handled by next update.
+            high_mtime = max_mtime(session.connection(SOURCE), table,
+                                   low_mtime, start_date)
+            high_mtimes[name] = high_mtime
+            if high_mtime is None:
+                print(datetime.datetime.now(), name, 'no change.')
+                continue
+            if low_mtime is not None:
+                condition = table.mtime > low_mtime
+            elif not full_update:
+                condition = table.mtime >= start_date
+            else:
+                print(datetime.datetime.now(), name, 'has no high-water '
+                      'mark, revisions are captured since', high_mtime)
+                continue
+            keys |= _revised_keys(session, table, inner_code, tradedate,
+                                  condition & (table.mtime <= high_mtime))
+        keys = {key for key in keys if key[0] in stocks}
+        print(datetime.datetime.now(), 'revised records of day tables:',
+              len(keys))
+
+        if len(keys) != 0:
+            day_metrics = []
+            for condition in _key_conditions(keys, day_fd.inner_code,
+                                             day_fd.trd_date):
+                day_metrics += _day_metrics(session, condition)
+            closing_prices = {}
+            for condition in _key_conditions(keys, stk_market.inner_code,
+                                             stk_market.tradedate):
+                closing_prices.update(_closing_prices(session, condition))
+            quarter_index = _quarter_index(
+                session, int_date(min(date for _, date in keys)))
+            progress.read(len(day_metrics) + len(closing_prices))
+            orig_records, recal_records = recalculate(
+                day_metrics, closing_prices, quarter_index, stocks)
+
+            revised = {(stocks[inner], int_date(date))
+                       for inner, date in keys}
+            with session.transaction(DEST):
+                for table, records in ((target(orig_day), orig_records),
+                                       (target(recal_day), recal_records)):
+                    _delete_keys(session, table, revised)
+                    insert_day_records(session, table, records)
+            progress.written(len(orig_records) + len(recal_records))
+            progress.stock_done(len({stock for stock, _ in revised}))
+    for name, high_mtime in high_mtimes.items():
+        if high_mtime is not None:
+            save_watermark(shard_key(name), high_mtime)
+    progress.finish()
+    return len(keys)
@@ -0,0 +1,267 @@
+import datetime
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from pandas import DataFrame, concat, merge
+from sqlbuilder.smartsql import T
+
+from config import get_dest_connect, get_divergence_conf
+from .backend import dest_query
+from .conn import MySQLDictCursorWrapper
+from .createtable import create_recal_divergence
+from .metrics import orig_day, recal_day, recal_divergence
+
+# metrics recalculated by update_day, the other columns of recal_day are
+# copied from orig_day.
+RECAL_METRICS = (
+    'pe_ratio', 'pcf_ratio', 'pcf_ratio_1', 'pcf_ratio_2', 'pcf_ratio_3',
+    'ps_ratio', 'pe_ratio_1', 'pe_ratio_2', 'peg_ratio', 'pb_ratio', 'ev',
+    'ev_2', 'ev_to_ebit',
+)
+
+# scopes of the rows of recal_divergence
+METRIC = 'metric'
+STOCK = 'stock'
+DATE = 'date'
+OUTLIER = 'outlier'
+
+# relative differences are counted in log10 bins for quantiles, the bins are
+# 1/_BINS_PER_DECADE decade wide between 10 ** _MIN_EXP and 10 ** _MAX_EXP.
+_MIN_EXP = -8
+_MAX_EXP = 6
+_BINS_PER_DECADE = 20
+_BINS = (_MAX_EXP - _MIN_EXP) * _BINS_PER_DECADE
+_QUANTILES = OrderedDict((('p50', 0.5), ('p90', 0.9), ('p99', 0.99)))
+_COUNTS = ('records', 'diverged', 'missing_orig', 'missing_recal')
+_INSERT_BATCH = 1000
+
+
+def divergence_enabled() -> bool:
+    return bool(get_divergence_conf().get('enabled'))
+
+
+def _stock_batches(batch: int) -> List[Tuple[str, str]]:
+    """ranges of stocks of orig_day and recal_day, batch stocks in one range"""
+    stocks = set()
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        for table in (orig_day, recal_day):
+            cursor.execute(*dest_query().fields(
+                table.stockcode
+            ).tables(table).group_by(table.stockcode).select())
+            stocks.update(r['stockcode'] for r in cursor.fetchall())
+    connect.close()
+    stocks = sorted(stocks)
+    return [(stocks[i], stocks[min(i + batch, len(stocks)) - 1])
+            for i in range(0, len(stocks), batch)]
+
+
+def _read(cursor, table: T, first: str, last: str) -> DataFrame:
+    """records of stocks between first and last in primary key order"""
+    columns = ('stockcode', 'tradedate') + RECAL_METRICS
+    cursor.execute(*dest_query().fields(
+        *[getattr(table, column) for column in columns]
+    ).tables(table).where(
+        (table.stockcode >= first) & (table.stockcode <= last)
+    ).order_by(table.stockcode, table.tradedate).select())
+    ret = DataFrame(cursor.fetchall(), columns=columns)
+    metrics = list(RECAL_METRICS)
+    ret[metrics] = ret[metrics].astype(float)
+    return ret
+
+
+class _MetricDivergence(object):
+    """divergence statistics of one metric, merged batch by batch"""
+
+    def __init__(self, metric: str, top: int):
+        self.metric = metric
+        self._top = top
+        self.counts = dict.fromkeys(_COUNTS, 0)
+        # zero differences are counted apart from the log10 bins
+        self._zeros = 0
+        self._bins = np.zeros(_BINS, dtype=np.int64)
+        self.stocks = None
+        self.dates = None
+        self.outliers = None
+
+    def add(self, df: DataFrame, rtol: float, atol: float):
+        """
+        :param df: merged records of both tables, the metric is in columns
+                   <metric>_orig and <metric>_recal.
+        """
+        orig = df[self.metric + '_orig'].to_numpy()
+        recal = df[self.metric + '_recal'].to_numpy()
+        has_orig = ~np.isnan(orig)
+        has_recal = ~np.isnan(recal)
+        both = has_orig & has_recal
+        diff = np.abs(recal - orig)
+        rel = np.where(both, diff / np.maximum(np.abs(orig), atol), np.nan)
+        flags = DataFrame({
+            'stockcode': df['stockcode'].to_numpy(),
+            'tradedate': df['tradedate'].to_numpy(),
+            'records': 1,
+            'diverged': both & (diff > atol + rtol * np.abs(orig)),
+            'missing_orig': has_recal & ~has_orig,
+            'missing_recal': has_orig & ~has_recal,
+            'max_diff': rel,
+        })
+        for name in _COUNTS:
+            self.counts[name] += int(flags[name].sum())
+
+        rel = rel[both]
+        zeros = rel == 0
+        self._zeros += int(zeros.sum())
+        with np.errstate(divide='ignore'):
+            index = np.floor((np.log10(rel[~zeros]) - _MIN_EXP) *
+                             _BINS_PER_DECADE)
+        self._bins += np.bincount(
+            np.clip(index, 0, _BINS - 1).astype(np.int64),
+            minlength=_BINS)
+
+        aggregation = OrderedDict((name, 'sum') for name in _COUNTS)
+        aggregation['max_diff'] = 'max'
+        # stocks of one batch are not in other batches
+        self.stocks = self._worst(concat([
+            self.stocks, flags.groupby('stockcode').agg(aggregation)]))
+        # dates are in all batches, they are merged and then cut at last
+        dates = flags.groupby('tradedate').agg(aggregation)
+        self.dates = dates if self.dates is None else concat(
+            [self.dates, dates]).groupby(level=0).agg(aggregation)
+        outliers = DataFrame({
+            'stockcode': flags['stockcode'], 'tradedate': flags['tradedate'],
+            'orig_value': orig, 'recal_value': recal,
+            'max_diff': flags['max_diff'],
+        })[both].nlargest(self._top, 'max_diff')
+        self.outliers = outliers if self.outliers is None else concat(
+            [self.outliers, outliers]).nlargest(self._top, 'max_diff')
+
+    def _worst(self, df: DataFrame) -> DataFrame:
+        """the groups which have most diverged or missing values"""
+        df = df[(df['diverged'] + df['missing_orig'] +
+                 df['missing_recal']) != 0]
+        return df.sort_values(['diverged', 'max_diff'],
+                              ascending=False).head(self._top)
+
+    def quantile(self, q: float):
+        """
+        approximate quantile of relative differences, it is the upper edge of
+        the log10 bin of the quantile.
+        """
+        total = self._zeros + int(self._bins.sum())
+        if total == 0:
+            return None
+        rank = q * total
+        if rank <= self._zeros:
+            return 0.0
+        index = int(np.searchsorted(np.cumsum(self._bins),
+                                    rank - self._zeros))
+        return float(10 ** (_MIN_EXP + (index + 1) / _BINS_PER_DECADE))
+
+    def rows(self, generated_at) -> List[Dict]:
+        """rows of recal_divergence"""
+        def row(scope, key, values):
+            ret = OrderedDict((
+                ('scope', scope), ('scope_key', str(key)),
+                ('metric', self.metric)))
+            ret.update(values)
+            ret['generated_at'] = generated_at
+            return ret
+
+        summary = dict(self.counts)
+        summary.update((name, self.quantile(q))
+                       for name, q in _QUANTILES.items())
+        if self.outliers is not None and len(self.outliers) != 0:
+            summary.update(self.outliers.iloc[0].to_dict())
+        ret = [row(METRIC, '', summary)]
+        if self.stocks is not None:
+            ret += [row(STOCK, stockcode, values) for stockcode, values
+                    in self.stocks.to_dict('index').items()]
+        if self.dates is not None:
+            ret += [row(DATE, int(tradedate), values) for tradedate, values
+                    in self._worst(self.dates).to_dict('index').items()]
+        if self.outliers is not None:
+            ret += [row(OUTLIER, rank + 1, values) for rank, values
+                    in enumerate(self.outliers.to_dict('records'))]
+        return ret
+
+
+def _value(value):
+    """value stored into recal_divergence, NaN is stored as NULL"""
+    if value is None:
+        return None
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return value
+
+
+def _write(rows: List[Dict]):
+    columns = ('scope', 'scope_key', 'metric') + _COUNTS + \
+        tuple(_QUANTILES) + ('max_diff', 'stockcode', 'tradedate',
+                             'orig_value', 'recal_value', 'generated_at')
+    fields = [getattr(recal_divergence, column) for column in columns]
+    query = dest_query()
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor, connect.transaction():
+        # only the report of latest run is kept
+        cursor.execute(*query.tables(recal_divergence).delete())
+        for i in range(0, len(rows), _INSERT_BATCH):
+            cursor.execute(*query.fields(*fields).tables(
+                recal_divergence
+            ).insert(values=[
+                [_value(row.get(column)) for column in columns]
+                for row in rows[i:i + _INSERT_BATCH]
+            ]))
+    connect.close()
+
+
+def report_divergence() -> DataFrame:
+    """
+    compare the recalculated metrics of recal_day with the vendor values of
+    orig_day, and write the statistics into recal_divergence table:
+
+    metric: counts and approximate quantiles of relative differences of every
+            metric, with its largest outlier
+    stock, date: the divergence.top stocks and dates which have most diverged
+                 records of every metric
+    outlier: the divergence.top records of every metric which have largest
+             relative differences
+
+    Both tables are streamed together in primary key order, batch stocks at
+    a time, so that memory is bounded by one batch. A metric diverges if
+    |recal - orig| > atol + rtol * |orig|, and its relative difference is
+    |recal - orig| / max(|orig|, atol).
+
+    :return: rows of metric scope, one row for every metric.
+    """
+    conf = get_divergence_conf()
+    rtol = float(conf.get('rtol', 1e-4))
+    atol = float(conf.get('atol', 1e-4))
+    top = int(conf.get('top', 20))
+    batches = _stock_batches(int(conf.get('batch', 200)))
+    divergences = [_MetricDivergence(metric, top) for metric in RECAL_METRICS]
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        for first, last in batches:
+            df = merge(_read(cursor, orig_day, first, last),
+                       _read(cursor, recal_day, first, last),
+                       on=['stockcode', 'tradedate'], how='outer',
+                       suffixes=('_orig', '_recal'))
+            for divergence in divergences:
+                divergence.add(df, rtol, atol)
+    connect.close()
+
+    generated_at = datetime.datetime.now()
+    rows = []
+    for divergence in divergences:
+        rows += divergence.rows(generated_at)
+    create_recal_divergence()
+    _write(rows)
+    ret = DataFrame([row for row in rows if row['scope'] == METRIC])
+    print(datetime.datetime.now(), 'divergence of recal_day in',
+          len(batches), 'batches:')
+    print(ret[['metric'] + list(_COUNTS) + list(_QUANTILES)].to_string(
+        index=False))
+    return ret
@@ -0,0 +1,112 @@
+import datetime
+import random
+from typing import Dict, List, Tuple
+
+from .metrics import DAY_COLUMNS, QUARTER_ENDDATE_MAP, RPT_SRC, Income
+
+# comcode of the stock of fixture
+COMCODE = 80000001
+# metrics of strategy_quarter_metrics read by QuarterMetrics
+_QUARTER_METRICS = (
+    'net_profit_parent_company', 'net_profit', 'operating_revenue',
+    'cash_flow_from_operating_activities', 'current_assets', 'cash',
+    'cash_equivalent', 'interest_bearing_debt', 'ebitda', 'revenue',
+    'cash_equivalent_inc_net', 'book_value_per_share',
+)
+
+
+class Fixture(object):
+    """
+    quarter reports and day records of one stock for years years, in the
+    same shapes as they are read from strategy_quarter_metrics,
+    ana_stk_val_idx and the quarter source tables. They are generated from
+    seed, so micro-benchmarks of different commits and tests run on the same
+    data, see benchmarks.micro.
+    """
+
+    def __init__(self, seed: int = 1, years: int = 10,
+                 end_year: int = 2016):
+        rng = random.Random(seed)
+        self.start_year = end_year - years + 1
+        self.end_year = end_year
+        self.reports = self._reports(rng)
+        self.trading_dates = self._trading_dates()
+        self.tradedates = [int(d.strftime('%Y%m%d'))
+                           for d in self.trading_dates]
+        self.day_records = self._day_records(rng)
+        self.closing_prices = {d: round(rng.uniform(5, 50), 2)
+                               for d in self.trading_dates}
+        self.quarter_columns, self.quarter_rows = self._quarter_rows(rng)
+
+    def _reports(self, rng: random.Random) -> List[Dict]:
+        """reports in end_date descending order, some of them are missing"""
+        ret = []
+        for year in range(self.end_year, self.start_year - 1, -1):
+            for quarter in range(4, 0, -1):
+                end_date = datetime.datetime.strptime(
+                    str(year) + QUARTER_ENDDATE_MAP[quarter], '%Y%m%d')
+                announce_date = end_date + datetime.timedelta(
+                    days=rng.randint(20, 100 if quarter == 4 else 55))
+                report = {
+                    'announce_date': int(announce_date.strftime('%Y%m%d')),
+                    'rpt_year': year,
+                    'rpt_quarter': quarter,
+                    'end_date': int(end_date.strftime('%Y%m%d')),
+                }
+                for metric in _QUARTER_METRICS:
+                    report[metric] = None if rng.random() < 0.05 else \
+                        rng.uniform(-1e9, 1e10)
+                ret.append(report)
+        # first and last reports are the range of filled reports
+        return [ret[0]] + [r for r in ret[1:-1] if rng.random() >= 0.1] + \
+            [ret[-1]]
+
+    def _trading_dates(self) -> List[datetime.datetime]:
+        """weekdays in descending order, the same order as day records"""
+        ret = []
+        date = datetime.datetime(self.end_year, 12, 31)
+        while date.year >= self.start_year + 1:
+            if date.weekday() < 5:
+                ret.append(date)
+            date -= datetime.timedelta(days=1)
+        return ret
+
+    def _day_records(self, rng: random.Random) -> List[Dict]:
+        ret = []
+        for date in self.trading_dates:
+            record = {column: rng.uniform(1, 60) for column in DAY_COLUMNS}
+            record['stockcode'] = '000001'
+            record['tradedate'] = date
+            record['market_cap'] = rng.uniform(1e10, 1e11)
+            record['val_of_stk_right'] = rng.uniform(1e10, 1e11)
+            record['dividend_yield'] = None
+            ret.append(record)
+        return ret
+
+    def _quarter_rows(self, rng: random.Random) \
+            -> Tuple[Tuple[str, ...], List[Tuple]]:
+        """rows of the cursor of Income query, a quarter of them are others"""
+        columns = tuple(_column_name(f) for f in Income.metrics())
+        rows = []
+        for report in self.reports:
+            values = {
+                'stockcode': '000001',
+                'comcode': COMCODE if rng.random() < 0.75 else COMCODE + 1,
+                'announce_date': datetime.datetime.strptime(
+                    str(report['announce_date']), '%Y%m%d').date(),
+                'end_date': datetime.datetime.strptime(
+                    str(report['end_date']), '%Y%m%d'),
+                'rpt_src': RPT_SRC[report['rpt_quarter'] - 1],
+            }
+            rows.append(tuple(
+                values[c] if c in values else
+                (0 if rng.random() < 0.2 else rng.uniform(-1e9, 1e10))
+                for c in columns))
+        return columns, rows
+
+
+def _column_name(field) -> str:
+    """column name of a metric in the cursor, it is its alias if any"""
+    if hasattr(field, '_expr'):
+        return field._sql._name
+    return field._name._name
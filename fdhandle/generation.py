@@ -0,0 +1,77 @@
+from typing import Callable, List
+
+from sqlbuilder.smartsql import T
+
+from .metrics import table_name
+
+# suffixes of the shadow table being rebuilt and the previous generation
+NEXT_SUFFIX = '_next'
+PREV_SUFFIX = '_prev'
+
+# names of the destination tables being rebuilt into their shadow tables by
+# current process. Processes forked during the rebuild inherit them.
+_building = set()
+# actions which take effect only if the rebuilt tables are swapped in
+_on_swap = []
+
+
+def next_name(name: str) -> str:
+    return name + NEXT_SUFFIX
+
+
+def prev_name(name: str) -> str:
+    return name + PREV_SUFFIX
+
+
+def base_table_name(name: str) -> str:
+    """name of live table, such as "orig_day" for "orig_day_next"."""
+    for suffix in (NEXT_SUFFIX, PREV_SUFFIX):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def target_name(name: str) -> str:
+    """name of the table which should be written, see target()"""
+    return next_name(name) if name in _building else name
+
+
+def target(table: T) -> T:
+    """
+    table which should be written and read by the pipeline. It is the shadow
+    table if the table is being rebuilt, otherwise the table itself.
+    """
+    name = table_name(table)
+    if name not in _building:
+        return table
+    return getattr(T, next_name(name))
+
+
+def is_building() -> bool:
+    return len(_building) != 0
+
+
+def start_building(names: List[str]):
+    _building.update(names)
+
+
+def stop_building(names: List[str]) -> List[Callable]:
+    """:return: actions registered by on_swap() during the rebuild"""
+    _building.difference_update(names)
+    if is_building():
+        return []
+    actions = list(_on_swap)
+    del _on_swap[:]
+    return actions
+
+
+def on_swap(action: Callable):
+    """
+    run action after the tables being rebuilt are swapped in, such as saving
+    high-water marks of source tables. It is dropped if the rebuild fails, and
+    it is run at once if no table is being rebuilt.
+    """
+    if is_building():
+        _on_swap.append(action)
+    else:
+        action()
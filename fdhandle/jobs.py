@@ -0,0 +1,339 @@
+import datetime
+import os
+import random
+import socket
+import time
+from collections import OrderedDict, namedtuple
+from multiprocessing import Queue, SimpleQueue
+from typing import Dict, Iterable, List
+
+from sqlbuilder.smartsql import func
+
+from config import get_dest_connect, get_job_queue_conf
+from .backend import dest_backend
+from .conn import MySQLDictCursorWrapper
+from .metrics import recal_job
+
+PENDING = 'pending'
+LEASED = 'leased'
+DONE = 'done'
+FAILED = 'failed'
+# event of MemoryJobs, the stock is claimed by a worker
+_CLAIMED = 'claimed'
+
+# number of records inserted by one statement when jobs are enqueued
+_ENQUEUE_BATCH = 1000
+# number of claimable jobs read at one time, one of them is claimed
+_CLAIM_CANDIDATES = 32
+
+# stock which failed permanently, error is its traceback
+DeadLetter = namedtuple('DeadLetter', ('order_book_id', 'error'))
+
+
+def _lease_seconds() -> int:
+    return int(get_job_queue_conf().get('lease', 600))
+
+
+def _owner(pid: int = None) -> str:
+    return '{}:{}'.format(socket.gethostname(),
+                          os.getpid() if pid is None else pid)
+
+
+def enqueue(run_id: str, order_book_ids: Iterable[str]):
+    """
+    add a pending job of every stock to run. The jobs which exist already
+    are kept, so the completed stocks of a restarted run are skipped. The
+    failed jobs are pending again, they are retried by the restarted run.
+    """
+    query = dest_backend().query
+    order_book_ids = list(order_book_ids)
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor, connect.transaction():
+        for i in range(0, len(order_book_ids), _ENQUEUE_BATCH):
+            cursor.execute(*query.fields(
+                recal_job.run_id, recal_job.order_book_id, recal_job.state
+            ).tables(recal_job).insert(
+                values=[(run_id, order_book_id, PENDING) for order_book_id
+                        in order_book_ids[i:i + _ENQUEUE_BATCH]],
+                ignore=True
+            ))
+        cursor.execute(*query.tables(recal_job).where(
+            (recal_job.run_id == run_id) & (recal_job.state == FAILED)
+        ).update(OrderedDict((
+            (recal_job.state, PENDING),
+            (recal_job.attempts, 0),
+        ))))
+    connect.close()
+
+
+def job_stats(run_id: str) -> Dict[str, Dict]:
+    """:return: key is job state, value is number of jobs and records"""
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        cursor.execute(*dest_backend().query.fields(
+            recal_job.state,
+            func.COUNT(recal_job.order_book_id).as_('jobs'),
+            func.SUM(recal_job.records).as_('records'),
+        ).tables(recal_job).where(
+            recal_job.run_id == run_id
+        ).group_by(recal_job.state).select())
+        ret = OrderedDict(
+            (r['state'], {'jobs': int(r['jobs']),
+                          'records': int(r['records'] or 0)})
+            for r in cursor.fetchall())
+    connect.close()
+    return ret
+
+
+class JobQueue(object):
+    """
+    per-stock jobs of one run in recal_job table, workers on any host claim
+    the stocks of the same run by its run_id.
+
+    A claimed job is leased to its worker for job_queue.lease seconds. If the
+    worker dies, the job is claimed again by another worker after the lease
+    expires. Leases are compared with the clocks of hosts, so the lease should
+    be much longer than the clock difference between hosts. The jobs of a
+    worker which died on this host are released at once, see release().
+
+    A claimed stock may have been written partly by an expired lease, a dead
+    worker or a run with the same run_id, so every claimed stock replaces its
+    records, see reclaimed().
+    """
+
+    def __init__(self, run_id: str):
+        self.run_id = run_id
+
+    def _claimable(self, now):
+        return (recal_job.run_id == self.run_id) & (
+            (recal_job.state == PENDING) |
+            ((recal_job.state == LEASED) & (recal_job.lease_until < now)))
+
+    def get(self):
+        """
+        claim one job.
+
+        :return: order_book_id of the claimed job, None if no job is left.
+        """
+        query = dest_backend().query
+        owner = _owner()
+        connect = get_dest_connect()
+        try:
+            with MySQLDictCursorWrapper(connect) as cursor:
+                while True:
+                    now = datetime.datetime.now()
+                    cursor.execute(*query.fields(
+                        recal_job.order_book_id
+                    ).tables(recal_job).where(
+                        self._claimable(now)
+                    ).limit(_CLAIM_CANDIDATES).select())
+                    candidates = [r['order_book_id']
+                                  for r in cursor.fetchall()]
+                    if len(candidates) == 0:
+                        return None
+                    # workers start from different candidates to avoid
+                    # claiming the same job.
+                    random.shuffle(candidates)
+                    lease_until = now + datetime.timedelta(
+                        seconds=_lease_seconds())
+                    for order_book_id in candidates:
+                        # claimed only if it is still claimable
+                        cursor.execute(*query.tables(recal_job).where(
+                            self._claimable(now) &
+                            (recal_job.order_book_id == order_book_id)
+                        ).update(OrderedDict((
+                            (recal_job.state, LEASED),
+                            (recal_job.owner, owner),
+                            (recal_job.lease_until, lease_until),
+                            (recal_job.attempts, recal_job.attempts + 1),
+                            (recal_job.started_at, now),
+                        ))))
+                        if cursor.rowcount == 1:
+                            return order_book_id
+        finally:
+            connect.close()
+
+    def complete(self, order_book_id: str, records: int):
+        """mark the job claimed by current process as done"""
+        connect = get_dest_connect()
+        with MySQLDictCursorWrapper(connect) as cursor:
+            cursor.execute(*dest_backend().query.tables(recal_job).where(
+                (recal_job.run_id == self.run_id) &
+                (recal_job.order_book_id == order_book_id) &
+                (recal_job.owner == _owner())
+            ).update(OrderedDict((
+                (recal_job.state, DONE),
+                (recal_job.records, records),
+                (recal_job.finished_at, datetime.datetime.now()),
+            ))))
+            if cursor.rowcount != 1:
+                # the lease expired and the job was claimed by another worker,
+                # which replaces the records written by current process.
+                print(datetime.datetime.now(), 'job', self.run_id,
+                      order_book_id, 'was claimed by another worker.')
+        connect.close()
+
+    @staticmethod
+    def reclaimed(order_book_id: str) -> bool:
+        """
+        whether the records of the stock claimed by current process may have
+        been written by an earlier claim, then they should be replaced.
+        """
+        return True
+
+    def fail(self, order_book_id: str, error: str):
+        """dead-letter the job claimed by current process"""
+        connect = get_dest_connect()
+        with MySQLDictCursorWrapper(connect) as cursor:
+            cursor.execute(*dest_backend().query.tables(recal_job).where(
+                (recal_job.run_id == self.run_id) &
+                (recal_job.order_book_id == order_book_id) &
+                (recal_job.owner == _owner())
+            ).update(OrderedDict((
+                (recal_job.state, FAILED),
+                (recal_job.error, error),
+                (recal_job.finished_at, datetime.datetime.now()),
+            ))))
+        connect.close()
+
+    # following methods are called by the supervisor, see supervisor.py
+
+    @staticmethod
+    def poll(timeout: float):
+        time.sleep(timeout)
+
+    def release(self, pid: int, max_crashes: int):
+        """
+        make the jobs leased to dead worker pid of this host claimable again.
+        The jobs which were claimed max_crashes times are dead-lettered.
+        """
+        query = dest_backend().query
+        leased = (recal_job.run_id == self.run_id) & \
+                 (recal_job.state == LEASED) & \
+                 (recal_job.owner == _owner(pid))
+        connect = get_dest_connect()
+        with MySQLDictCursorWrapper(connect) as cursor:
+            cursor.execute(*query.tables(recal_job).where(
+                leased & (recal_job.attempts >= max_crashes)
+            ).update(OrderedDict((
+                (recal_job.state, FAILED),
+                (recal_job.error, 'worker {} died'.format(pid)),
+                (recal_job.finished_at, datetime.datetime.now()),
+            ))))
+            cursor.execute(*query.tables(recal_job).where(leased).update(
+                OrderedDict(((recal_job.state, PENDING),
+                             (recal_job.owner, None)))))
+        connect.close()
+
+    @staticmethod
+    def drained() -> bool:
+        # workers stop by themselves when no job is claimable
+        return False
+
+    @staticmethod
+    def stop(workers: int):
+        pass
+
+    def failures(self) -> List[DeadLetter]:
+        connect = get_dest_connect()
+        with MySQLDictCursorWrapper(connect) as cursor:
+            cursor.execute(*dest_backend().query.fields(
+                recal_job.order_book_id, recal_job.error
+            ).tables(recal_job).where(
+                (recal_job.run_id == self.run_id) &
+                (recal_job.state == FAILED)
+            ).order_by(recal_job.order_book_id).select())
+            ret = [DeadLetter(r['order_book_id'], r['error'])
+                   for r in cursor.fetchall()]
+        connect.close()
+        return ret
+
+    def close(self):
+        pass
+
+
+class MemoryJobs(object):
+    """
+    stocks of update_day in memory queue of current host, which has the same
+    methods as JobQueue. Workers report every claimed, completed and failed
+    stock to the supervisor by events, so that the stocks in flight of a
+    dead worker are put back into the queue by release(). They may have been
+    written partly, so they are marked to replace their records when they are
+    claimed again, see reclaimed().
+    """
+
+    def __init__(self, order_book_ids: Iterable[str]):
+        self._queue = Queue()
+        # written synchronously, so events are not lost if the worker dies
+        self._events = SimpleQueue()
+        # following states are kept by the supervisor
+        self._pending = set()
+        # key is pid of worker, value is the stocks claimed by it
+        self._in_flight = {}
+        # key is order_book_id, value is number of its dead workers
+        self._crashes = {}
+        self._failures = OrderedDict()
+        # stocks released by dead workers and claimed by current process
+        self._reclaimed = set()
+        for order_book_id in order_book_ids:
+            self._pending.add(order_book_id)
+            # item of queue is (order_book_id, released)
+            self._queue.put((order_book_id, False))
+
+    def get(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        order_book_id, released = item
+        if released:
+            self._reclaimed.add(order_book_id)
+        self._events.put((_CLAIMED, order_book_id, os.getpid()))
+        return order_book_id
+
+    def reclaimed(self, order_book_id: str) -> bool:
+        return order_book_id in self._reclaimed
+
+    def complete(self, order_book_id: str, records: int):
+        self._events.put((DONE, order_book_id, os.getpid()))
+
+    def fail(self, order_book_id: str, error: str):
+        self._events.put((FAILED, order_book_id, error))
+
+    def poll(self, timeout: float):
+        """handle the events of workers"""
+        if self._events.empty():
+            time.sleep(timeout)
+        while not self._events.empty():
+            event, order_book_id, value = self._events.get()
+            if event == _CLAIMED:
+                self._in_flight.setdefault(value, set()).add(order_book_id)
+                continue
+            self._pending.discard(order_book_id)
+            if event == FAILED:
+                self._failures[order_book_id] = value
+
+    def release(self, pid: int, max_crashes: int):
+        for order_book_id in sorted(self._in_flight.pop(pid, ())):
+            if order_book_id not in self._pending:
+                continue
+            crashes = self._crashes.get(order_book_id, 0) + 1
+            self._crashes[order_book_id] = crashes
+            if crashes >= max_crashes:
+                self._pending.discard(order_book_id)
+                self._failures[order_book_id] = 'worker {} died'.format(pid)
+            else:
+                self._queue.put((order_book_id, True))
+
+    def drained(self) -> bool:
+        return len(self._pending) == 0
+
+    def stop(self, workers: int):
+        for _ in range(workers):
+            self._queue.put(None)
+
+    def failures(self) -> List[DeadLetter]:
+        return [DeadLetter(order_book_id, error)
+                for order_book_id, error in self._failures.items()]
+
+    def close(self):
+        self._queue.close()
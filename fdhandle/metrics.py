@@ -1,3 +1,5 @@
+from typing import Dict, Sequence, Tuple
+
 from sqlbuilder.smartsql.compilers.mysql import compile as mysql_compile
 from sqlbuilder.smartsql import T, Q, Result
 
@@ -7,8 +9,14 @@ query = Q(result=Result(compile=mysql_compile))
 research_quarter = T.research_quarter
 prepare_quarter = T.prepare_quarter
 strategy_quarter = T.strategy_quarter
+# narrow projection of strategy_quarter read by day-level recalculation
+strategy_quarter_metrics = T.strategy_quarter_metrics
 orig_day = T.orig_day
 recal_day = T.recal_day
+sync_watermark = T.sync_watermark
+recal_job = T.recal_job
+quarter_checkpoint = T.quarter_checkpoint
+recal_divergence = T.recal_divergence
 day_fd = T.ana_stk_val_idx
 balance_sheet = T.stk_bala_gen
 income_statement = T.stk_income_gen
@@ -25,11 +33,106 @@ RPT_TYPE = "合并"
 RPT_SRC = ("第一季度报", "中报", "第三季度报", "年报")
 
 
+# compiled row plans, key is (metrics class, column names)
+_row_plans = {}
+# fields of metrics classes, key is metrics class
+_parsed_metrics = {}
+
+
+def _date_converter(key):
+    def convert(record, value):
+        record[key] = value.year * 10000 + value.month * 100 + value.day
+    return convert
+
+
+def _end_date_converter(key):
+    def convert(record, value):
+        date = value.year * 10000 + value.month * 100 + value.day
+        record[key] = date
+        record['rpt_year'] = date / 10000
+        record['rpt_quarter'] = (date % 10000) / 300
+    return convert
+
+
+def _raw_converter(key):
+    def convert(record, value):
+        record[key] = value
+    return convert
+
+
+def _float_converter(key):
+    def convert(record, value):
+        record[key] = float(value)
+    return convert
+
+
+class RowPlan(object):
+    """
+    transform plan of quarter-level source rows. It is compiled once from the
+    column names of cursor, and then cleans each row by tuple index.
+
+    The cleaned record does not contain None or zero value, and stockcode is
+    from comcode, not from query record.
+    """
+
+    def __init__(self, columns: Sequence[str]):
+        self.columns = tuple(columns)
+        self._comcode_index = None
+        self._converters = []
+        for index, column in enumerate(self.columns):
+            if column == 'stockcode':
+                continue
+            elif column == 'comcode':  # comcode must be in query record.
+                self._comcode_index = index
+            elif column == 'rpt_src':
+                self._converters.append((index, _raw_converter(column)))
+            elif column == 'announce_date':
+                self._converters.append((index, _date_converter(column)))
+            elif column == 'end_date':
+                self._converters.append((index, _end_date_converter(column)))
+            else:
+                self._converters.append((index, _float_converter(column)))
+        if self._comcode_index is None:
+            raise ValueError("comcode must be in columns {}".format(columns))
+
+    def __call__(self, row: Tuple, code_map: Dict) -> Dict:
+        """
+        :param row: tuple of values in the same order of columns
+        :param code_map: map from comcode to order_book_id
+        :return: cleaned record, None if its comcode is not in our interesting
+                 instruments.
+        """
+        comcode = row[self._comcode_index]
+        order_book_id = code_map.get(comcode)
+        if not order_book_id:
+            return None
+
+        # zero revenue is skipped as well as other zero value, and
+        # operating_revenue is kept for
+        # http://jira.ricequant.com/browse/ENG-2449
+        record = {'comcode': comcode, 'stockcode': order_book_id}
+        for index, convert in self._converters:
+            value = row[index]
+            if value:
+                convert(record, value)
+        return record
+
+
 class Metrics(object):
     @classmethod
     def metrics(cls):
         return parse_metrics(cls)
 
+    @classmethod
+    def row_plan(cls, columns: Sequence[str]) -> RowPlan:
+        """get transform plan of the columns returned by cursor"""
+        key = (cls, tuple(columns))
+        plan = _row_plans.get(key)
+        if plan is None:
+            plan = RowPlan(columns)
+            _row_plans[key] = plan
+        return plan
+
 
 class Day(Metrics):  # 19
     stock_code = day_fd.stockcode.as_('stockcode')
@@ -61,6 +164,25 @@ class Day(Metrics):  # 19
         return day_fd.isvalid == 1
 
 
+# columns of orig_day and recal_day, the same order as sql/day.sql
+DAY_COLUMNS = (
+    'stockcode', 'tradedate', 'pe_ratio', 'pcf_ratio', 'pb_ratio',
+    'market_cap', 'market_cap_2', 'a_share_market_val', 'a_share_market_val_2',
+    'val_of_stk_right', 'ev', 'ev_2', 'ev_to_ebit', 'dividend_yield',
+    'pe_ratio_1', 'pe_ratio_2', 'peg_ratio', 'pcf_ratio_1', 'pcf_ratio_2',
+    'pcf_ratio_3', 'ps_ratio',
+)
+
+# columns of strategy_quarter_metrics, stockcode and end_date are its key.
+QUARTER_METRICS_COLUMNS = (
+    'stockcode', 'end_date', 'announce_date', 'rpt_year', 'rpt_quarter',
+    'net_profit_parent_company', 'net_profit', 'operating_revenue',
+    'cash_flow_from_operating_activities', 'current_assets', 'cash',
+    'cash_equivalent', 'interest_bearing_debt', 'ebitda', 'revenue',
+    'cash_equivalent_inc_net', 'book_value_per_share',
+)
+
+
 class Income(Metrics):  # 49
 
     stock_code = income_statement.a_stockcode.as_('stockcode')
@@ -454,13 +576,22 @@ class Indicator(Metrics):  # 110
         return 'ana_stk_fin_idx'
 
 
+def table_name(table: T) -> str:
+    return table._name._name
+
+
 def parse_metrics(clazz):
+    """fields of metrics class, they are parsed only once for each class"""
+    mem_vars = _parsed_metrics.get(clazz)
+    if mem_vars is not None:
+        return mem_vars
     variables = clazz.__dict__
     mem_vars = []
     for var in variables:
         if var.startswith('_') or var.endswith('_'):
             continue
         mem_vars.append(getattr(clazz, var))
+    _parsed_metrics[clazz] = mem_vars
     return mem_vars
 
 
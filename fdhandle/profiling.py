@@ -0,0 +1,151 @@
+import cProfile
+import glob
+import os
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict
+
+from config import get_profile_conf
+
+# profile of one process is named as "<stage>.<pid>.proc.prof", and that of
+# other threads as "<stage>.<pid>.<thread>.proc.prof". Merged profile of one
+# stage is named as "<stage>.prof"
+_PROCESS_SUFFIX = '.proc.prof'
+_MAX_STACK_DEPTH = 64
+_MIN_SECONDS = 1e-6
+
+
+def _profile_dir():
+    conf = get_profile_conf()
+    if not conf.get('enabled'):
+        return None
+    return conf.get('dir') or 'profile'
+
+
+@contextmanager
+def profiled(stage: str, thread: str = None):
+    """
+    profile the code in this context by cProfile if profile.enabled is set, and
+    dump the profile of current process into profile.dir. If
+    profile.tracemalloc is set, the top memory allocations are dumped too.
+
+    cProfile only profiles the thread which enables it, so other threads of
+    the process are profiled by their own profiled(stage, thread) context.
+    Their profiles are merged with the others, and memory is traced by the
+    main thread only.
+
+    :param stage: stage name, the profiles of one stage in all processes can be
+                  merged by merge_profiles.
+    :param thread: name of current thread if it is not the main thread.
+    """
+    profile_dir = _profile_dir()
+    if profile_dir is None:
+        yield
+        return
+
+    os.makedirs(profile_dir, exist_ok=True)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # python 3.12 allows one profiler at a time, which profiles all
+        # threads of the process.
+        yield
+        return
+    trace_memory = thread is None and \
+        get_profile_conf().get('tracemalloc', False)
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        prefix = os.path.join(profile_dir, '{}.{}'.format(stage, os.getpid()))
+        if thread is not None:
+            prefix += '.' + thread
+        profiler.dump_stats(prefix + _PROCESS_SUFFIX)
+        if trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            with open(prefix + '.mem.txt', mode='wt') as f:
+                for stat in snapshot.statistics('lineno')[:50]:
+                    f.write('{}\n'.format(stat))
+
+
+def reset_profiles(stage: str):
+    """remove process profiles of stage left by previous run"""
+    profile_dir = _profile_dir()
+    if profile_dir is None:
+        return
+    for path in glob.glob(os.path.join(profile_dir, glob.escape(stage) +
+                                       '.*' + _PROCESS_SUFFIX)):
+        os.remove(path)
+
+
+def merge_profiles(stage: str):
+    """
+    merge the profiles of stage in all processes into "<stage>.prof", and
+    write collapsed stacks into "<stage>.collapsed" for flame graph tools such
+    as flamegraph.pl or speedscope.
+    """
+    profile_dir = _profile_dir()
+    if profile_dir is None:
+        return
+    files = sorted(glob.glob(os.path.join(profile_dir, glob.escape(stage) +
+                                          '.*' + _PROCESS_SUFFIX)))
+    if len(files) == 0:
+        return
+    stats = pstats.Stats(*files)
+    prefix = os.path.join(profile_dir, stage)
+    stats.dump_stats(prefix + '.prof')
+    with open(prefix + '.collapsed', mode='wt') as f:
+        for stack, microseconds in sorted(collapsed_stacks(stats).items()):
+            f.write('{} {}\n'.format(stack, microseconds))
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == '~':  # built-in function
+        return name
+    return '{}:{}:{}'.format(os.path.basename(filename), line, name)
+
+
+def collapsed_stacks(stats: pstats.Stats) -> Dict[str, int]:
+    """
+    approximate call stacks from the caller/callee edges of cProfile. The time
+    of one function is split to its callers in proportion to the cumulative
+    time of each call edge.
+
+    :return: dictionary, key is stack like "main;foo;bar" and value is self
+             time of the stack in microseconds.
+    """
+    raw_stats = stats.stats
+    callees = {}
+    for func, (_, _, _, _, callers) in raw_stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+
+    ret = {}
+
+    def walk(func, weight, path):
+        self_time = raw_stats[func][2]
+        stack = path + (_label(func),)
+        key = ';'.join(stack)
+        ret[key] = ret.get(key, 0) + self_time * weight
+        if len(stack) >= _MAX_STACK_DEPTH:
+            return
+        for callee, edge_time in callees.get(func, []):
+            callee_cum_time = raw_stats[callee][3]
+            # skip recursive calls and the paths too short to show
+            if callee_cum_time <= 0 or weight * edge_time < _MIN_SECONDS or \
+                    _label(callee) in stack:
+                continue
+            # share of callee's time which was spent on this path
+            walk(callee, weight * edge_time / callee_cum_time, stack)
+
+    for func, (_, _, _, _, callers) in raw_stats.items():
+        if len(callers) == 0:
+            walk(func, 1.0, ())
+    return {stack: int(seconds * 1e6) for stack, seconds in ret.items()
+            if int(seconds * 1e6) > 0}
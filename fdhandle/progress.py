@@ -0,0 +1,231 @@
+import datetime
+import glob
+import json
+import os
+import threading
+import time
+from multiprocessing import current_process
+from typing import Dict, List
+
+from config import get_progress_conf
+
+# status file of one worker is named as "<stage>.<pid>.worker.json"
+_WORKER_SUFFIX = '.worker.json'
+_STATUS_FILE = 'status.json'
+_PROM_FILE = 'fdhandle.prom'
+
+_COUNTERS = ('rows_read', 'rows_written', 'stocks_done')
+
+
+def _write_atomic(path: str, content: str):
+    tmp_path = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, mode='wt') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+class StageProgress(object):
+    """
+    progress and throughput of one pipeline stage in current process.
+
+    Every process of a stage has its own StageProgress, which counts rows read,
+    rows written and stocks done, and reports them at most once every interval
+    seconds: it prints one progress line and, if progress.dir is configured,
+    dumps its counters to a worker status file. All worker status files are
+    aggregated into status.json and a Prometheus textfile in the same
+    directory, see aggregate().
+
+    If the stocks of a stage are shared by several worker processes, a worker
+    does not know its share of total, so its line only has its own stocks
+    done, followed by the percentage of the whole stage aggregated from all
+    worker status files if progress.dir is configured.
+    """
+
+    def __init__(self, stage: str, total: int = None, shared: bool = False):
+        """
+        :param stage: stage name, such as "prepare_quarter.import"
+        :param total: total number of stocks of this stage if it is known.
+        :param shared: whether total is shared with workers of other
+                       processes.
+        """
+        conf = get_progress_conf()
+        self._stage = stage
+        self._total = total
+        self._shared = shared
+        self._interval = conf.get('interval', 10)
+        self._status_dir = conf.get('dir')
+        self._worker = '{}-{}'.format(current_process().name,
+                                      current_process().pid)
+
+        self.rows_read = 0
+        self.rows_written = 0
+        self.stocks_done = 0
+        self._started = time.time()
+        self._last_report = self._started
+        self._finished = False
+        # counters may be updated by threads of worker pipeline
+        self._lock = threading.Lock()
+
+        if self._status_dir:
+            os.makedirs(self._status_dir, exist_ok=True)
+            self._report(force=True)
+
+    def read(self, rows=1):
+        with self._lock:
+            self.rows_read += rows
+
+    def written(self, rows=1):
+        with self._lock:
+            self.rows_written += rows
+            self._report()
+
+    def stock_done(self, stocks=1):
+        with self._lock:
+            self.stocks_done += stocks
+            self._report()
+
+    def finish(self):
+        with self._lock:
+            self._finished = True
+            self._report(force=True)
+
+    def snapshot(self) -> Dict:
+        now = time.time()
+        elapsed = max(now - self._started, 1e-6)
+        return {
+            'stage': self._stage,
+            'worker': self._worker,
+            'pid': os.getpid(),
+            'total': self._total,
+            'rows_read': self.rows_read,
+            'rows_written': self.rows_written,
+            'stocks_done': self.stocks_done,
+            'rows_per_second': self.rows_written / elapsed,
+            'started_at': self._started,
+            'updated_at': now,
+            'finished': self._finished,
+        }
+
+    def _report(self, force=False):
+        now = time.time()
+        if not force and now - self._last_report < self._interval:
+            return
+        self._last_report = now
+        snapshot = self.snapshot()
+        stage_done = None
+        if self._status_dir:
+            file_name = '{}.{}{}'.format(self._stage, snapshot['pid'],
+                                         _WORKER_SUFFIX)
+            _write_atomic(os.path.join(self._status_dir, file_name),
+                          json.dumps(snapshot))
+            stage_done = aggregate(self._status_dir)[self._stage][
+                'stocks_done']
+        if not self._total:
+            done = '{} stocks'.format(self.stocks_done)
+        elif not self._shared:
+            done = '{}/{} stocks {:.2f}%'.format(
+                self.stocks_done, self._total,
+                self.stocks_done / self._total * 100)
+        elif stage_done is not None:
+            done = '{} stocks, stage {}/{} stocks {:.2f}%'.format(
+                self.stocks_done, stage_done, self._total,
+                stage_done / self._total * 100)
+        else:
+            done = '{} stocks'.format(self.stocks_done)
+        print('{} {} [{}] {}, read {} rows, written {} rows, {:.1f} rows/s'
+              .format(datetime.datetime.now(), self._stage, self._worker,
+                      done, self.rows_read, self.rows_written,
+                      snapshot['rows_per_second']))
+
+
+def reset_progress(stage: str):
+    """remove worker status files of stage left by previous run"""
+    status_dir = get_progress_conf().get('dir')
+    if not status_dir:
+        return
+    pattern = os.path.join(status_dir, glob.escape(stage) + '.*' +
+                           _WORKER_SUFFIX)
+    for path in glob.glob(pattern):
+        os.remove(path)
+
+
+def start_stage(stage: str, total: int = None) -> StageProgress:
+    """start progress of stage which runs in current process only"""
+    reset_progress(stage)
+    return StageProgress(stage, total)
+
+
+def _load_workers(status_dir: str) -> List[Dict]:
+    ret = []
+    for path in glob.glob(os.path.join(status_dir, '*' + _WORKER_SUFFIX)):
+        try:
+            with open(path, mode='rt') as f:
+                ret.append(json.load(f))
+        except (OSError, ValueError):
+            # the file is being replaced by its worker.
+            continue
+    return ret
+
+
+def aggregate(status_dir: str) -> Dict:
+    """
+    aggregate all worker status files of status_dir by stage, and export them
+    to status.json and Prometheus textfile fdhandle.prom.
+
+    :return: dictionary, key is stage name and value is aggregated counters.
+    """
+    now = time.time()
+    workers = _load_workers(status_dir)
+    stages = {}
+    for worker in workers:
+        stage = stages.setdefault(worker['stage'], {
+            'total': None, 'rows_read': 0, 'rows_written': 0,
+            'stocks_done': 0, 'rows_per_second': 0.0,
+            'started_at': worker['started_at'], 'updated_at': 0,
+            'workers': {},
+        })
+        for counter in _COUNTERS:
+            stage[counter] += worker[counter]
+        if worker['total']:
+            stage['total'] = max(stage['total'] or 0, worker['total'])
+        if not worker['finished']:
+            stage['rows_per_second'] += worker['rows_per_second']
+        stage['started_at'] = min(stage['started_at'], worker['started_at'])
+        stage['updated_at'] = max(stage['updated_at'], worker['updated_at'])
+        stage['workers'][worker['worker']] = {
+            'rows_read': worker['rows_read'],
+            'rows_written': worker['rows_written'],
+            'stocks_done': worker['stocks_done'],
+            'rows_per_second': worker['rows_per_second'],
+            'finished': worker['finished'],
+            # a long idle worker which is not finished may be stalled.
+            'idle_seconds': now - worker['updated_at'],
+        }
+
+    _write_atomic(os.path.join(status_dir, _STATUS_FILE),
+                  json.dumps({'updated_at': now, 'stages': stages},
+                             indent=2, sort_keys=True))
+    _write_atomic(os.path.join(status_dir, _PROM_FILE),
+                  _prometheus_text(stages))
+    return stages
+
+
+def _prometheus_text(stages: Dict) -> str:
+    lines = []
+    metrics = [(counter, counter + '_total', 'counter')
+               for counter in _COUNTERS] + \
+              [('rows_per_second', 'rows_per_second', 'gauge'),
+               ('idle_seconds', 'idle_seconds', 'gauge')]
+    for metric, name, metric_type in metrics:
+        name = 'fdhandle_' + name
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for stage_name, stage in sorted(stages.items()):
+            for worker_name, worker in sorted(stage['workers'].items()):
+                lines.append('{}{{stage="{}",worker="{}"}} {}'.format(
+                    name, stage_name, worker_name, worker[metric]))
+    lines.append('# TYPE fdhandle_stocks_expected gauge')
+    for stage_name, stage in sorted(stages.items()):
+        if stage['total']:
+            lines.append('fdhandle_stocks_expected{{stage="{}"}} {}'.format(
+                stage_name, stage['total']))
+    return '\n'.join(lines) + '\n'
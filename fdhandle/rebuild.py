@@ -0,0 +1,131 @@
+import datetime
+from contextlib import contextmanager
+from typing import Sequence
+
+from sqlbuilder.smartsql import T
+
+from config import get_dest_connect, get_rebuild_conf
+from .backend import dest_backend
+from .conn import MySQLDictCursorWrapper
+from .generation import next_name, prev_name, start_building, stop_building
+from .metrics import table_name
+
+
+def rebuild_enabled() -> bool:
+    return bool(get_rebuild_conf().get('enabled'))
+
+
+def _drop_tables(names: Sequence[str]):
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        for name in names:
+            cursor.execute('DROP TABLE IF EXISTS `{}`'.format(name))
+    connect.close()
+
+
+def _count(cursor, name: str) -> int:
+    cursor.execute('SELECT COUNT(*) AS n FROM `{}`'.format(name))
+    return cursor.fetchall()[0]['n']
+
+
+def _validate(names: Sequence[str]):
+    """
+    check the shadow tables before they are swapped in. The rebuild is
+    rejected if one shadow table is empty or has much fewer records than its
+    live table, which means the rebuild was incomplete.
+    """
+    min_ratio = float(get_rebuild_conf().get('min_ratio', 0.9))
+    backend = dest_backend()
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        for name in names:
+            rebuilt = _count(cursor, next_name(name))
+            live = _count(cursor, name) \
+                if backend.table_exists(cursor, name) else 0
+            print(datetime.datetime.now(), 'rebuilt', name, rebuilt,
+                  'records, live table has', live, 'records.')
+            if rebuilt == 0 or rebuilt < live * min_ratio:
+                raise RuntimeError(
+                    "rebuilt table {} has {} records, but live table has {} "
+                    "records, min_ratio is {}".format(
+                        next_name(name), rebuilt, live, min_ratio))
+    connect.close()
+
+
+def _swap(names: Sequence[str]):
+    """
+    swap the shadow tables in by one atomic rename, the live tables are
+    renamed to their previous generation.
+    """
+    backend = dest_backend()
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        renames = []
+        for name in names:
+            if backend.table_exists(cursor, name):
+                renames.append((name, prev_name(name)))
+            renames.append((next_name(name), name))
+        with connect.transaction():
+            backend.rename_tables(cursor, renames)
+    connect.close()
+
+
+@contextmanager
+def rebuild(tables: Sequence[T], enabled=True, resume=False):
+    """
+    rebuild tables into their shadow tables <table>_next if enabled is set and
+    rebuild.enabled is set, such as full build. The pipeline writes and reads
+    the shadow tables in this context, see generation.target(), and the live
+    tables keep serving readers.
+
+    When the context exits without error, the shadow tables are validated and
+    swapped in together by one atomic rename. The replaced live tables are
+    kept as <table>_prev until next rebuild, see rollback(). If the rebuild
+    fails, the live tables are untouched.
+
+    :param resume: if it is set, the shadow tables left by the failed rebuild
+                   are kept to be resumed, otherwise they are dropped.
+    """
+    if not enabled or not rebuild_enabled():
+        yield
+        return
+    names = [table_name(table) for table in tables]
+    if not resume:
+        _drop_tables([next_name(name) for name in names])
+    start_building(names)
+    try:
+        yield
+        _validate(names)
+    except BaseException:
+        stop_building(names)
+        print(datetime.datetime.now(), 'rebuild of', names,
+              'failed, live tables are kept.')
+        raise
+    actions = stop_building(names)
+    _drop_tables([prev_name(name) for name in names])
+    _swap(names)
+    print(datetime.datetime.now(), 'rebuilt tables', names, 'swapped in.')
+    for action in actions:
+        action()
+
+
+def rollback(tables: Sequence[T]):
+    """
+    swap the previous generation of tables back. The rolled back tables are
+    renamed to <table>_next, they are dropped by next rebuild.
+    """
+    names = [table_name(table) for table in tables]
+    _drop_tables([next_name(name) for name in names])
+    renames = []
+    backend = dest_backend()
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        for name in names:
+            if not backend.table_exists(cursor, prev_name(name)):
+                raise RuntimeError(
+                    "table {} has no previous generation".format(name))
+            renames += [(name, next_name(name)), (prev_name(name), name)]
+        with connect.transaction():
+            backend.rename_tables(cursor, renames)
+    connect.close()
+    print(datetime.datetime.now(), 'tables', names, 'rolled back.')
@@ -1,112 +1,152 @@
 import datetime
+import queue
+import threading
+import traceback
 from typing import List, Dict
 
-from multiprocessing import Queue, Process, Lock
+from multiprocessing import Process
 from pandas import to_datetime
+from sqlbuilder.smartsql import T
 
-from config import get_source_connect, get_dest_connect
+from .backend import dest_query
+from .bulkload import bulk_load
 from .stocks import get_orderbookids
-from .codemap import orderbookid_map
-from .conn import MySQLDictCursorWrapper
-from .createtable import create_orig_day, create_recal_day
-from .metrics import Day, strategy_quarter, QUARTER_ENDDATE_MAP, \
-    stk_market, orig_day, recal_day, day_fd, query
-
-
-def _day_metrics(order_book_id: str, latest_date=None):
+from .codemap import orderbookid_map, reset_code_maps
+from .createtable import create_orig_day, create_recal_day, \
+    create_recal_job
+from .divergence import divergence_enabled, report_divergence
+from .generation import target
+from .jobs import DONE, DeadLetter, JobQueue, MemoryJobs, enqueue, \
+    job_stats
+from .metrics import Day, strategy_quarter_metrics, QUARTER_ENDDATE_MAP, \
+    stk_code, stk_market, orig_day, recal_day, day_fd, query, DAY_COLUMNS, \
+    table_name
+from .profiling import profiled, reset_profiles, merge_profiles
+from .progress import StageProgress, reset_progress
+from .rebuild import rebuild
+from .session import Session, session_scope, SOURCE, DEST
+from .shard import is_sharded, set_shard
+from .snapshot import snapshot_enabled, snapshot, refresh_snapshots
+from .supervisor import report, retry, supervise
+from .templates import Slot, template, insert_template
+
+# progress stage name of day-level recalculation
+_RECAL_STAGE = 'recal_day.recal'
+# maximum number of stocks waiting between two threads of worker pipeline
+_PIPELINE_DEPTH = 4
+# maximum number of records inserted by one statement
+INSERT_BATCH = 1000
+
+
+def int_date(value) -> int:
+    """:return: date or datetime as integer such as 20160104"""
+    return int(value.strftime('%Y%m%d'))
+
+
+def _day_metrics(order_book_id: str, latest_date=None,
+                 session: Session = None):
     innercode = orderbookid_map().get(order_book_id)
     if innercode is None:
         raise RuntimeError("order_book_id %s can not get corresponding inner "
                            "code from pgenius database." % order_book_id)
-
-    condition = (Day.inner_code_ == innercode) & (Day.filter_conditions_())
-    if latest_date is not None:
-        condition &= (day_fd.trd_date > latest_date)
-    src_conn = get_source_connect()
-    with MySQLDictCursorWrapper(src_conn) as cursor:
-        cursor.execute(
-            *query.fields(
-                Day.metrics()
-            ).tables(
-                day_fd
-            ).where(
-                condition
-            ).order_by(
-                Day.trade_date.desc()
-            ).select()
-        )
-        ret = cursor.fetchall()
-    src_conn.close()
-    return ret
-
-
-def _closing_price(order_book_id):
+    if snapshot_enabled():
+        records = snapshot(table_name(day_fd)).records(innercode)
+        if latest_date is not None:
+            records = [r for r in records
+                       if int_date(r['tradedate']) > latest_date]
+        records.sort(key=lambda r: r['tradedate'], reverse=True)
+        return records
+
+    def build():
+        condition = (Day.inner_code_ == Slot('innercode')) & \
+                    (Day.filter_conditions_())
+        if latest_date is not None:
+            condition &= (day_fd.trd_date > Slot('latest_date'))
+        return query.fields(
+            Day.metrics()
+        ).tables(
+            day_fd
+        ).where(
+            condition
+        ).order_by(
+            Day.trade_date.desc()
+        ).select()
+
+    select = template(('day_metrics', latest_date is not None), build)
+    with session_scope(session) as s:
+        return s.fetchall(SOURCE, *select.bind(innercode=innercode,
+                                               latest_date=latest_date),
+                          prepared=True)
+
+
+def _closing_price(order_book_id, session: Session = None):
     innercode = orderbookid_map().get(order_book_id)
     if innercode is None:
         raise RuntimeError("order_book_id %s can not get corresponding inner "
                            "code from pgenius database." % order_book_id)
-    src_conn = get_source_connect()
-    with MySQLDictCursorWrapper(src_conn) as cursor:
-        cursor.execute(
-            *query.fields(
-                stk_market.tradedate,
-                stk_market.tclose
-            ).tables(
-                stk_market
-            ).where(
-                (stk_market.inner_code == innercode) &
-                (stk_market.isvalid == 1)
-            ).order_by(
-                stk_market.tradedate.desc()
-            ).select()
-        )
-        ret = cursor.fetchall()
-    src_conn.close()
-    return ret
+    if snapshot_enabled():
+        records = snapshot(table_name(stk_market)).records(innercode)
+        records.sort(key=lambda r: r['tradedate'], reverse=True)
+        return records
+    select = template('closing_price', lambda: query.fields(
+        stk_market.tradedate,
+        stk_market.tclose
+    ).tables(
+        stk_market
+    ).where(
+        (stk_market.inner_code == Slot('innercode')) &
+        (stk_market.isvalid == 1)
+    ).order_by(
+        stk_market.tradedate.desc()
+    ).select())
+    with session_scope(session) as s:
+        return s.fetchall(SOURCE, *select.bind(innercode=innercode),
+                          prepared=True)
 
 
-def _quarter_metrics(order_book_id: str) -> List[Dict]:
+def _quarter_metrics(order_book_id: str, session: Session = None) \
+        -> List[Dict]:
     """
     get quarter metrics from strategy_quarter since this quarter table has
     filled the missing announce date and removed late announce date records.
+    They are read from its narrow projection strategy_quarter_metrics.
 
     Note: Announce date in quarter record is very important for recalculating
     day-level fundamental metrics which are based on it.
 
     :param order_book_id: string like "000001.XSHE"
+    :param session: session of current worker, if it is None, a temporary
+                    session is used.
     :return: quarter metrics of this stock and result is in end_date descending
              order
     """
-    select_sql, select_param = query.fields(
-        strategy_quarter.announce_date,
-        strategy_quarter.rpt_year,
-        strategy_quarter.rpt_quarter,
-        strategy_quarter.end_date,
+    select = template('quarter_metrics', lambda: dest_query().fields(
+        strategy_quarter_metrics.announce_date,
+        strategy_quarter_metrics.rpt_year,
+        strategy_quarter_metrics.rpt_quarter,
+        strategy_quarter_metrics.end_date,
 
         # metrics
-        strategy_quarter.net_profit_parent_company,
-        strategy_quarter.net_profit,
-        strategy_quarter.operating_revenue,
-        strategy_quarter.cash_flow_from_operating_activities,
-        strategy_quarter.current_assets,
-        strategy_quarter.cash,
-        strategy_quarter.cash_equivalent,
-        strategy_quarter.interest_bearing_debt,
-        strategy_quarter.ebitda,
-        strategy_quarter.revenue,
-        strategy_quarter.cash_equivalent_inc_net,
-        strategy_quarter.book_value_per_share
-    ).tables(strategy_quarter).where(
-        strategy_quarter.stockcode == order_book_id
+        strategy_quarter_metrics.net_profit_parent_company,
+        strategy_quarter_metrics.net_profit,
+        strategy_quarter_metrics.operating_revenue,
+        strategy_quarter_metrics.cash_flow_from_operating_activities,
+        strategy_quarter_metrics.current_assets,
+        strategy_quarter_metrics.cash,
+        strategy_quarter_metrics.cash_equivalent,
+        strategy_quarter_metrics.interest_bearing_debt,
+        strategy_quarter_metrics.ebitda,
+        strategy_quarter_metrics.revenue,
+        strategy_quarter_metrics.cash_equivalent_inc_net,
+        strategy_quarter_metrics.book_value_per_share
+    ).tables(strategy_quarter_metrics).where(
+        strategy_quarter_metrics.stockcode == Slot('order_book_id')
     ).order_by(
-        strategy_quarter.end_date.desc()
-    ).select()
-    src_conn = get_dest_connect()
-    with MySQLDictCursorWrapper(src_conn) as cursor:
-        cursor.execute(select_sql, select_param)
-        ret = cursor.fetchall()
-    src_conn.close()
-    return ret
+        strategy_quarter_metrics.end_date.desc()
+    ).select())
+    with session_scope(session) as s:
+        return s.fetchall(DEST, *select.bind(order_book_id=order_book_id),
+                          prepared=True)
 
 
 def _latest_enddates(tradedate: int):
@@ -132,8 +172,16 @@ def _latest_enddates(tradedate: int):
 
 
 class QuarterMetrics(object):
-    def __init__(self, order_book_id: str):
+    def __init__(self, order_book_id: str, session: Session = None,
+                 raw_reports: List[Dict] = None):
+        """
+        :param raw_reports: quarter metrics of this stock in end_date
+                            descending order, such as preloaded for all
+                            stocks. They are queried if it is None.
+        """
         self._order_book_id = order_book_id
+        self._session = session
+        self._raw_reports = raw_reports
         self._quarter_metrics = self._get_and_fill()
         self._quarter_length = len(self._quarter_metrics)
 
@@ -316,7 +364,9 @@ class QuarterMetrics(object):
         missing quarter report with announce_date and without any metric value.
         """
         filled_reports = []
-        raw_reports = _quarter_metrics(self._order_book_id)
+        raw_reports = self._raw_reports
+        if raw_reports is None:
+            raw_reports = _quarter_metrics(self._order_book_id, self._session)
         raw_length = len(raw_reports)
         if raw_reports is None or raw_length == 0:
             print('Empty quarter metrics for order book id %s' %
@@ -365,16 +415,27 @@ def _four_quarter_metric(record, quarter_metrics, rename_metric, metric_name):
 
 
 class RecalDayMetrics(object):
-    def __init__(self, order_book_id: str):
+    def __init__(self, order_book_id: str, session: Session = None):
+        """
+        :param order_book_id: string like "000001.XSHE"
+        :param session: session of current worker which is used by all queries
+                        and writes of this stock. If it is None, every query
+                        uses a temporary session.
+        """
         self._order_book_id = order_book_id
-        self._quarter_obj = QuarterMetrics(order_book_id)
+        self._session = session
+        self._quarter_obj = QuarterMetrics(order_book_id, session)
+
+    @property
+    def order_book_id(self):
+        return self._order_book_id
 
     def get_day_metrics(self, latest_date):
-        return _day_metrics(self._order_book_id, latest_date)
+        return _day_metrics(self._order_book_id, latest_date, self._session)
 
     def get_closing_prices(self):
         ret = {}
-        results = _closing_price(self._order_book_id)
+        results = _closing_price(self._order_book_id, self._session)
         for result in results:
             tradedate = result.get('tradedate')
             closing_price = result.get('tclose')
@@ -532,21 +593,19 @@ class RecalDayMetrics(object):
             del record['dividend_yield']
 
     def _latest_date(self, table):
-        dest_conn = get_dest_connect()
-        with MySQLDictCursorWrapper(dest_conn) as dest_curosr:
-            dest_curosr.execute(
-                *query.fields(
-                    table.tradedate
-                ).tables(
-                    table
-                ).where(
-                    (table.stockcode == self._order_book_id)
-                ).order_by(
-                    table.tradedate
-                ).limit(1).select()
-            )
-            ret = dest_curosr.fetchone()
-        dest_conn.close()
+        select = template(('latest_date', table_name(table)),
+                          lambda: dest_query().fields(
+                              table.tradedate
+                          ).tables(
+                              table
+                          ).where(
+                              (table.stockcode == Slot('order_book_id'))
+                          ).order_by(
+                              table.tradedate
+                          ).limit(1).select())
+        with session_scope(self._session) as s:
+            ret = s.fetchone(DEST, *select.bind(
+                order_book_id=self._order_book_id), prepared=True)
         return ret.get('tradedate') if ret is not None else None
 
     @staticmethod
@@ -562,79 +621,342 @@ class RecalDayMetrics(object):
             cleared_record[key] = value
         return cleared_record
 
-    def recal(self, first):
+    def fetch(self, first):
+        """
+        query source data of this stock. Quarter metrics have been queried
+        when this object was created.
+
+        :return: (closing prices, day metrics)
+        """
         closing_prices = self.get_closing_prices()
         latest_date = None if first else self._latest_date(orig_day)
-        day_metrics = self.get_day_metrics(latest_date)
-        dest_conn = get_dest_connect()
-        with MySQLDictCursorWrapper(dest_conn) as dest_cursor:
-            for record in day_metrics:
-                record['stockcode'] = self._order_book_id
-                orig_record = self._clear_record(record)
-                dest_cursor.execute(
-                    *query.tables(orig_day).insert(orig_record)
-                )
-                tradedate = record.get('tradedate')
-                trading_date = int(to_datetime(tradedate).strftime('%Y%m%d'))
-                quarter_metrics = self._quarter_obj.get(trading_date)
-                self.pe_ratio(record, quarter_metrics)
-                self.pcf_ratio(record, quarter_metrics)
-                self.pcf_ratio_1(record, quarter_metrics)
-                self.ps_ratio(record, quarter_metrics)
-                self.pe_ratio_2(record, quarter_metrics)
-                self.ev(record, quarter_metrics)
-                self.ev2(record, quarter_metrics)
-                self.ev_to_ebit(record, quarter_metrics)
-                self.pe_ratio_1(record, quarter_metrics)
-                self.peg_ratio(record, quarter_metrics, trading_date)
-                self.pcf_ratio_3(record, quarter_metrics)
-                self.pcf_ratio_2(record, quarter_metrics)
-                self.pb_ratio(record, quarter_metrics,
-                              closing_prices.get(tradedate))
-
-                # remove None value in non-recalculation metrics since None
-                # value can not store it into mongodb.
-                self.market_cap(record)
-                self.market_cap_2(record)
-                self.a_share_market_val(record)
-                self.a_share_market_val_2(record)
-                self.val_of_stk_right(record)
-                self.dividend_yield(record)
-                record['tradedate'] = trading_date
-                dest_cursor.execute(
-                    *query.tables(recal_day).insert(record)
-                )
-        dest_conn.close()
-
-
-def recal_by_stock(i, first, id_queue):
+        return closing_prices, self.get_day_metrics(latest_date)
+
+    def compute(self, closing_prices, day_metrics):
+        """
+        recalculate day metrics, no query is executed.
+
+        :return: (records of orig_day, records of recal_day)
+        """
+        orig_records = []
+        recal_records = []
+        for record in day_metrics:
+            record['stockcode'] = self._order_book_id
+            orig_records.append(self._clear_record(record))
+            tradedate = record.get('tradedate')
+            trading_date = int(to_datetime(tradedate).strftime('%Y%m%d'))
+            quarter_metrics = self._quarter_obj.get(trading_date)
+            self.pe_ratio(record, quarter_metrics)
+            self.pcf_ratio(record, quarter_metrics)
+            self.pcf_ratio_1(record, quarter_metrics)
+            self.ps_ratio(record, quarter_metrics)
+            self.pe_ratio_2(record, quarter_metrics)
+            self.ev(record, quarter_metrics)
+            self.ev2(record, quarter_metrics)
+            self.ev_to_ebit(record, quarter_metrics)
+            self.pe_ratio_1(record, quarter_metrics)
+            self.peg_ratio(record, quarter_metrics, trading_date)
+            self.pcf_ratio_3(record, quarter_metrics)
+            self.pcf_ratio_2(record, quarter_metrics)
+            self.pb_ratio(record, quarter_metrics,
+                          closing_prices.get(tradedate))
+
+            # remove None value in non-recalculation metrics since None
+            # value can not store it into mongodb.
+            self.market_cap(record)
+            self.market_cap_2(record)
+            self.a_share_market_val(record)
+            self.a_share_market_val_2(record)
+            self.val_of_stk_right(record)
+            self.dividend_yield(record)
+            record['tradedate'] = trading_date
+            recal_records.append(record)
+        return orig_records, recal_records
+
+    @staticmethod
+    def write(session: Session, orig_records, recal_records, replace=False):
+        """
+        :param replace: delete the records of the same trading dates at
+                        first, such as writing again after the records were
+                        written partly.
+        """
+        with session.transaction(DEST):
+            for table, records in ((target(orig_day), orig_records),
+                                   (target(recal_day), recal_records)):
+                if replace:
+                    _delete_day_records(session, table, records)
+                insert_day_records(session, table, records)
+
+    def recal(self, first, progress: StageProgress = None):
+        closing_prices, day_metrics = self.fetch(first)
+        if progress is not None:
+            progress.read(len(day_metrics))
+        orig_records, recal_records = self.compute(closing_prices,
+                                                   day_metrics)
+        with session_scope(self._session) as s:
+            self.write(s, orig_records, recal_records)
+        if progress is not None:
+            progress.written(len(orig_records) + len(recal_records))
+
+
+def _delete_day_records(session: Session, table: T, records: List[Dict]):
+    """delete the records of one stock between the dates of records"""
+    if len(records) == 0:
+        return
+    tradedates = [record['tradedate'] for record in records]
+    session.execute(DEST, *dest_query().tables(table).where(
+        (table.stockcode == records[0]['stockcode']) &
+        (table.tradedate >= min(tradedates)) &
+        (table.tradedate <= max(tradedates))
+    ).delete())
+
+
+def insert_day_records(session: Session, table: T, records: List[Dict]):
+    """insert records into orig_day or recal_day in batches"""
+    if len(records) == 0:
+        return
+    # missing metric is stored as NULL, the same as omitting it.
+    insert_sql = insert_template(table, DAY_COLUMNS)
+    for i in range(0, len(records), INSERT_BATCH):
+        session.executemany(DEST, insert_sql, [
+            tuple(record.get(column) for column in DAY_COLUMNS)
+            for record in records[i:i + INSERT_BATCH]
+        ])
+
+
+class _PipelineThread(threading.Thread):
+    """
+    thread of worker pipeline which keeps its exception for main thread. It
+    is profiled by its own profiler, see profiling.profiled().
+    """
+
+    def __init__(self, target, name, stage):
+        super().__init__(name=name, daemon=True)
+        self._run_target = target
+        self._stage = stage
+        self.error = None
+
+    def run(self):
+        try:
+            with profiled(self._stage, self.name):
+                self._run_target()
+        except BaseException as e:
+            self.error = e
+
+
+class _PipelineMain(object):
+    """main thread of worker pipeline as it is seen by the other threads"""
+
+    def __init__(self):
+        self.name = threading.current_thread().name
+        self.error = None
+        self.stopped = False
+
+    def is_alive(self):
+        return not self.stopped
+
+
+def _check_peer(peer):
+    """raise if the thread at the other end of a pipe is gone"""
+    if peer.error is not None:
+        raise peer.error
+    if not peer.is_alive():
+        raise RuntimeError("pipeline thread {} stopped".format(peer.name))
+
+
+def _pipeline_put(pipe: queue.Queue, item, consumer):
     while True:
-        order_book_id = id_queue.get()
-        print(datetime.datetime.now(), 'handle ', order_book_id)
-        if order_book_id is None:
-            break
-        recal_obj = RecalDayMetrics(order_book_id)
-        recal_obj.recal(first)
-
-
-def update_day(first=False):
-    create_orig_day()
-    create_recal_day()
-    orderbookid_queue = Queue()
-
-    process_num = 5
-    workers = [
-        Process(target=recal_by_stock, args=(i, first, orderbookid_queue,))
-        for i in range(process_num)]
-    for worker in workers:
-        worker.start()
-
-    for order_book_id in get_orderbookids():
-        orderbookid_queue.put(order_book_id)
-
-    for _ in workers:
-        orderbookid_queue.put(None)
-
-    for worker in workers:
-        worker.join()
-    orderbookid_queue.close()
+        _check_peer(consumer)
+        try:
+            pipe.put(item, timeout=1)
+            return
+        except queue.Full:
+            continue
+
+
+def _pipeline_get(pipe: queue.Queue, producer):
+    while True:
+        try:
+            return pipe.get(timeout=1)
+        except queue.Empty:
+            _check_peer(producer)
+
+
+def _dead_letter(jobs, order_book_id: str, progress: StageProgress):
+    """put the stock failed by current exception into the dead letters"""
+    error = traceback.format_exc()
+    print(datetime.datetime.now(), 'stock', order_book_id, 'failed:',
+          error.strip().splitlines()[-1])
+    jobs.fail(order_book_id, error)
+    progress.stock_done()
+
+
+def _write_job(session: Session, jobs, order_book_id: str,
+               orig_records: List[Dict], recal_records: List[Dict]):
+    """
+    write the records of a claimed stock, retried after transient database
+    errors. The records written partly by an earlier attempt or claim of the
+    stock are replaced, see JobQueue.reclaimed().
+    """
+    reclaimed = jobs.reclaimed(order_book_id)
+    retry(lambda attempt: RecalDayMetrics.write(
+        session, orig_records, recal_records,
+        replace=reclaimed or attempt != 0
+    ), 'write of ' + order_book_id)
+
+
+def recal_by_stock(i, first, jobs, total=None):
+    """
+    worker of update_day, it handles the stocks of jobs until jobs.get()
+    returns None, see JobQueue and MemoryJobs. The stocks are handled by a
+    pipeline of three threads, so that waiting on mysql and recalculating are
+    overlapped:
+
+    fetch thread: prefetches source data of next stocks
+    main thread: recalculates day metrics
+    write thread: writes records into orig_day and recal_day
+
+    The fetch thread and the write thread have their own sessions, and the
+    queues between them are bounded by _PIPELINE_DEPTH stocks. Source reads of
+    worker i go to the source replica of partition i.
+
+    Reads and writes of one stock are retried after transient database
+    errors, see supervisor.retry(). A stock which still fails is
+    dead-lettered by jobs.fail() and the worker goes on with next stock.
+    """
+    progress = StageProgress(_RECAL_STAGE, total, shared=True)
+    main = _PipelineMain()
+    fetched = queue.Queue(maxsize=_PIPELINE_DEPTH)
+    computed = queue.Queue(maxsize=_PIPELINE_DEPTH)
+
+    def fetch():
+        with Session(partition=i) as session:
+            while True:
+                order_book_id = jobs.get()
+                if order_book_id is None:
+                    break
+
+                def fetch_stock(attempt):
+                    recal_obj = RecalDayMetrics(order_book_id, session)
+                    return recal_obj, recal_obj.fetch(first)
+
+                try:
+                    item = retry(fetch_stock, 'fetch of ' + order_book_id)
+                except Exception:
+                    _dead_letter(jobs, order_book_id, progress)
+                    continue
+                _pipeline_put(fetched, item, main)
+        _pipeline_put(fetched, None, main)
+
+    def write():
+        with Session() as session:
+            while True:
+                item = _pipeline_get(computed, main)
+                if item is None:
+                    break
+                order_book_id, (orig_records, recal_records) = item
+                try:
+                    _write_job(session, jobs, order_book_id, orig_records,
+                               recal_records)
+                except Exception:
+                    _dead_letter(jobs, order_book_id, progress)
+                    continue
+                records = len(orig_records) + len(recal_records)
+                jobs.complete(order_book_id, records)
+                progress.written(records)
+                progress.stock_done()
+
+    with profiled(_RECAL_STAGE):
+        fetcher = _PipelineThread(fetch, 'fetch-%d' % i, _RECAL_STAGE)
+        writer = _PipelineThread(write, 'write-%d' % i, _RECAL_STAGE)
+        fetcher.start()
+        writer.start()
+        try:
+            while True:
+                item = _pipeline_get(fetched, fetcher)
+                if item is None:
+                    break
+                recal_obj, (closing_prices, day_metrics) = item
+                progress.read(len(day_metrics))
+                try:
+                    records = recal_obj.compute(closing_prices, day_metrics)
+                except Exception:
+                    _dead_letter(jobs, recal_obj.order_book_id, progress)
+                    continue
+                _pipeline_put(computed, (recal_obj.order_book_id, records),
+                              writer)
+            _pipeline_put(computed, None, writer)
+            writer.join()
+        except BaseException as e:
+            # the other threads stop waiting on their pipes
+            main.error = e
+            raise
+        finally:
+            main.stopped = True
+        if writer.error is not None:
+            raise writer.error
+    progress.finish()
+
+
+def update_day(first=False, shard_index=0, shard_count=1,
+               order_book_ids=None, run_id=None) -> List[DeadLetter]:
+    """
+    recalculate day tables. Several hosts can recalculate the tables
+    together, each one recalculates the stocks of one shard, see
+    shard.set_shard(). Sharded runs update the live tables in place.
+
+    :param run_id: if it is not None, the stocks are claimed from the jobs of
+                   this run in recal_job table instead of a memory queue.
+                   Workers on other hosts join the run by the same run_id,
+                   and a restarted run skips the completed stocks. Such runs
+                   update the live tables in place too.
+    :return: the stocks which failed permanently, they are not recalculated.
+             The workers are supervised, see supervisor.supervise().
+
+    If divergence.enabled is set, recal_day is compared with orig_day after
+    the update, see divergence.report_divergence(). Sharded runs and runs
+    with run_id skip it since other workers may be still running, the report
+    should be run after all of them.
+    """
+    set_shard(shard_index, shard_count, order_book_ids)
+    reset_code_maps()
+    # refreshed before forking workers which read them
+    refresh_snapshots([table_name(day_fd), table_name(stk_market),
+                       table_name(stk_code)])
+    order_book_ids = get_orderbookids()
+    if run_id is None:
+        jobs = MemoryJobs(order_book_ids)
+        total = len(order_book_ids)
+    else:
+        create_recal_job()
+        enqueue(run_id, order_book_ids)
+        jobs = JobQueue(run_id)
+        stats = job_stats(run_id)
+        total = len(order_book_ids) - stats.get(DONE, {}).get('jobs', 0)
+    reset_progress(_RECAL_STAGE)
+    reset_profiles(_RECAL_STAGE)
+
+    # day tables of first update are rebuilt and swapped in together, keys are
+    # rebuilt once after all workers.
+    with rebuild([orig_day, recal_day],
+                 enabled=first and not is_sharded() and run_id is None):
+        create_orig_day()
+        create_recal_day()
+        with bulk_load([target(orig_day), target(recal_day)], enabled=first):
+            def start_worker(i):
+                worker = Process(target=recal_by_stock,
+                                 args=(i, first, jobs, total,))
+                worker.start()
+                return worker
+
+            supervise(jobs, start_worker, 5)
+        jobs.close()
+    dead_letters = jobs.failures()
+    if run_id is not None:
+        print(datetime.datetime.now(), 'jobs of run', run_id, ':',
+              dict(job_stats(run_id)))
+    report(dead_letters, 'update_day')
+    merge_profiles(_RECAL_STAGE)
+    if divergence_enabled() and not is_sharded() and run_id is None:
+        report_divergence()
+    return dead_letters
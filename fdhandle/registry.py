@@ -0,0 +1,115 @@
+import os
+import pickle
+from collections import namedtuple
+from typing import List, Sequence, Tuple
+
+from pandas import isna, read_csv
+
+from config import get_inst_cache, get_inst_files
+
+# columns parsed from instruments files, the missing ones are skipped.
+_ORDER_BOOK_ID = 'OrderBookID'
+_METADATA_COLUMNS = {
+    'Symbol': 'symbol',
+    'ListedDate': 'listed_date',
+    'DeListedDate': 'de_listed_date',
+}
+# bumped when the cached data is changed
+_CACHE_VERSION = 1
+
+Instrument = namedtuple('Instrument', (
+    'order_book_id', 'stockcode', 'exchange', 'symbol', 'listed_date',
+    'de_listed_date'), defaults=(None, None, None))
+
+# registry of current process, forked processes inherit it.
+_registry = None
+
+
+class Registry(object):
+    """instruments of interest, they are parsed from instruments files"""
+
+    def __init__(self, signature: Tuple, instruments: Sequence[Instrument]):
+        self.signature = signature
+        self.instruments = {i.order_book_id: i for i in instruments}
+        self.order_book_ids = sorted(self.instruments)
+        # key is stockcode such as "000001", value is order_book_id
+        self.stockcode_map = {i.stockcode: i.order_book_id
+                              for i in self.instruments.values()}
+        # key is exchange suffix such as "XSHE", value is order_book_ids
+        self.exchange_map = {}
+        for order_book_id in self.order_book_ids:
+            self.exchange_map.setdefault(
+                self.instruments[order_book_id].exchange,
+                []).append(order_book_id)
+
+    def get(self, order_book_id: str) -> Instrument:
+        return self.instruments.get(order_book_id)
+
+
+def _signature(files: Sequence[str]) -> Tuple:
+    """instruments files with their modified times and sizes"""
+    ret = []
+    for file in files:
+        stat = os.stat(file)
+        ret.append((os.path.abspath(file), stat.st_mtime_ns, stat.st_size))
+    return tuple(ret)
+
+
+def _value(value):
+    return None if isna(value) else value
+
+
+def _parse(files: Sequence[str]) -> List[Instrument]:
+    wanted = {_ORDER_BOOK_ID} | set(_METADATA_COLUMNS)
+    ret = {}
+    for file in files:
+        df = read_csv(file, usecols=lambda c: c in wanted, dtype=str)
+        columns = [c for c in _METADATA_COLUMNS if c in df.columns]
+        for row in df.itertuples(index=False):
+            row = dict(zip(df.columns, row))
+            order_book_id = row[_ORDER_BOOK_ID]
+            stockcode, _, exchange = order_book_id.partition('.')
+            ret[order_book_id] = Instrument(
+                order_book_id, stockcode, exchange,
+                **{_METADATA_COLUMNS[c]: _value(row[c]) for c in columns})
+    return list(ret.values())
+
+
+def _load_cache(path: str, signature: Tuple):
+    try:
+        with open(path, mode='rb') as f:
+            version, cached_signature, instruments = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, ValueError):
+        return None
+    if version != _CACHE_VERSION or cached_signature != signature:
+        return None
+    return instruments
+
+
+def _save_cache(path: str, signature: Tuple, instruments: List[Instrument]):
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, mode='wb') as f:
+        pickle.dump((_CACHE_VERSION, signature, instruments), f,
+                    protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def registry() -> Registry:
+    """
+    registry of instruments files. The files are parsed at most once until
+    they are modified: the registry is kept in memory of current process and
+    in instrument_cache file for other processes.
+    """
+    global _registry
+    files = get_inst_files()
+    signature = _signature(files)
+    if _registry is not None and _registry.signature == signature:
+        return _registry
+    cache = get_inst_cache()
+    instruments = _load_cache(cache, signature) if cache else None
+    if instruments is None:
+        instruments = _parse(files)
+        if cache:
+            _save_cache(cache, signature, instruments)
+    _registry = Registry(signature, instruments)
+    return _registry
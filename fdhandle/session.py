@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+from functools import partial
+from typing import Dict, List, Sequence
+
+from mysql.connector.errors import InterfaceError, OperationalError
+
+from config import get_source_connect, get_dest_connect
+
+SOURCE = 'source'
+DEST = 'dest'
+
+
+class Session(object):
+    """
+    one source connection and one dest connection owned by one worker. They
+    are checked out from pools once and kept during the whole session, so the
+    queries of one stock do not check out and reset connections again and
+    again.
+
+    Every endpoint keeps one dictionary cursor for all queries, and one
+    prepared cursor for each hot statement if prepared is set in its pool
+    config. If the connection was lost, it is discarded and the next
+    statement checks out a new connection from the pool, which has the
+    session variables of the pool. A lost source connection is replaced by a
+    connection of another replica if its replica is down.
+
+    Reads are executed again on the new connection at once. Writes are not,
+    since the lost write may have been applied, the error is raised to the
+    caller which retries the whole unit of work, see supervisor.retry().
+    """
+
+    def __init__(self, partition=None):
+        """
+        :param partition: partition of source reads, see get_source_connect.
+        """
+        self._connectors = {
+            SOURCE: partial(get_source_connect, partition),
+            DEST: get_dest_connect,
+        }
+        self._connections = {}
+        self._cursors = {}
+        # key is (endpoint, sql), statement is prepared by server only once
+        self._prepared_cursors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def connection(self, endpoint: str):
+        cnx = self._connections.get(endpoint)
+        if cnx is None:
+            cnx = self._connectors[endpoint]()
+            self._connections[endpoint] = cnx
+        return cnx
+
+    def cursor(self, endpoint: str):
+        cursor = self._cursors.get(endpoint)
+        if cursor is None:
+            cursor = self.connection(endpoint).cursor(dictionary=True)
+            self._cursors[endpoint] = cursor
+        return cursor
+
+    def _prepared_cursor(self, endpoint: str, sql: str):
+        key = (endpoint, sql)
+        cursor = self._prepared_cursors.get(key)
+        if cursor is None:
+            cursor = self.connection(endpoint).cursor(prepared=True)
+            self._prepared_cursors[key] = cursor
+        return cursor
+
+    def _cursor(self, endpoint: str, sql: str, prepared: bool):
+        if prepared and getattr(self.connection(endpoint), 'prepared', False):
+            return self._prepared_cursor(endpoint, sql)
+        return self.cursor(endpoint)
+
+    @staticmethod
+    def _close_cursor(cursor):
+        try:
+            cursor.close()
+        except (InterfaceError, OperationalError):
+            pass
+
+    def _discard(self, endpoint: str):
+        cursor = self._cursors.pop(endpoint, None)
+        if cursor is not None:
+            self._close_cursor(cursor)
+        # statements prepared by the lost connection are gone with it
+        for key in [key for key in self._prepared_cursors
+                    if key[0] == endpoint]:
+            self._close_cursor(self._prepared_cursors.pop(key))
+        # next statement checks out again, which fails over to another
+        # replica for source.
+        cnx = self._connections.pop(endpoint, None)
+        if cnx is not None:
+            # checkout itself may have failed
+            cnx.invalidate()
+
+    def _execute(self, endpoint: str, sql: str, params: Sequence,
+                 many=False, prepared=False, retry=False):
+        """:param retry: execute again on a new connection if it was lost"""
+        try:
+            cursor = self._cursor(endpoint, sql, prepared)
+            (cursor.executemany if many else cursor.execute)(sql, params)
+        except (InterfaceError, OperationalError):
+            self._discard(endpoint)
+            if not retry:
+                raise
+            cursor = self._cursor(endpoint, sql, prepared)
+            (cursor.executemany if many else cursor.execute)(sql, params)
+        return cursor
+
+    def transaction(self, endpoint: str):
+        """bulk writes of endpoint in one transaction if it supports"""
+        return self.connection(endpoint).transaction()
+
+    def fetchall(self, endpoint: str, sql: str, params: Sequence = (),
+                 prepared=False) -> List[Dict]:
+        """
+        :param prepared: execute sql as server-side prepared statement if the
+                         pool of endpoint enables it, it is for the statements
+                         executed again and again with different parameters.
+        """
+        cursor = self._execute(endpoint, sql, params, prepared=prepared,
+                               retry=True)
+        rows = cursor.fetchall()
+        if len(rows) != 0 and not isinstance(rows[0], dict):
+            # prepared cursor returns tuples
+            columns = cursor.column_names
+            rows = [dict(zip(columns, row)) for row in rows]
+        return rows
+
+    def fetchone(self, endpoint: str, sql: str, params: Sequence = (),
+                 prepared=False) -> Dict:
+        rows = self.fetchall(endpoint, sql, params, prepared)
+        return rows[0] if len(rows) != 0 else None
+
+    def execute(self, endpoint: str, sql: str, params: Sequence = ()):
+        self._execute(endpoint, sql, params)
+
+    def executemany(self, endpoint: str, sql: str,
+                    seq_params: Sequence[Sequence]):
+        self._execute(endpoint, sql, seq_params, many=True)
+
+    def close(self):
+        for cursor in self._cursors.values():
+            cursor.close()
+        self._cursors.clear()
+        for cursor in self._prepared_cursors.values():
+            cursor.close()
+        self._prepared_cursors.clear()
+        for cnx in self._connections.values():
+            cnx.close()
+        self._connections.clear()
+
+
+@contextmanager
+def session_scope(session: Session = None):
+    """use session if it is given, otherwise open a temporary session."""
+    if session is not None:
+        yield session
+        return
+    with Session() as session:
+        yield session
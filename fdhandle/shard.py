@@ -0,0 +1,59 @@
+import zlib
+from typing import Iterable
+
+# shard of current run, (shard_index, shard_count, order_book_ids). Processes
+# forked during the run inherit it.
+_shard = (0, 1, None)
+
+
+def shard_of(order_book_id: str, shard_count: int) -> int:
+    """stable shard index of order_book_id, the same on every host"""
+    return zlib.crc32(order_book_id.encode()) % shard_count
+
+
+def set_shard(shard_index=0, shard_count=1,
+              order_book_ids: Iterable[str] = None):
+    """
+    process only one slice of the instruments in this run, so that several
+    hosts can each process one slice of the same run.
+
+    :param shard_index: index of the slice, 0 <= shard_index < shard_count
+    :param shard_count: number of slices, instruments are partitioned by the
+                        crc32 of order_book_id.
+    :param order_book_ids: if it is not None, only these instruments of the
+                           slice are processed.
+    """
+    global _shard
+    if shard_count < 1 or not 0 <= shard_index < shard_count:
+        raise ValueError("invalid shard {} of {}".format(shard_index,
+                                                         shard_count))
+    if order_book_ids is not None:
+        order_book_ids = frozenset(order_book_ids)
+    _shard = (shard_index, shard_count, order_book_ids)
+
+
+def is_sharded() -> bool:
+    return _shard != (0, 1, None)
+
+
+def in_shard(order_book_id: str) -> bool:
+    shard_index, shard_count, order_book_ids = _shard
+    if order_book_ids is not None and order_book_id not in order_book_ids:
+        return False
+    return shard_count == 1 or \
+        shard_of(order_book_id, shard_count) == shard_index
+
+
+def shard_key(name: str) -> str:
+    """
+    name of the state of current shard, such as high-water mark. It is name
+    itself if the run is not sharded.
+    """
+    if not is_sharded():
+        return name
+    shard_index, shard_count, order_book_ids = _shard
+    ret = '{}@{}of{}'.format(name, shard_index, shard_count)
+    if order_book_ids is not None:
+        ret += '.{:08x}'.format(
+            zlib.crc32(','.join(sorted(order_book_ids)).encode()))
+    return ret
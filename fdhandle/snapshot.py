@@ -0,0 +1,359 @@
+import datetime
+import json
+import os
+import shutil
+import threading
+from collections import namedtuple
+from decimal import Decimal
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from config import get_snapshot_conf, get_source_connect
+from .metrics import QUARTER_TABLES_MAP, Day, query, day_fd, stk_code, \
+    stk_market, table_name
+from .watermark import max_mtime
+
+# number of source records fetched and encoded at one time
+_FETCH_SIZE = 10000
+_META_FILE = 'meta.json'
+
+# bookkeeping columns of snapshot, every pgenius table has primary key seq
+_SEQ = 'snapshot_seq'
+_MTIME = 'snapshot_mtime'
+_PARTITION = 'snapshot_partition'
+_KEEP = 'snapshot_keep'
+
+_NULL = 'null'
+_DECIMAL = 'decimal'
+
+# loaded snapshots of current process, key is table name
+_snapshots = {}
+_lock = threading.Lock()
+
+_Spec = namedtuple('_Spec', ('table', 'fields', 'partition', 'condition'))
+
+# column of snapshot. data is numpy array, mask is True for NULL. Decimal is
+# stored as integer data * 10 ** scale.
+Column = namedtuple('Column', ('kind', 'scale', 'data', 'mask'))
+
+
+def _specs() -> Dict[str, _Spec]:
+    """
+    projection of every snapshot table. The rows not satisfying condition are
+    dropped, and the rows of one partition are stored together.
+    """
+    ret = {
+        table_name(day_fd): _Spec(day_fd, Day.metrics(), day_fd.inner_code,
+                                  Day.filter_conditions_()),
+        table_name(stk_market): _Spec(
+            stk_market, [stk_market.tradedate, stk_market.tclose],
+            stk_market.inner_code, stk_market.isvalid == 1),
+        table_name(stk_code): _Spec(
+            stk_code, [stk_code.comcode, stk_code.inner_code,
+                       stk_code.stockcode],
+            stk_code.stockcode, None),
+    }
+    for table, clazz in QUARTER_TABLES_MAP.items():
+        ret[table_name(table)] = _Spec(table, clazz.metrics(), clazz.comcode,
+                                       clazz.filter_conditions_())
+    return ret
+
+
+def snapshot_enabled() -> bool:
+    return bool(get_snapshot_conf().get('enabled'))
+
+
+def _snapshot_dir() -> str:
+    return get_snapshot_conf().get('dir') or 'snapshot'
+
+
+def _kind(value) -> str:
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, Decimal):
+        return _DECIMAL
+    if isinstance(value, datetime.datetime):
+        return 'datetime'
+    if isinstance(value, datetime.date):
+        return 'date'
+    if isinstance(value, str):
+        return 'str'
+    raise TypeError("unsupported snapshot value {!r}".format(value))
+
+
+_DTYPES = {
+    'bool': np.bool_,
+    'int': np.int64,
+    'float': np.float64,
+    # decimal(18, x) of pgenius fits in int64 after scaling
+    _DECIMAL: np.int64,
+    'datetime': 'datetime64[us]',
+    'date': 'datetime64[D]',
+    'str': np.str_,
+}
+
+
+def encode(values: Sequence) -> Column:
+    """encode values of one column in the same type"""
+    mask = np.fromiter((v is None for v in values), dtype=np.bool_,
+                       count=len(values))
+    kinds = {_kind(v) for v in values if v is not None}
+    if len(kinds) == 0:
+        return Column(_NULL, 0, np.zeros(len(values), dtype=np.int8), mask)
+    if len(kinds) != 1:
+        raise TypeError("mixed snapshot value types {}".format(kinds))
+    kind = kinds.pop()
+    scale = 0
+    if kind == _DECIMAL:
+        scale = max(max(0, -v.as_tuple().exponent)
+                    for v in values if v is not None)
+        values = [0 if v is None else int(v.scaleb(scale)) for v in values]
+    elif kind in ('datetime', 'date'):
+        values = [np.datetime64('NaT') if v is None else v for v in values]
+    elif kind == 'str':
+        values = ['' if v is None else v for v in values]
+    else:
+        values = [0 if v is None else v for v in values]
+    return Column(kind, scale, np.array(values, dtype=_DTYPES[kind]), mask)
+
+
+def decode(column: Column) -> List:
+    if column.kind == _NULL:
+        return [None] * len(column.mask)
+    values = column.data.tolist()
+    if column.kind == _DECIMAL:
+        values = [Decimal(v).scaleb(-column.scale) for v in values]
+    if column.mask.any():
+        values = [None if null else v
+                  for v, null in zip(values, column.mask.tolist())]
+    return values
+
+
+def concat(columns: Sequence[Column]) -> Column:
+    mask = np.concatenate([c.mask for c in columns])
+    typed = [c for c in columns if c.kind != _NULL]
+    if len(typed) == 0:
+        return Column(_NULL, 0, np.zeros(len(mask), dtype=np.int8), mask)
+    kinds = {c.kind for c in typed}
+    if len(kinds) != 1:
+        raise TypeError("mixed snapshot column types {}".format(kinds))
+    kind = kinds.pop()
+    scale = max(c.scale for c in typed)
+    data = []
+    for c in columns:
+        if c.kind == _NULL:
+            data.append(np.zeros(len(c.mask), dtype=typed[0].data.dtype))
+        elif c.scale != scale:
+            data.append(np.asarray(c.data) * 10 ** (scale - c.scale))
+        else:
+            data.append(c.data)
+    return Column(kind, scale, np.concatenate(data), mask)
+
+
+def _take(column: Column, index) -> Column:
+    return Column(column.kind, column.scale, column.data[index],
+                  column.mask[index])
+
+
+class Snapshot(object):
+    """
+    local columnar snapshot of one pgenius table. Every column is a numpy
+    file which is memory mapped, and rows are sorted by partition, so the rows
+    of one stock are read without loading the whole table.
+    """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, _META_FILE), mode='rt') as f:
+            meta = json.load(f)
+        self.path = path
+        self.signature = meta['signature']
+        # snapshot of empty table has no high-water mark
+        self.mtime = datetime.datetime.fromisoformat(meta['mtime']) \
+            if meta['mtime'] is not None else None
+        self.names = [c['name'] for c in meta['columns']]
+        self._columns = {}
+        for i, c in enumerate(meta['columns']):
+            data = np.load(os.path.join(path, '%d.npy' % i), mmap_mode='r')
+            mask = np.load(os.path.join(path, '%d.mask.npy' % i),
+                           mmap_mode='r')
+            self._columns[c['name']] = Column(c['kind'], c['scale'], data,
+                                              mask)
+        # projected columns, the same as the columns of source query
+        self.column_names = tuple(name for name in self.names
+                                  if not name.startswith('snapshot_'))
+
+    def column(self, name: str) -> Column:
+        return self._columns[name]
+
+    def rows(self, partition=None) -> List[Tuple]:
+        """
+        :param partition: inner_code, comcode or stockcode of the rows. If it
+                          is None, all rows are returned.
+        :return: rows in the order of column_names
+        """
+        index = slice(None)
+        if partition is not None:
+            keys = self._columns[_PARTITION].data
+            if len(keys) == 0:
+                return []
+            index = slice(np.searchsorted(keys, partition, 'left'),
+                          np.searchsorted(keys, partition, 'right'))
+        return list(zip(*[decode(_take(self._columns[name], index))
+                          for name in self.column_names]))
+
+    def records(self, partition=None) -> List[Dict]:
+        return [dict(zip(self.column_names, row))
+                for row in self.rows(partition)]
+
+
+def snapshot(name: str) -> Snapshot:
+    """loaded snapshot of pgenius table, such as "stk_mkt"."""
+    with _lock:
+        ret = _snapshots.get(name)
+        if ret is None:
+            ret = Snapshot(os.path.join(_snapshot_dir(), name))
+            _snapshots[name] = ret
+        return ret
+
+
+def _load_previous(path: str, signature: str):
+    if not os.path.exists(os.path.join(path, _META_FILE)):
+        return None
+    previous = Snapshot(path)
+    # projection was changed, rebuild it.
+    return previous if previous.signature == signature else None
+
+
+def _fetch_delta(spec: _Spec, low_mtime, high_mtime) -> Dict[str, Column]:
+    table = spec.table
+    fields = list(spec.fields) + [
+        table.seq.as_(_SEQ), table.mtime.as_(_MTIME),
+        spec.partition.as_(_PARTITION)]
+    if spec.condition is not None:
+        fields.append(spec.condition.as_(_KEEP))
+    select = query.fields(fields).tables(table)
+    if high_mtime is None:
+        # empty table, only the columns are read
+        select = select.limit(0)
+    else:
+        condition = table.mtime <= high_mtime
+        if low_mtime is not None:
+            condition &= table.mtime > low_mtime
+        select = select.where(condition)
+
+    src_conn = get_source_connect()
+    src_cursor = src_conn.cursor()
+    src_cursor.execute(*select.select())
+    names = src_cursor.column_names
+    chunks = []
+    rows = src_cursor.fetchmany(_FETCH_SIZE)
+    while len(rows) != 0:
+        chunks.append([encode(values) for values in zip(*rows)])
+        rows = src_cursor.fetchmany(_FETCH_SIZE)
+    src_cursor.close()
+    src_conn.close()
+    if len(chunks) == 0:
+        return {name: encode(()) for name in names}
+    return {name: concat([chunk[i] for chunk in chunks])
+            for i, name in enumerate(names)}
+
+
+def _write_column(path: str, i: int, column: Column):
+    np.save(os.path.join(path, '%d.npy' % i), column.data)
+    np.save(os.path.join(path, '%d.mask.npy' % i), column.mask)
+
+
+def _replace_dir(path: str, new_path: str):
+    old_path = path + '.old'
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(new_path, path)
+    # processes which loaded the old snapshot keep reading their mapped files
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def refresh_snapshot(name: str):
+    """
+    refresh snapshot of pgenius table by the records modified since last
+    refresh. The modified records replace their previous versions by seq, and
+    the records which are invalid now are dropped. The snapshot of an empty
+    table has its columns and no records.
+
+    Records deleted from the source table leave no mtime behind, so they are
+    never removed from the snapshot. Remove the snapshot directory to build
+    it again after records are deleted.
+    """
+    spec = _specs()[name]
+    signature = query.fields(list(spec.fields) + [spec.partition]).tables(
+        spec.table).where(spec.condition).select()
+    signature = json.dumps(signature, default=str)
+    path = os.path.join(_snapshot_dir(), name)
+    previous = _load_previous(path, signature)
+    low_mtime = previous.mtime if previous is not None else None
+
+    src_conn = get_source_connect()
+    high_mtime = max_mtime(src_conn, spec.table, low_mtime)
+    src_conn.close()
+    if high_mtime is None and previous is not None:
+        print(datetime.datetime.now(), 'snapshot', name, 'no change.')
+        return
+
+    delta = _fetch_delta(spec, low_mtime, high_mtime)
+    if _KEEP in delta:
+        keep = delta.pop(_KEEP)
+        keep = (keep.data != 0) & ~keep.mask if keep.kind != _NULL \
+            else np.zeros(len(keep.mask), dtype=np.bool_)
+    else:
+        keep = np.ones(len(delta[_SEQ].mask), dtype=np.bool_)
+    names = list(delta)
+
+    def merged(column_name):
+        column = _take(delta[column_name], keep)
+        if previous is None:
+            return column
+        return concat([_take(previous.column(column_name), retained),
+                       column])
+
+    retained = None
+    if previous is not None:
+        # previous versions of modified records are replaced
+        retained = ~np.isin(previous.column(_SEQ).data, delta[_SEQ].data)
+    order = np.argsort(merged(_PARTITION).data, kind='stable')
+
+    new_path = '%s.%d.tmp' % (path, os.getpid())
+    shutil.rmtree(new_path, ignore_errors=True)
+    os.makedirs(new_path)
+    meta_columns = []
+    rows = 0
+    # one column is merged and written at a time to bound memory usage
+    for i, column_name in enumerate(names):
+        column = _take(merged(column_name), order)
+        _write_column(new_path, i, column)
+        meta_columns.append({'name': column_name, 'kind': column.kind,
+                             'scale': column.scale})
+        rows = len(column.mask)
+    with open(os.path.join(new_path, _META_FILE), mode='wt') as f:
+        json.dump({'signature': signature,
+                   'mtime': high_mtime.isoformat()
+                   if high_mtime is not None else None,
+                   'rows': rows, 'columns': meta_columns}, f)
+    _replace_dir(path, new_path)
+    with _lock:
+        _snapshots.pop(name, None)
+    print(datetime.datetime.now(), 'snapshot', name, 'refreshed,',
+          len(keep), 'records modified,', rows, 'records.')
+
+
+def refresh_snapshots(names: Iterable[str]):
+    """refresh snapshots of tables if snapshot.enabled is set"""
+    if not snapshot_enabled():
+        return
+    os.makedirs(_snapshot_dir(), exist_ok=True)
+    for name in names:
+        refresh_snapshot(name)
@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS %s
+(
+   run_id varchar(64) NOT NULL,
+   stage varchar(64) NOT NULL,
+   stock varchar(16) NOT NULL,
+   data varchar(1024),
+   updated_at datetime NOT NULL,
+
+   PRIMARY KEY (RUN_ID, STAGE, STOCK)
+) ENGINE=MyISAM DEFAULT CHARSET=utf8;
@@ -0,0 +1,21 @@
+CREATE TABLE IF NOT EXISTS %s
+(
+   scope varchar(10) NOT NULL,
+   scope_key varchar(20) NOT NULL,
+   metric varchar(32) NOT NULL,
+   records int(11),
+   diverged int(11),
+   missing_orig int(11),
+   missing_recal int(11),
+   p50 double,
+   p90 double,
+   p99 double,
+   max_diff double,
+   stockcode char(11),
+   tradedate int(11),
+   orig_value decimal(21,4),
+   recal_value decimal(21,4),
+   generated_at datetime,
+
+   PRIMARY KEY (SCOPE, SCOPE_KEY, METRIC)
+) ENGINE=MyISAM DEFAULT CHARSET=utf8;
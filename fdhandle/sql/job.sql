@@ -0,0 +1,15 @@
+CREATE TABLE IF NOT EXISTS %s
+(
+   run_id varchar(64) NOT NULL,
+   order_book_id char(11) NOT NULL,
+   state varchar(10) NOT NULL,
+   owner varchar(128),
+   lease_until datetime,
+   attempts int(11) NOT NULL DEFAULT 0,
+   records int(11),
+   started_at datetime,
+   finished_at datetime,
+   error text,
+
+   PRIMARY KEY (RUN_ID, ORDER_BOOK_ID)
+) ENGINE=MyISAM DEFAULT CHARSET=utf8;
@@ -0,0 +1,23 @@
+CREATE TABLE IF NOT EXISTS %s
+(
+   stockcode char(11) NOT NULL,
+   end_date int(11) NOT NULL,
+   announce_date int(11) NULL,
+   rpt_year int(11),
+   rpt_quarter int(11),
+
+   net_profit_parent_company decimal(18,2),
+   net_profit decimal(18,2),
+   operating_revenue decimal(18,2),
+   cash_flow_from_operating_activities decimal(18,2),
+   current_assets decimal(18,2),
+   cash decimal(18,2),
+   cash_equivalent decimal(18,2),
+   interest_bearing_debt decimal(18,4),
+   ebitda decimal(18,4),
+   revenue decimal(18,2),
+   cash_equivalent_inc_net decimal(18,2),
+   book_value_per_share decimal(18,4),
+
+   PRIMARY KEY (STOCKCODE, END_DATE)
+) ENGINE=MyISAM DEFAULT CHARSET=utf8;
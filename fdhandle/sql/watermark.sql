@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS %s
+(
+   table_name varchar(64) NOT NULL,
+   mtime datetime NOT NULL,
+   updated_at datetime NOT NULL,
+
+   PRIMARY KEY (TABLE_NAME)
+) ENGINE=MyISAM DEFAULT CHARSET=utf8;
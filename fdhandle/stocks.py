@@ -1,31 +1,24 @@
 from typing import List, Dict
 
-from pandas import read_csv
 from sqlbuilder.smartsql import Field
 
-from config import get_inst_files, get_source_connect
+from config import get_source_connect
 from fdhandle.conn import MySQLDictCursorWrapper
-from fdhandle.metrics import query, stk_code
+from fdhandle.metrics import query, stk_code, table_name
+from fdhandle.registry import registry
+from fdhandle.shard import in_shard
+from fdhandle.snapshot import snapshot_enabled, snapshot
 
 
 def get_stockcode_map() -> Dict:
-    filenames = get_inst_files()
-
-    stockcodes = dict()
-    for file in filenames:
-        df = read_csv(file)
-        for order_book_id in set(df.OrderBookID):
-            stockcodes[order_book_id.split(".")[0]] = order_book_id
-    return stockcodes
+    """stockcodes of the instruments in shard of current run"""
+    return {stockcode: order_book_id for stockcode, order_book_id
+            in registry().stockcode_map.items() if in_shard(order_book_id)}
 
 
 def get_orderbookids():
-    ret = set()
-    filenames = get_inst_files()
-    for file in filenames:
-        df = read_csv(file)
-        ret |= set(df.OrderBookID.values)
-    return list(ret)
+    return [order_book_id for order_book_id in registry().order_book_ids
+            if in_shard(order_book_id)]
 
 
 def _get_code_map(*fields: List[Field]):
@@ -40,7 +33,16 @@ def _get_code_map(*fields: List[Field]):
     return sql, params
 
 
+def _snapshot_code_map(key: str):
+    stockcodes = set(get_stockcode_map().keys())
+    return {r[key]: r["stockcode"]
+            for r in snapshot(table_name(stk_code)).records()
+            if r["stockcode"] in stockcodes}
+
+
 def get_comcode_map():
+    if snapshot_enabled():
+        return _snapshot_code_map("comcode")
     sql, params = _get_code_map(stk_code.comcode, stk_code.stockcode)
     src_conn = get_source_connect()
     with MySQLDictCursorWrapper(src_conn) as cursor:
@@ -54,6 +56,8 @@ def get_comcode_map():
 
 
 def get_innercode_map():
+    if snapshot_enabled():
+        return _snapshot_code_map("inner_code")
     sql, params = _get_code_map(stk_code.inner_code, stk_code.stockcode)
     src_conn = get_source_connect()
     with MySQLDictCursorWrapper(src_conn) as cursor:
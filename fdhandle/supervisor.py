@@ -0,0 +1,108 @@
+import datetime
+import sqlite3
+import time
+from typing import Callable, List
+
+from mysql.connector.errors import Error, InterfaceError, OperationalError, \
+    PoolError
+
+from config import get_supervisor_conf
+
+# errno of mysql errors which may succeed if they are tried again: too many
+# connections, lock wait timeout, deadlock, server has gone away, lost
+# connection.
+_TRANSIENT_ERRNOS = {1040, 1205, 1213, 2006, 2013}
+
+
+def is_transient(e: BaseException) -> bool:
+    """whether e is a database error which may succeed if it is retried"""
+    if isinstance(e, (InterfaceError, OperationalError, PoolError)):
+        return True
+    if isinstance(e, Error):
+        return e.errno in _TRANSIENT_ERRNOS
+    if isinstance(e, sqlite3.OperationalError):
+        message = str(e)
+        return 'locked' in message or 'busy' in message
+    return False
+
+
+def retry(action: Callable, description: str):
+    """
+    call action(attempt) until it does not raise transient database error,
+    attempt is 0 for the first call. It is retried at most
+    supervisor.retries times with exponential backoff, then the error is
+    raised.
+    """
+    conf = get_supervisor_conf()
+    retries = int(conf.get('retries', 3))
+    backoff = float(conf.get('backoff', 1))
+    attempt = 0
+    while True:
+        try:
+            return action(attempt)
+        except Exception as e:
+            if attempt >= retries or not is_transient(e):
+                raise
+            delay = backoff * 2 ** attempt
+            print(datetime.datetime.now(), description, 'failed by', repr(e),
+                  ', retry after', delay, 'seconds.')
+            time.sleep(delay)
+            attempt += 1
+
+
+def supervise(jobs, start_worker: Callable, process_num: int):
+    """
+    run process_num workers until they handled all jobs, see
+    jobs.MemoryJobs and jobs.JobQueue. A dead worker is respawned and the
+    stocks in flight of it are released to other workers; a stock which was
+    in flight of supervisor.max_crashes dead workers is dead-lettered
+    instead.
+
+    :param start_worker: start_worker(i) starts worker i and returns its
+                         process.
+    """
+    conf = get_supervisor_conf()
+    max_crashes = int(conf.get('max_crashes', 2))
+    max_respawns = int(conf.get('max_respawns', 10))
+    workers = {i: start_worker(i) for i in range(process_num)}
+    respawns = 0
+    stopped = False
+    while len(workers) != 0:
+        dead = [(i, worker) for i, worker in workers.items()
+                if not worker.is_alive()]
+        # events of dead workers are handled before their stocks are released
+        jobs.poll(0 if len(dead) != 0 else 1)
+        for i, worker in dead:
+            worker.join()
+            del workers[i]
+            if worker.exitcode == 0:
+                continue
+            print(datetime.datetime.now(), 'worker', i, 'pid', worker.pid,
+                  'died with exit code', worker.exitcode)
+            jobs.release(worker.pid, max_crashes)
+            if stopped:
+                # no stock is left for it
+                continue
+            if respawns >= max_respawns:
+                for other in workers.values():
+                    other.terminate()
+                raise RuntimeError("recal workers died {} times".format(
+                    respawns + 1))
+            respawns += 1
+            workers[i] = start_worker(i)
+        if not stopped and jobs.drained():
+            jobs.stop(len(workers))
+            stopped = True
+
+
+def report(dead_letters: List, description: str):
+    """print the dead letters of a run with their tracebacks"""
+    if len(dead_letters) == 0:
+        print(datetime.datetime.now(), description, 'has no failed stock.')
+        return
+    print(datetime.datetime.now(), description, 'has', len(dead_letters),
+          'failed stocks:',
+          ', '.join(letter.order_book_id for letter in dead_letters))
+    for letter in dead_letters:
+        print('-' * 30, letter.order_book_id)
+        print(letter.error)
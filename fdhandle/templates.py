@@ -0,0 +1,87 @@
+from collections import OrderedDict
+from typing import Callable, Hashable, List, Sequence, Tuple
+
+from sqlbuilder.smartsql import T
+
+from .backend import dest_backend
+from .metrics import table_name
+
+# compiled templates of current process, key is statement shape.
+_templates = {}
+
+
+class Slot(object):
+    """placeholder of template parameter whose value is given at execution"""
+    __slots__ = ('name',)
+
+    def __init__(self, name: str):
+        self.name = name
+
+
+class Template(object):
+    """
+    compiled sql statement. Its parameters are either Slot which are bound by
+    name at execution, or constants of the statement.
+    """
+
+    def __init__(self, sql: str, params: Sequence):
+        self.sql = sql
+        self._params = tuple(
+            (True, p.name) if isinstance(p, Slot) else (False, p)
+            for p in params)
+
+    def params(self, **values) -> List:
+        return [values[p] if is_slot else p for is_slot, p in self._params]
+
+    def bind(self, **values) -> Tuple[str, List]:
+        return self.sql, self.params(**values)
+
+
+def template(key: Hashable, build: Callable[[], Tuple[str, List]]) \
+        -> Template:
+    """
+    get compiled template of statement shape, it is compiled only once in each
+    process.
+
+    :param key: statement shape, such as ('day_metrics', True)
+    :param build: build the statement by query with Slot as parameter values,
+                  it returns (sql, params) like query.select().
+    """
+    ret = _templates.get(key)
+    if ret is None:
+        ret = Template(*build())
+        _templates[key] = ret
+    return ret
+
+
+def insert_template(table: T, columns: Sequence[str],
+                    update_columns: Sequence[str] = ()) -> str:
+    """
+    get sql of inserting one record with columns into destination table. Its
+    parameters are the values of columns in the same order.
+
+    :param update_columns: if it is not empty, these columns are updated by
+                           the inserted values when the key is duplicated.
+    """
+    columns = tuple(columns)
+    update_columns = tuple(update_columns)
+    backend = dest_backend()
+    key = ('insert', backend.name, table_name(table), columns, update_columns)
+    ret = _templates.get(key)
+    if ret is None:
+        fields = [getattr(table, column) for column in columns]
+        if len(update_columns) != 0:
+            ret, _ = backend.query.fields(*fields).tables(table).insert(
+                values=[[Slot(column) for column in columns]],
+                on_duplicate_key_update=OrderedDict(
+                    (getattr(table, column),
+                     backend.inserted(getattr(table, column)))
+                    for column in update_columns
+                )
+            )
+        else:
+            ret, _ = backend.query.fields(*fields).tables(table).insert(
+                values=[[Slot(column) for column in columns]])
+        _templates[key] = ret
+    return ret
+
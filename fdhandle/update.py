@@ -1,38 +1,43 @@
 import datetime
 from collections import OrderedDict
-from typing import Dict
+from typing import Dict, Iterable, Iterator, Tuple
 
-from sqlbuilder.smartsql import T, func
+from sqlbuilder.smartsql import T
 
 from config import get_source_connect, get_timeslot, get_dest_connect
-from .codemap import comecode_map, stockcode_map
+from .backend import dest_backend
+from .bulkload import bulk_load
+from .checkpoint import COMPLETE, CHANGED, StageCheckpoint, finish_run, \
+    finish_table, reset_table, run_complete, run_started, stage_checkpoint, \
+    start_run, table_state
+from .codemap import comecode_map, stockcode_map, comcode_orderbookid_map, \
+    reset_code_maps
 from .conn import MySQLDictCursorWrapper
 from .createtable import create_research_quarter, \
-    create_prepare_quarter, create_strategy_quarter
-from .metrics import QUARTER_TABLES_MAP, query, research_quarter, \
-    prepare_quarter, strategy_quarter
-
-
-def _all_mtime(start_date):
-    ret = {}
-    src_conn = get_source_connect()
-    for table, clazz in QUARTER_TABLES_MAP.items():
-        if start_date is None:
-            sql = 'select distinct date_format(mtime, \'%Y-%m-%d\') as ' \
-                  'modified_time from {0} order by mtime ' \
-                  'asc;'.format(clazz.name_(), start_date)
-        else:
-            sql = 'select distinct date_format(mtime, \'%Y-%m-%d\') as ' \
-                  'modified_time from {0} where mtime >= \'{1}\' ' \
-                  'order by mtime asc;'.format(clazz.name_(), start_date)
-        with MySQLDictCursorWrapper(src_conn) as src_cursor:
-            src_cursor.execute(sql)
-            ret[table] = src_cursor.fetchall()
-    src_conn.close()
-    return ret
-
-
-def _get_start_date():
+    create_prepare_quarter, create_strategy_quarter, \
+    create_strategy_quarter_metrics, create_sync_watermark
+from .generation import base_table_name, on_swap, target
+from .metrics import QUARTER_METRICS_COLUMNS, QUARTER_TABLES_MAP, RowPlan, \
+    query, research_quarter, prepare_quarter, strategy_quarter, \
+    strategy_quarter_metrics, stk_code, table_name
+from .profiling import profiled, reset_profiles, merge_profiles
+from .progress import StageProgress, start_stage
+from .rebuild import rebuild
+from .shard import is_sharded, set_shard, shard_key
+from .snapshot import snapshot_enabled, snapshot, refresh_snapshots
+from .templates import insert_template
+from .watermark import load_watermarks, save_watermark, max_mtime
+
+
+# number of source records fetched at one time during rehandling.
+_FETCH_SIZE = 1000
+
+
+def get_start_date():
+    """
+    start date of rehandle window. It is only used when the source table has
+    no high-water mark yet, see ResearchQuarter._update_by_mtime.
+    """
     timeslot = get_timeslot()
     if timeslot < 0:
         return None
@@ -45,34 +50,42 @@ def _get_start_date():
 def _insert_record(cursor: MySQLDictCursorWrapper, dest_quarter: T,
                    record: Dict, duplicate_update=True):
     # on_duplicate_key_update will take more time to invoke insert function.
-    if duplicate_update:
-        insert_sql, insert_params = query.tables(dest_quarter).insert(
-            record,
-            on_duplicate_key_update=record
-        )
-    else:
-        insert_sql, insert_params = query.tables(dest_quarter).insert(record)
-    cursor.execute(insert_sql, insert_params)  # auto commit
+    columns = tuple(record.keys())
+    insert_sql = insert_template(dest_quarter, columns,
+                                 columns if duplicate_update else ())
+    cursor.execute(insert_sql, tuple(record.values()))  # auto commit
 
 
-def _import_quarter(src_quarter: T, dest_quarter: T):
+def _finished(checkpoint: StageCheckpoint) -> bool:
+    """whether the stage was finished by previous attempt of the run"""
+    if checkpoint.complete:
+        print(datetime.datetime.now(), checkpoint.stage,
+              'was finished, skipped.')
+    return checkpoint.complete
+
+
+def _import_quarter(src_quarter: T, dest_quarter: T, all_update: bool):
     """:param all_update, if it is True, then importing all data from
     research_quarter; Otherwise, importing latest quarter record for each stock
     from research_quarter"""
-    all_update = get_timeslot() < 0
-
+    dest = dest_backend()
+    stockcodes = stockcode_map()
+    stage = table_name(dest_quarter) + '.import'
+    checkpoint = stage_checkpoint(stage)
+    if _finished(checkpoint):
+        return
     dest_conn = get_dest_connect()
     src_conn = get_dest_connect()
-    percent = 0
-    for _, order_book_id in stockcode_map().items():
-        percent += 1
-        print("{0} {1} import data finished {2:.2f}%"
-              .format(datetime.datetime.now(), dest_quarter,
-                      percent / len(stockcode_map()) * 100))
+    progress = start_stage(stage, len(stockcodes))
+    for _, order_book_id in stockcodes.items():
+        if checkpoint.done(order_book_id):
+            progress.stock_done()
+            continue
         with MySQLDictCursorWrapper(src_conn) as src_cursor:
             if all_update:
-                select_sql, select_params = query.fields('*').tables(
-                    src_quarter).where(
+                select_sql, select_params = dest.query.fields(
+                    '*'
+                ).tables(src_quarter).where(
                     src_quarter.stockcode == order_book_id
                 ).select()
             else:
@@ -81,20 +94,34 @@ def _import_quarter(src_quarter: T, dest_quarter: T):
                 # than the max end_date from src_quarter. Since it is
                 # quarter-level data, it is enough to get latest record from
                 # src_quarter.
-                select_sql, select_params = query.fields('*').tables(
-                    src_quarter).where(
+                select_sql, select_params = dest.query.fields(
+                    '*'
+                ).tables(src_quarter).where(
                     src_quarter.stockcode == order_book_id
                 ).order_by(
                     src_quarter.end_date.desc()
                 ).limit(1).select()
             src_cursor.execute(select_sql, select_params)
-            with MySQLDictCursorWrapper(dest_conn) as dest_cursor:
+            with MySQLDictCursorWrapper(dest_conn) as dest_cursor, \
+                    dest_conn.transaction():
                 for record in src_cursor:
+                    progress.read()
                     _insert_record(dest_cursor, dest_quarter, record)
+                    progress.written()
+        checkpoint.mark(order_book_id)
+        progress.stock_done()
+    progress.finish()
+    checkpoint.finish()
     src_conn.close()
     dest_conn.close()
 
 
+def _save_watermarks(high_mtimes: Dict[str, datetime.datetime]):
+    for source_table, high_mtime in high_mtimes.items():
+        if high_mtime is not None:
+            save_watermark(shard_key(source_table), high_mtime)
+
+
 class ResearchQuarter(object):
     """
     Get data from genius database and store data into research_quarter
@@ -105,19 +132,28 @@ class ResearchQuarter(object):
     """
 
     def __init__(self):
-        self._table_mtime_map = _all_mtime(_get_start_date())
-        self._table = research_quarter
+        self._table = target(research_quarter)
 
     def update(self, first=False):
         # create research_quarter if the table does not exist.
         create_research_quarter()
+        create_sync_watermark()
 
-        self._update_table(first)
+        with bulk_load([self._table], enabled=first):
+            self._update_table(first)
         print(datetime.datetime.now(), 'update done.')
 
         self._remove_null_rptsrc()
         self._fill_announce_date()
 
+    def skip(self, first=False):
+        """
+        the table was finished by previous attempt of checkpointed run, only
+        the high-water marks of its first update are kept.
+        """
+        if first:
+            self._first_update()
+
     def _remove_null_rptsrc(self):
         """
         quarter research table consists of four tables (income_statement,
@@ -128,7 +164,7 @@ class ResearchQuarter(object):
         delete it
         """
         dest_conn = get_dest_connect()
-        delete_sql, param = query.tables(self._table).where(
+        delete_sql, param = dest_backend().query.tables(self._table).where(
             self._table.rpt_src == None).delete()
         with MySQLDictCursorWrapper(dest_conn) as dest_cursor:
             dest_cursor.execute(delete_sql, param)
@@ -141,12 +177,20 @@ class ResearchQuarter(object):
         you can refer to the case: http://jira.ricequant.com/browse/ENG-2442
         to get more detail requirements of handling this kind of records.
         """
+        dest = dest_backend()
+        stockcodes = stockcode_map()
+        stage = table_name(self._table) + '.fill_announce_date'
+        checkpoint = stage_checkpoint(stage)
+        if _finished(checkpoint):
+            return
         dest_conn = get_dest_connect()
         src_conn = get_dest_connect()
-        for _, order_book_id in stockcode_map().items():
-            print(datetime.datetime.now(),
-                  "adjust announce date for {}".format(order_book_id))
-            select_sql, select_params = query.fields(
+        progress = start_stage(stage, len(stockcodes))
+        for _, order_book_id in stockcodes.items():
+            if checkpoint.done(order_book_id):
+                progress.stock_done()
+                continue
+            select_sql, select_params = dest.query.fields(
                 self._table.stockcode, self._table.end_date,
                 self._table.comcode, self._table.announce_date,
                 self._table.rpt_quarter, self._table.rpt_year
@@ -161,9 +205,10 @@ class ResearchQuarter(object):
                 src_cursor.execute(select_sql, select_params)
                 adjust_announce_date = AnnounceDateAdjustement(src_cursor)
                 values = adjust_announce_date.values()
+                progress.read(len(values))
                 if len(values) != 0:
                     with MySQLDictCursorWrapper(dest_conn) as dest_cursor:
-                        insert_sql, insert_params = query.fields(
+                        insert_sql, insert_params = dest.query.fields(
                             self._table.stockcode,
                             self._table.comcode,
                             self._table.end_date,
@@ -173,52 +218,147 @@ class ResearchQuarter(object):
                             values=values,
                             on_duplicate_key_update=OrderedDict((
                                 (self._table.announce_date,
-                                 func.VALUES(self._table.announce_date)),
+                                 dest.inserted(self._table.announce_date)),
                                 (self._table.announce_to,
-                                 func.VALUES(self._table.announce_to))
+                                 dest.inserted(self._table.announce_to))
                             ))
                         )
                         dest_cursor.execute(insert_sql, insert_params)
+                        progress.written(len(values))
+            checkpoint.mark(order_book_id)
+            progress.stock_done()
+        progress.finish()
+        checkpoint.finish()
         src_conn.close()
         dest_conn.close()
 
     def _update_by_mtime(self):
+        """
+        rehandle the records modified since the high-water mark of each source
+        table. The high-water mark is the maximum mtime which was handled by
+        last successful update, so only the real delta is scanned.
+
+        If timeslot is negative, all records are rehandled. If one table has no
+        high-water mark yet, the records modified in latest timeslot days are
+        rehandled.
+        """
+        full_update = get_timeslot() < 0
+        watermarks = {} if full_update else load_watermarks()
+        start_date = get_start_date()
+        stage = table_name(self._table) + '.update_by_mtime'
+        checkpoint = stage_checkpoint(stage)
+        if _finished(checkpoint):
+            return
+        progress = start_stage(stage)
         src_conn = get_source_connect()
-        src_cursor = src_conn.cursor(dictionary=True)
+        src_cursor = src_conn.cursor()
         for table, clazz in QUARTER_TABLES_MAP.items():
-            mtimes = self._table_mtime_map[table]
-            while len(mtimes) != 0:
-                select_sql, select_param = query.fields(
-                    clazz.metrics()
-                ).tables(
-                    table
-                ).where(
-                    clazz.filter_conditions_() &
-                    table.mtime.contains(mtimes.pop()['modified_time'])
-                ).select()
-                src_cursor.execute(select_sql, select_param)
-                self._exec_update(src_cursor.fetchall())
+            if checkpoint.done(clazz.name_()):
+                continue
+            # unsharded mark also covers the records of this shard
+            low_mtime = watermarks.get(shard_key(clazz.name_()),
+                                       watermarks.get(clazz.name_()))
+            if low_mtime is not None:
+                condition = clazz.mtime_ > low_mtime
+            elif start_date is not None:
+                condition = clazz.mtime_ >= start_date
+            else:
+                condition = None
+
+            # fix the upper bound before reading, records modified during
+            # this update will be handled by next update.
+            high_mtime = max_mtime(src_conn, table, low_mtime, start_date)
+            if high_mtime is None:
+                print(datetime.datetime.now(), clazz.name_(), 'no change.')
+                continue
+            condition = clazz.mtime_ <= high_mtime if condition is None \
+                else condition & (clazz.mtime_ <= high_mtime)
+
+            select_sql, select_param = query.fields(
+                clazz.metrics()
+            ).tables(
+                table
+            ).where(
+                clazz.filter_conditions_() & condition
+            ).select()
+            src_cursor.execute(select_sql, select_param)
+            plan = clazz.row_plan(src_cursor.column_names)
+            rows = src_cursor.fetchmany(_FETCH_SIZE)
+            while len(rows) != 0:
+                progress.read(len(rows))
+                self._exec_update(self._clear_records(plan, rows), progress)
+                rows = src_cursor.fetchmany(_FETCH_SIZE)
+            save_watermark(shard_key(clazz.name_()), high_mtime)
+            checkpoint.mark(clazz.name_())
+        progress.finish()
+        checkpoint.finish()
         src_cursor.close()
         src_conn.close()
 
     def _first_update(self):
+        stage = table_name(self._table) + '.first_update'
+        checkpoint = stage_checkpoint(stage)
+        # high-water marks are taken before reading, so the records modified
+        # during first update will be rehandled by next update. Snapshots
+        # contain the records modified until their own marks. A resumed
+        # attempt keeps the marks of the first attempt.
+        from_snapshot = snapshot_enabled()
+        high_mtimes = checkpoint.state()
+        if high_mtimes is None:
+            src_conn = get_source_connect()
+            high_mtimes = {}
+            for table, clazz in QUARTER_TABLES_MAP.items():
+                high_mtimes[clazz.name_()] = \
+                    snapshot(clazz.name_()).mtime if from_snapshot \
+                    else max_mtime(src_conn, table)
+            src_conn.close()
+            checkpoint.save_state({
+                name: mtime.isoformat() if mtime is not None else None
+                for name, mtime in high_mtimes.items()})
+        else:
+            high_mtimes = {
+                name: datetime.datetime.fromisoformat(mtime)
+                if mtime is not None else None
+                for name, mtime in high_mtimes.items()}
+        if not _finished(checkpoint):
+            self._first_update_comcodes(checkpoint, from_snapshot)
+            checkpoint.finish()
+        # if research_quarter is rebuilt, the marks are kept until the rebuilt
+        # table is swapped in.
+        on_swap(lambda: _save_watermarks(high_mtimes))
+
+    def _first_update_comcodes(self, checkpoint: StageCheckpoint,
+                               from_snapshot: bool):
         src_conn = get_source_connect()
-        src_cursor = src_conn.cursor(dictionary=True)
+        src_cursor = src_conn.cursor()
         comcodes = comecode_map()
+        progress = start_stage(checkpoint.stage, len(comcodes))
+        # records of the comcode interrupted by last attempt may exist
+        duplicate_update = checkpoint.resumed
         for comcode in comcodes:
-            print(datetime.datetime.now(), comcode)
+            if checkpoint.done(comcode):
+                progress.stock_done()
+                continue
             merged_records = {}
             for table, clazz in QUARTER_TABLES_MAP.items():
-                select_sql, select_param = query.fields(
-                    clazz.metrics()
-                ).tables(
-                    table
-                ).where(
-                    (clazz.comcode == comcode) &
-                    clazz.filter_conditions_()
-                ).select()
-                src_cursor.execute(select_sql, select_param)
-                records = src_cursor.fetchall()
+                if from_snapshot:
+                    table_snapshot = snapshot(clazz.name_())
+                    plan = clazz.row_plan(table_snapshot.column_names)
+                    rows = table_snapshot.rows(comcode)
+                else:
+                    select_sql, select_param = query.fields(
+                        clazz.metrics()
+                    ).tables(
+                        table
+                    ).where(
+                        (clazz.comcode == comcode) &
+                        clazz.filter_conditions_()
+                    ).select()
+                    src_cursor.execute(select_sql, select_param)
+                    plan = clazz.row_plan(src_cursor.column_names)
+                    rows = src_cursor.fetchall()
+                progress.read(len(rows))
+                records = self._clear_records(plan, rows)
                 for record in records:
                     enddate = record.get('end_date')
                     kept_record = merged_records.get((comcode, enddate))
@@ -226,77 +366,64 @@ class ResearchQuarter(object):
                         merged_records[(comcode, enddate)] = record
                     else:
                         kept_record.update(record)
-            self._exec_update(merged_records.values(), duplicate_update=False)
+            self._exec_update(merged_records.values(), progress,
+                              duplicate_update=duplicate_update)
+            checkpoint.mark(comcode)
+            progress.stock_done()
+        progress.finish()
         src_cursor.close()
         src_conn.close()
 
     def _update_table(self, first):
         self._first_update() if first else self._update_by_mtime()
 
-    def _exec_update(self, update_records, duplicate_update=True):
+    def _exec_update(self, update_records, progress: StageProgress,
+                     duplicate_update=True):
+        """:param update_records: records cleaned by _clear_records"""
         dest_conn = get_dest_connect()
-        with MySQLDictCursorWrapper(dest_conn) as dest_cursor:
-            for record in update_records:
-                update_record = self._clear_record(record)
-                if not update_record or len(update_record) == 0:
-                    continue
+        with MySQLDictCursorWrapper(dest_conn) as dest_cursor, \
+                dest_conn.transaction():
+            for update_record in update_records:
                 _insert_record(dest_cursor, self._table, update_record,
                                duplicate_update)
+                progress.written()
         dest_conn.close()
 
     @staticmethod
-    def _clear_record(record: Dict) -> Dict:
-        comcode = record.get("comcode")
-        stockcode = comecode_map().get(comcode)
-
-        # this stockcode is not in our interesting instruments
-        if not stockcode:
-            return None
-
-        # handle revenue and operating_revenue for
-        # http://jira.ricequant.com/browse/ENG-2449
-        if record.get("revenue") == 0 and record.get("operating_revenue"):
-            del record["revenue"]
-
-        update_record = dict()
-        for key, value in record.items():
-            # update_record does not contain None value record.
-            # and stockcode is from comcode_map based on comcode, not query
-            # record.
-            if not value or key == 'stockcode':
-                pass
-            elif key in ('rpt_src',):
-                update_record[key] = value
-            elif key in ('comcode',):  # comcode must be in query record.
-                update_record[key] = value
-                updated_code = stockcode_map().get(stockcode)
-                if not updated_code:
-                    raise ValueError(
-                        "Impossible to get none stockcode from stockcode map")
-                update_record['stockcode'] = updated_code
-            elif key in ('announce_date', 'end_date',):
-                date = int(value.strftime("%Y%m%d"))
-                update_record[key] = date
-                if key == 'end_date':
-                    update_record['rpt_year'] = date / 10000
-                    update_record['rpt_quarter'] = (date % 10000) / 300
-            else:
-                update_record[key] = float(value)
-        return update_record
+    def _clear_records(plan: RowPlan, rows: Iterable[Tuple]) -> Iterator[Dict]:
+        """
+        clean source rows by compiled plan of their metrics class. The rows
+        whose comcode is not in our interesting instruments are dropped.
+        """
+        code_map = comcode_orderbookid_map()
+        for row in rows:
+            update_record = plan(row, code_map)
+            if update_record:
+                yield update_record
 
 
 class PrepareQuarter(object):
     def __init__(self):
-        self._table = prepare_quarter
+        self._table = target(prepare_quarter)
 
-    def update(self):
+    def update(self, first=False):
         create_prepare_quarter()
-        self._import_quarter()
+        self._import_quarter(first)
         self._remove_late_announce_records()
 
-    def _import_quarter(self):
-        """import all records from research_quarter"""
-        _import_quarter(research_quarter, self._table)
+    def skip(self, first=False):
+        pass
+
+    def _import_quarter(self, first):
+        """
+        import records from research_quarter. All records are imported by
+        first update, whose table may be an empty shadow table, or if timeslot
+        is negative.
+        """
+        all_update = first or get_timeslot() < 0
+        with bulk_load([self._table], enabled=all_update):
+            _import_quarter(target(research_quarter), self._table,
+                            all_update)
 
     def _remove_late_announce_records(self):
         """
@@ -304,15 +431,20 @@ class PrepareQuarter(object):
         announce_date is equal to or larger than that of its next latter
         quarter record, then this record is so called late announcement record.
         """
+        dest = dest_backend()
+        stockcodes = stockcode_map()
+        stage = table_name(self._table) + '.remove_late_announce_records'
+        checkpoint = stage_checkpoint(stage)
+        if _finished(checkpoint):
+            return
         dest_conn = get_dest_connect()
         src_conn = get_dest_connect()
-        percent = 0
-        for _, order_book_id in stockcode_map().items():
-            percent += 1
-            print("{0} prepare_quarter remove late announce records finished "
-                  "{1:.2f}%".format(datetime.datetime.now(),
-                                    percent / len(stockcode_map()) * 100))
-            select_sql, select_params = query.fields(
+        progress = start_stage(stage, len(stockcodes))
+        for _, order_book_id in stockcodes.items():
+            if checkpoint.done(order_book_id):
+                progress.stock_done()
+                continue
+            select_sql, select_params = dest.query.fields(
                 self._table.stockcode, self._table.end_date,
                 self._table.announce_date, self._table.comcode
             ).tables(
@@ -326,18 +458,21 @@ class PrepareQuarter(object):
                 src_cursor.execute(select_sql, select_params)
                 latest_ann_date = 29991231
                 last_deleted = False
-                with MySQLDictCursorWrapper(dest_conn) as dest_cursor:
+                with MySQLDictCursorWrapper(dest_conn) as dest_cursor, \
+                        dest_conn.transaction():
                     for record in src_cursor:
+                        progress.read()
                         ann_date = record.get("announce_date")
                         enddate = record.get("end_date")
                         if latest_ann_date <= ann_date:
-                            delete_sql, delete_params = query.tables(
+                            delete_sql, delete_params = dest.query.tables(
                                 self._table
                             ).where(
                                 (self._table.stockcode == order_book_id) &
                                 (self._table.end_date == enddate)
                             ).delete()
                             dest_cursor.execute(delete_sql, delete_params)
+                            progress.written()
                             last_deleted = True
                             print(
                                 "deleted record: stockcode = {}, end_date = {},"
@@ -346,50 +481,78 @@ class PrepareQuarter(object):
                                                              ann_date))
                         else:
                             if last_deleted:
-                                update_sql, update_params = query.tables(
-                                    self._table
-                                ).where(
-                                    (self._table.stockcode == order_book_id) &
-                                    (self._table.end_date == enddate)
-                                ).update({
-                                    self._table.announce_to: latest_ann_date
-                                })
+                                update_sql, update_params = \
+                                    dest.query.tables(
+                                        self._table
+                                    ).where(
+                                        (self._table.stockcode ==
+                                         order_book_id) &
+                                        (self._table.end_date == enddate)
+                                    ).update({
+                                        self._table.announce_to:
+                                            latest_ann_date
+                                    })
                                 dest_cursor.execute(update_sql, update_params)
+                                progress.written()
                                 last_deleted = False
                             latest_ann_date = ann_date
+            checkpoint.mark(order_book_id)
+            progress.stock_done()
+        progress.finish()
+        checkpoint.finish()
         src_conn.close()
         dest_conn.close()
 
 
 class StrategyQuarter(object):
     def __init__(self):
-        self._table = strategy_quarter
+        self._table = target(strategy_quarter)
 
-    def update(self):
+    def update(self, first=False):
         create_strategy_quarter()
-        self._import_quarter()
+        create_strategy_quarter_metrics()
+        self._import_quarter(first)
         self._update_announce_date()
+        self._sync_metrics()
+
+    def skip(self, first=False):
+        pass
 
-    def _import_quarter(self):
-        _import_quarter(prepare_quarter, self._table)
+    def _import_quarter(self, first):
+        """import records from prepare_quarter, see PrepareQuarter"""
+        all_update = first or get_timeslot() < 0
+        with bulk_load([self._table], enabled=all_update):
+            _import_quarter(target(prepare_quarter), self._table,
+                            all_update)
 
     def _update_announce_date(self):
         """
         update announce date. It is necessary to update announce_to for newly
         quarter report in prepare_quarter
         """
+        dest = dest_backend()
+        src_table = target(prepare_quarter)
+        stockcodes = stockcode_map()
+        stage = table_name(self._table) + '.update_announce_date'
+        checkpoint = stage_checkpoint(stage)
+        if _finished(checkpoint):
+            return
         src_conn = get_dest_connect()
         dest_conn = get_dest_connect()
-        for _, order_book_id in stockcode_map().items():
-            select_sql, select_params = query.fields(
-                prepare_quarter.stockcode, prepare_quarter.end_date,
-                prepare_quarter.announce_to, prepare_quarter.comcode
+        progress = start_stage(stage, len(stockcodes))
+        for _, order_book_id in stockcodes.items():
+            if checkpoint.done(order_book_id):
+                progress.stock_done()
+                continue
+            select_sql, select_params = dest.query.fields(
+                src_table.stockcode, src_table.end_date,
+                src_table.announce_to, src_table.comcode
             ).tables(
-                prepare_quarter
+                src_table
             ).where(
-                prepare_quarter.stockcode == order_book_id
+                src_table.stockcode == order_book_id
             ).order_by(
-                prepare_quarter.end_date.desc()
+                src_table.end_date.desc()
             ).select()
             with MySQLDictCursorWrapper(src_conn) as src_cursor:
                 src_cursor.execute(select_sql, select_params)
@@ -399,23 +562,79 @@ class StrategyQuarter(object):
                                       record.get('announce_to'),
                                       record.get('comcode')
                                   ) for record in src_cursor]
+                progress.read(len(update_records))
                 if len(update_records) == 0:
+                    checkpoint.mark(order_book_id)
+                    progress.stock_done()
                     continue
                 with MySQLDictCursorWrapper(dest_conn) as dest_cursor:
-                    insert_sql, insert_params = query.fields(
+                    insert_sql, insert_params = dest.query.fields(
                         self._table.stockcode, self._table.end_date,
                         self._table.announce_to, self._table.comcode
                     ).tables(self._table).insert(
                         values=update_records,
                         on_duplicate_key_update=OrderedDict((
                             (self._table.announce_to,
-                             func.VALUES(self._table.announce_to)),
+                             dest.inserted(self._table.announce_to)),
                         ))
                     )
                     dest_cursor.execute(insert_sql, insert_params)
+                    progress.written(len(update_records))
+            checkpoint.mark(order_book_id)
+            progress.stock_done()
+        progress.finish()
+        checkpoint.finish()
         dest_conn.close()
         src_conn.close()
 
+    def _sync_metrics(self):
+        """
+        copy the columns of day-level recalculation into
+        strategy_quarter_metrics, so that recalculation reads the narrow
+        table instead of the wide rows of strategy_quarter. The records of
+        every stock are replaced, so the records deleted from strategy_quarter
+        are also deleted.
+        """
+        dest = dest_backend()
+        metrics_table = target(strategy_quarter_metrics)
+        stockcodes = stockcode_map()
+        stage = table_name(self._table) + '.sync_metrics'
+        checkpoint = stage_checkpoint(stage)
+        if _finished(checkpoint):
+            return
+        dest_conn = get_dest_connect()
+        progress = start_stage(stage, len(stockcodes))
+        for _, order_book_id in stockcodes.items():
+            if checkpoint.done(order_book_id):
+                progress.stock_done()
+                continue
+            delete_sql, delete_params = dest.query.tables(
+                metrics_table
+            ).where(
+                metrics_table.stockcode == order_book_id
+            ).delete()
+            insert_sql, insert_params = dest.query.fields(*[
+                getattr(metrics_table, column)
+                for column in QUARTER_METRICS_COLUMNS
+            ]).tables(metrics_table).insert(
+                values=dest.query.fields(*[
+                    getattr(self._table, column)
+                    for column in QUARTER_METRICS_COLUMNS
+                ]).tables(self._table).where(
+                    self._table.stockcode == order_book_id
+                )
+            )
+            with MySQLDictCursorWrapper(dest_conn) as dest_cursor, \
+                    dest_conn.transaction():
+                dest_cursor.execute(delete_sql, delete_params)
+                dest_cursor.execute(insert_sql, insert_params)
+                progress.written(dest_cursor.rowcount)
+            checkpoint.mark(order_book_id)
+            progress.stock_done()
+        progress.finish()
+        checkpoint.finish()
+        dest_conn.close()
+
 
 class AnnounceDateAdjustement(object):
     """
@@ -538,9 +757,56 @@ class AnnounceDateAdjustement(object):
         return self._values
 
 
-def update_quarter(first=False):
-    research_handler = ResearchQuarter()
-    research_handler.update(first)
-    handlers = [PrepareQuarter(), StrategyQuarter()]
-    for handler in handlers:
-        handler.update()
+def _profiled_update(stage: str, update, *args):
+    reset_profiles(stage)
+    with profiled(stage):
+        update(*args)
+    merge_profiles(stage)
+
+
+def update_quarter(first=False, shard_index=0, shard_count=1,
+                   order_book_ids=None, run_id=None):
+    """
+    update quarter tables. Several hosts can update the tables together, each
+    one updates the stocks of one shard, see shard.set_shard(). Sharded runs
+    update the live tables in place, since one host can not swap in the
+    tables rebuilt by all hosts.
+
+    :param run_id: if it is not None, the progress of every stage and stock
+                   is checkpointed in quarter_checkpoint table. Running again
+                   with the same run_id resumes at the first unfinished stage
+                   and stock. The finished tables are skipped only if they
+                   have not been changed since they were finished, otherwise
+                   they and all tables after them are updated again.
+    """
+    set_shard(shard_index, shard_count, order_book_ids)
+    reset_code_maps()
+    start_run(shard_key(run_id) if run_id is not None else None)
+    if run_complete():
+        print(datetime.datetime.now(), 'run', run_id, 'was finished.')
+        return
+    refresh_snapshots([table_name(table) for table in QUARTER_TABLES_MAP] +
+                      [table_name(stk_code)])
+    # quarter tables of first update are rebuilt and swapped in together,
+    # the handlers are created in the rebuild to write the shadow tables.
+    with rebuild([research_quarter, prepare_quarter, strategy_quarter,
+                  strategy_quarter_metrics],
+                 enabled=first and not is_sharded(), resume=run_started()):
+        handlers = [(ResearchQuarter(), (first,)),
+                    (PrepareQuarter(), (first,)),
+                    (StrategyQuarter(), (first,))]
+        upstream_changed = False
+        for handler, args in handlers:
+            name = table_name(handler._table)
+            state = table_state(name)
+            if state == COMPLETE and not upstream_changed:
+                print(datetime.datetime.now(), name, 'was finished, skipped.')
+                handler.skip(*args)
+                continue
+            if state == CHANGED or upstream_changed:
+                reset_table(name)
+            _profiled_update(base_table_name(name), handler.update, *args)
+            finish_table(name)
+            # the tables after it are built from the updated records
+            upstream_changed = True
+    finish_run()
@@ -0,0 +1,87 @@
+import datetime
+from typing import Dict
+
+from sqlbuilder.smartsql import T, func
+
+from config import get_dest_connect
+from .backend import dest_query
+from .conn import MySQLDictCursorWrapper
+from .metrics import query, sync_watermark
+
+
+def load_watermarks() -> Dict[str, datetime.datetime]:
+    """
+    get the high-water mark of every source table which was synchronized
+    successfully before.
+
+    :return: dictionary, key is source table name like "stk_income_gen" and
+             value is the maximum mtime which has been handled.
+    """
+    dest_conn = get_dest_connect()
+    with MySQLDictCursorWrapper(dest_conn) as cursor:
+        cursor.execute(
+            *dest_query().fields(
+                sync_watermark.table_name,
+                sync_watermark.mtime
+            ).tables(
+                sync_watermark
+            ).select()
+        )
+        ret = {r['table_name']: r['mtime'] for r in cursor.fetchall()}
+    dest_conn.close()
+    return ret
+
+
+def save_watermark(table_name: str, mtime: datetime.datetime):
+    """
+    persist the high-water mark of source table. It must be called after all
+    records whose mtime is not larger than mtime have been stored.
+    """
+    record = {
+        'table_name': table_name,
+        'mtime': mtime,
+        'updated_at': datetime.datetime.now(),
+    }
+    dest_conn = get_dest_connect()
+    with MySQLDictCursorWrapper(dest_conn) as cursor:
+        cursor.execute(
+            *dest_query().tables(sync_watermark).insert(
+                record,
+                on_duplicate_key_update=record
+            )
+        )
+    dest_conn.close()
+
+
+def max_mtime(src_conn, table: T, since=None, start=None):
+    """
+    query current maximum mtime of source table. If neither since nor start
+    is given, MAX(mtime) is over the whole table, which is a full scan if
+    mtime is not indexed. It is only done once for a table without
+    high-water mark, such as the first update.
+
+    :param src_conn: source connection
+    :param table: source table, such as stk_income_gen
+    :param since: if it is not None, only consider records modified after it.
+    :param start: if since is None and it is not None, only consider records
+                  modified at or after it, such as the rehandle window of a
+                  table without high-water mark.
+    :return: maximum mtime, None if no record was modified after since.
+    """
+    condition = None
+    if since is not None:
+        condition = table.mtime > since
+    elif start is not None:
+        condition = table.mtime >= start
+    with MySQLDictCursorWrapper(src_conn) as cursor:
+        cursor.execute(
+            *query.fields(
+                func.MAX(table.mtime).as_('max_mtime')
+            ).tables(
+                table
+            ).where(
+                condition
+            ).select()
+        )
+        ret = cursor.fetchall()
+    return ret[0].get('max_mtime') if len(ret) != 0 else None
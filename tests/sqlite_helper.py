@@ -0,0 +1,34 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from config import init_with
+
+
+class SQLiteConfig(object):
+    """config of sqlite destination at path, extra has other config keys"""
+
+    def __init__(self, path, extra=None):
+        self._conf = {'data.dest': {'backend': 'sqlite', 'path': path}}
+        self._conf.update(extra or {})
+
+    def get(self, path):
+        return self._conf[path]
+
+
+class SQLiteTestCase(TestCase):
+    """
+    test case on an empty sqlite destination in a temporary directory, which
+    is removed after every test. extra_conf is added to its config.
+    """
+    extra_conf = {}
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        init_with(SQLiteConfig(os.path.join(self.dir, 'fundamentals.db'),
+                               self.extra_conf))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
@@ -0,0 +1,27 @@
+from unittest import TestCase
+
+from benchmarks.compare import compare
+from benchmarks.micro import BENCHMARKS, _queries_of
+from fdhandle.fixtures import Fixture
+
+
+class TestMicroBenchmarks(TestCase):
+    def test_run(self):
+        fixture = Fixture(years=3)
+        with _queries_of(fixture):
+            for name, build in BENCHMARKS.items():
+                function, items = build(fixture)
+                function()
+                self.assertGreater(items, 0, name)
+
+
+class TestCompare(TestCase):
+    def test_compare(self):
+        baseline = {'results': {'a': {'seconds': 1.0}, 'b': {'seconds': 2.0},
+                                'c': {'seconds': 1.0}}}
+        current = {'results': {'a': {'seconds': 1.05}, 'b': {'seconds': 2.5},
+                               'd': {'seconds': 1.0}}}
+        self.assertEqual(
+            [(c.name, c.regressed) for c in compare(baseline, current, 0.1)],
+            [('a', False), ('b', True), ('c', False), ('d', False)])
+        self.assertAlmostEqual(compare(baseline, current)[1].change, 0.25)
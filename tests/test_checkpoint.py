@@ -0,0 +1,78 @@
+from unittest import mock
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from config import get_dest_connect
+from fdhandle import checkpoint
+from fdhandle.createtable import create_prepare_quarter, \
+    create_strategy_quarter
+from fdhandle.update import StrategyQuarter
+from sqlite_helper import SQLiteTestCase
+
+
+class TestCheckpoint(SQLiteTestCase):
+    def setUp(self):
+        super().setUp()
+        checkpoint.start_run('run')
+
+    def tearDown(self):
+        checkpoint.start_run(None)
+        super().tearDown()
+
+    def test_stage(self):
+        stage = checkpoint.stage_checkpoint('prepare_quarter.import')
+        self.assertFalse(stage.resumed)
+        stage.save_state({'stk_mkt': None})
+        stage.mark('000001.XSHE')
+
+        stage = checkpoint.stage_checkpoint('prepare_quarter.import')
+        self.assertTrue(stage.resumed)
+        self.assertTrue(stage.done('000001.XSHE'))
+        self.assertFalse(stage.done('000002.XSHE'))
+        self.assertFalse(stage.complete)
+        self.assertEqual(stage.state(), {'stk_mkt': None})
+        stage.finish()
+        self.assertTrue(
+            checkpoint.stage_checkpoint('prepare_quarter.import').complete)
+
+    def test_table(self):
+        create_prepare_quarter()
+        self.assertEqual(checkpoint.table_state('prepare_quarter'),
+                         checkpoint.PARTIAL)
+        checkpoint.stage_checkpoint('prepare_quarter.import').finish()
+        checkpoint.finish_table('prepare_quarter')
+        self.assertEqual(checkpoint.table_state('prepare_quarter'),
+                         checkpoint.COMPLETE)
+
+        connect = get_dest_connect()
+        connect.cursor().execute(
+            "INSERT INTO prepare_quarter (stockcode, comcode, end_date) "
+            "VALUES ('000001.XSHE', 1, 20151231)")
+        connect.close()
+        self.assertEqual(checkpoint.table_state('prepare_quarter'),
+                         checkpoint.CHANGED)
+        checkpoint.reset_table('prepare_quarter')
+        self.assertEqual(checkpoint.table_state('prepare_quarter'),
+                         checkpoint.PARTIAL)
+        self.assertFalse(
+            checkpoint.stage_checkpoint('prepare_quarter.import').complete)
+
+    def test_without_run(self):
+        checkpoint.start_run(None)
+        stage = checkpoint.stage_checkpoint('prepare_quarter.import')
+        stage.mark('000001.XSHE')
+        stage.finish()
+        self.assertFalse(
+            checkpoint.stage_checkpoint('prepare_quarter.import').complete)
+        self.assertFalse(checkpoint.run_started())
+
+    def test_stock_without_quarters(self):
+        create_prepare_quarter()
+        create_strategy_quarter()
+        # the stage is interrupted before it is finished
+        with mock.patch('fdhandle.update.stockcode_map',
+                        return_value={'000001': '000001.XSHE'}), \
+                mock.patch.object(checkpoint.StageCheckpoint, 'finish'):
+            StrategyQuarter()._update_announce_date()
+        stage = checkpoint.stage_checkpoint(
+            'strategy_quarter.update_announce_date')
+        self.assertTrue(stage.done('000001.XSHE'))
@@ -0,0 +1,100 @@
+import math
+from unittest import TestCase, mock
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from fdhandle.backend import dest_query
+from fdhandle.createtable import create_orig_day
+from fdhandle.daily import _delete_keys, _key_conditions, recalculate
+from fdhandle.fixtures import Fixture
+from fdhandle.metrics import DAY_COLUMNS, orig_day
+from fdhandle.session import Session, DEST
+from fdhandle.recal import RecalDayMetrics
+from sqlite_helper import SQLiteTestCase
+
+_INNER_CODE = 1001
+
+
+class TestDateMajor(TestCase):
+    def setUp(self):
+        self.fixture = Fixture(years=4)
+        self.order_book_id = '000001.XSHE'
+
+    def _by_stock(self):
+        with mock.patch('fdhandle.recal._quarter_metrics',
+                        return_value=self.fixture.reports):
+            recal_obj = RecalDayMetrics(self.order_book_id)
+        records = [dict(r) for r in self.fixture.day_records]
+        return recal_obj.compute(self.fixture.closing_prices, records)
+
+    def _by_date(self):
+        day_metrics = [dict(r, inner_code=_INNER_CODE)
+                       for r in self.fixture.day_records]
+        # another stock is not in the stocks to recalculate
+        day_metrics.append(dict(self.fixture.day_records[0], inner_code=2))
+        closing_prices = {(_INNER_CODE, d): price for d, price
+                          in self.fixture.closing_prices.items()}
+        return recalculate(day_metrics, closing_prices,
+                           {self.order_book_id: self.fixture.reports},
+                           {_INNER_CODE: self.order_book_id})
+
+    def test_same_as_by_stock(self):
+        orig_expected, recal_expected = self._by_stock()
+        orig_records, recal_records = self._by_date()
+        self.assertEqual(len(recal_records), len(recal_expected))
+        self.assertEqual(orig_records, orig_expected)
+        for expected, record in zip(recal_expected, recal_records):
+            for column in DAY_COLUMNS:
+                value = expected.get(column)
+                if value is None or isinstance(value, str):
+                    self.assertEqual(record[column], value, column)
+                else:
+                    self.assertTrue(math.isclose(record[column], value,
+                                                 rel_tol=1e-9, abs_tol=1e-4),
+                                    (column, record[column], value))
+
+    def test_zero_book_value(self):
+        # per-stock mode fails on zero book value, it is missing here
+        for report in self.fixture.reports:
+            report['book_value_per_share'] = 0.0
+        _, recal_records = self._by_date()
+        self.assertEqual({r['pb_ratio'] for r in recal_records}, {None})
+
+
+class TestRevisions(SQLiteTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orig_day()
+
+    def test_key_conditions(self):
+        # new trade date of all stocks is one statement
+        keys = {('000001.XSHE', 20160105), ('000002.XSHE', 20160105),
+                ('000003.XSHE', 20160105)}
+        self.assertEqual(len(list(_key_conditions(
+            keys, orig_day.stockcode, orig_day.tradedate))), 1)
+        # revised history of one stock is one statement
+        keys = {('000001.XSHE', 20160104), ('000001.XSHE', 20160105),
+                ('000002.XSHE', 20160105)}
+        self.assertEqual(len(list(_key_conditions(
+            keys, orig_day.stockcode, orig_day.tradedate))), 2)
+
+    def test_delete_keys(self):
+        records = [(stockcode, tradedate) for stockcode in
+                   ('000001.XSHE', '000002.XSHE')
+                   for tradedate in (20160104, 20160105, 20160106)]
+        with Session() as session:
+            with session.transaction(DEST):
+                session.executemany(
+                    DEST, "INSERT INTO orig_day (stockcode, tradedate) "
+                          "VALUES (?, ?)", records)
+                _delete_keys(session, orig_day,
+                             {('000001.XSHE', 20160104),
+                              ('000001.XSHE', 20160106),
+                              ('000002.XSHE', 20160105)})
+            rows = session.fetchall(DEST, *dest_query().fields(
+                orig_day.stockcode, orig_day.tradedate
+            ).tables(orig_day).order_by(
+                orig_day.stockcode, orig_day.tradedate).select())
+        self.assertEqual([(r['stockcode'], r['tradedate']) for r in rows],
+                         [('000001.XSHE', 20160105),
+                          ('000002.XSHE', 20160104),
+                          ('000002.XSHE', 20160106)])
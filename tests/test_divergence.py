@@ -0,0 +1,65 @@
+import math
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from config import get_dest_connect
+from fdhandle.createtable import create_orig_day, create_recal_day
+from fdhandle.divergence import DATE, OUTLIER, STOCK, report_divergence
+from sqlite_helper import SQLiteTestCase
+
+
+class TestDivergence(SQLiteTestCase):
+    extra_conf = {
+        'divergence': {'rtol': 0.0001, 'atol': 0.0001, 'top': 2,
+                       'batch': 1},
+    }
+
+    def setUp(self):
+        super().setUp()
+        create_orig_day()
+        create_recal_day()
+
+    def test_report(self):
+        connect = get_dest_connect()
+        cursor = connect.cursor()
+        sql = "INSERT INTO {} (stockcode, tradedate, pe_ratio) " \
+              "VALUES (?, ?, ?)"
+        cursor.executemany(sql.format('orig_day'), [
+            ('000001.XSHE', 20160104, 10.0),
+            ('000001.XSHE', 20160105, 10.0),
+            ('000002.XSHE', 20160104, 20.0),
+            ('000002.XSHE', 20160105, 20.0),
+        ])
+        cursor.executemany(sql.format('recal_day'), [
+            ('000001.XSHE', 20160104, 10.0),
+            ('000001.XSHE', 20160105, 12.5),
+            ('000002.XSHE', 20160104, 20.0),
+            ('000002.XSHE', 20160105, None),
+        ])
+        connect.close()
+
+        summary = report_divergence().set_index('metric')
+        pe_ratio = summary.loc['pe_ratio']
+        self.assertEqual(pe_ratio['records'], 4)
+        self.assertEqual(pe_ratio['diverged'], 1)
+        self.assertEqual(pe_ratio['missing_recal'], 1)
+        self.assertEqual(pe_ratio['p50'], 0.0)
+        self.assertAlmostEqual(pe_ratio['max_diff'], 0.25)
+        self.assertEqual(pe_ratio['stockcode'], '000001.XSHE')
+        self.assertEqual(summary.loc['pb_ratio']['records'], 4)
+        self.assertTrue(math.isnan(summary.loc['pb_ratio']['p50']))
+
+        connect = get_dest_connect()
+        cursor = connect.cursor()
+        cursor.execute(
+            "SELECT scope, scope_key, diverged FROM recal_divergence "
+            "WHERE metric = 'pe_ratio' AND scope != 'metric' "
+            "ORDER BY scope, scope_key")
+        rows = [tuple(r) for r in cursor.fetchall()]
+        connect.close()
+        self.assertEqual(rows, [
+            (DATE, '20160105', 1),
+            (OUTLIER, '1', None),
+            (OUTLIER, '2', None),
+            (STOCK, '000001.XSHE', 1),
+            (STOCK, '000002.XSHE', 0),
+        ])
@@ -0,0 +1,72 @@
+import datetime
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from config import get_dest_connect
+from fdhandle.createtable import create_orig_day, create_recal_day, \
+    create_recal_job
+from fdhandle.jobs import DONE, LEASED, JobQueue, enqueue, job_stats
+from fdhandle.recal import _write_job
+from fdhandle.session import Session, DEST
+from sqlite_helper import SQLiteTestCase
+
+
+class TestJobQueue(SQLiteTestCase):
+    extra_conf = {
+        'job_queue': {'lease': 600},
+    }
+
+    def setUp(self):
+        super().setUp()
+        create_recal_job()
+        enqueue('run', ['000001.XSHE', '000002.XSHE'])
+
+    @staticmethod
+    def _expire(order_book_id):
+        connect = get_dest_connect()
+        cursor = connect.cursor()
+        cursor.execute('UPDATE recal_job SET lease_until = ? '
+                       'WHERE order_book_id = ?',
+                       (datetime.datetime(2000, 1, 1), order_book_id))
+        connect.close()
+
+    def test_claim_and_complete(self):
+        jobs = JobQueue('run')
+        first = jobs.get()
+        second = jobs.get()
+        self.assertEqual({first, second}, {'000001.XSHE', '000002.XSHE'})
+        self.assertIsNone(jobs.get())
+        jobs.complete(first, 10)
+        stats = job_stats('run')
+        self.assertEqual(stats[DONE], {'jobs': 1, 'records': 10})
+        self.assertEqual(stats[LEASED]['jobs'], 1)
+
+        # restarted run keeps the completed job
+        enqueue('run', ['000001.XSHE', '000002.XSHE'])
+        self.assertEqual(job_stats('run')[DONE]['jobs'], 1)
+
+    def test_expired_lease(self):
+        jobs = JobQueue('run')
+        claimed = jobs.get()
+        self._expire(claimed)
+        # the expired job is claimable again, together with the pending one
+        self.assertEqual({jobs.get(), jobs.get()},
+                         {'000001.XSHE', '000002.XSHE'})
+        self.assertIsNone(jobs.get())
+
+    def test_claimed_twice(self):
+        create_orig_day()
+        create_recal_day()
+        jobs = JobQueue('run')
+        claimed = jobs.get()
+        records = [{'stockcode': claimed, 'tradedate': tradedate,
+                    'pe_ratio': 1.0} for tradedate in (20160104, 20160105)]
+        with Session() as session:
+            _write_job(session, jobs, claimed, records, records)
+        self._expire(claimed)
+        self.assertIn(claimed, {jobs.get(), jobs.get()})
+        # the stock written by the expired lease is written again, instead
+        # of failing on duplicated keys.
+        with Session() as session:
+            _write_job(session, jobs, claimed, records, records)
+            rows = session.fetchall(DEST, 'SELECT COUNT(*) AS n FROM orig_day')
+        self.assertEqual(rows[0]['n'], 2)
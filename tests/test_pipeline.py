@@ -0,0 +1,24 @@
+import queue
+from unittest import TestCase
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from fdhandle.recal import _PipelineMain, _pipeline_get, _pipeline_put
+
+
+class TestPipeline(TestCase):
+    def test_failed_peer(self):
+        main = _PipelineMain()
+        main.error = ValueError('compute failed')
+        pipe = queue.Queue(maxsize=1)
+        pipe.put('stock')
+        # the producer stops waiting on the full pipe
+        self.assertRaises(ValueError, _pipeline_put, pipe, 'stock', main)
+
+    def test_stopped_peer(self):
+        main = _PipelineMain()
+        pipe = queue.Queue(maxsize=1)
+        _pipeline_put(pipe, 'stock', main)
+        self.assertEqual(_pipeline_get(pipe, main), 'stock')
+        main.stopped = True
+        # the consumer stops waiting on the empty pipe
+        self.assertRaises(RuntimeError, _pipeline_get, pipe, main)
@@ -0,0 +1,97 @@
+from unittest import mock
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from config import get_dest_connect
+from fdhandle.backend import dest_backend
+from fdhandle.conn import MySQLDictCursorWrapper
+from fdhandle.createtable import create_orig_day, \
+    create_prepare_quarter, create_research_quarter, existing_managed_indexes
+from fdhandle.generation import target
+from fdhandle.metrics import orig_day, prepare_quarter
+from fdhandle.rebuild import rebuild, rollback
+from fdhandle.session import Session, DEST
+from fdhandle.templates import insert_template
+from fdhandle.update import PrepareQuarter
+from sqlite_helper import SQLiteTestCase
+
+
+def _insert(codes):
+    insert_sql = insert_template(target(orig_day), ('stockcode', 'tradedate'))
+    with Session() as session:
+        with session.transaction(DEST):
+            session.executemany(DEST, insert_sql,
+                                [(code, 20160104) for code in codes])
+
+
+def _codes(table_name):
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        cursor.execute('SELECT stockcode FROM `{}` ORDER BY stockcode'
+                       .format(table_name))
+        ret = [r['stockcode'] for r in cursor.fetchall()]
+    connect.close()
+    return ret
+
+
+class TestRebuild(SQLiteTestCase):
+    extra_conf = {
+        'rebuild': {'enabled': True, 'min_ratio': 0.5},
+        'update.timeslot': 0,
+    }
+
+    def setUp(self):
+        super().setUp()
+        create_orig_day()
+        _insert(['000001.XSHE', '000002.XSHE'])
+
+    def test_swap_and_rollback(self):
+        with rebuild([orig_day]):
+            create_orig_day()
+            _insert(['000001.XSHE', '000002.XSHE', '000004.XSHE'])
+            self.assertEqual(_codes('orig_day'),
+                             ['000001.XSHE', '000002.XSHE'])
+        self.assertEqual(_codes('orig_day'),
+                         ['000001.XSHE', '000002.XSHE', '000004.XSHE'])
+        self.assertEqual(_codes('orig_day_prev'),
+                         ['000001.XSHE', '000002.XSHE'])
+
+        # indexes of the renamed tables are still managed
+        connect = get_dest_connect()
+        with MySQLDictCursorWrapper(connect) as cursor:
+            for name in ('orig_day', 'orig_day_prev'):
+                self.assertEqual(
+                    len(existing_managed_indexes(cursor, name)), 1)
+        connect.close()
+
+        rollback([orig_day])
+        self.assertEqual(_codes('orig_day'), ['000001.XSHE', '000002.XSHE'])
+
+    def test_rejected(self):
+        with self.assertRaises(RuntimeError):
+            with rebuild([orig_day]):
+                create_orig_day()
+                _insert([])
+        self.assertEqual(_codes('orig_day'), ['000001.XSHE', '000002.XSHE'])
+        connect = get_dest_connect()
+        with MySQLDictCursorWrapper(connect) as cursor:
+            self.assertFalse(dest_backend().table_exists(cursor,
+                                                         'orig_day_prev'))
+        connect.close()
+
+    def test_import_all_quarters(self):
+        create_research_quarter()
+        connect = get_dest_connect()
+        connect.cursor().executemany(
+            "INSERT INTO research_quarter (stockcode, comcode, end_date) "
+            "VALUES (?, ?, ?)",
+            [('000001.XSHE', 1, 20150930), ('000001.XSHE', 1, 20151231)])
+        connect.close()
+        # all quarters are imported into the empty shadow table, though
+        # timeslot is not negative.
+        with mock.patch('fdhandle.update.stockcode_map',
+                        return_value={'000001': '000001.XSHE'}):
+            with rebuild([prepare_quarter]):
+                create_prepare_quarter()
+                PrepareQuarter()._import_quarter(True)
+        self.assertEqual(_codes('prepare_quarter'),
+                         ['000001.XSHE', '000001.XSHE'])
@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from config import init_with
+from fdhandle import registry
+
+
+class _Config(object):
+    def __init__(self, files, cache):
+        self._conf = {'instruments': files, 'instrument_cache': cache}
+
+    def get(self, path):
+        return self._conf[path]
+
+
+class TestRegistry(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.xshe = os.path.join(self.dir, 'XSHE_Instruments.csv')
+        self.xshg = os.path.join(self.dir, 'XSHG_Instruments.csv')
+        with open(self.xshe, mode='wt') as f:
+            f.write('OrderBookID,Symbol,ListedDate,Unused\n'
+                    '000001.XSHE,PAB,1991-04-03,x\n'
+                    '000002.XSHE,VANKE,,x\n')
+        with open(self.xshg, mode='wt') as f:
+            f.write('OrderBookID,Symbol\n600000.XSHG,SPDB\n')
+        self.cache = os.path.join(self.dir, 'instruments.cache')
+        init_with(_Config([self.xshe, self.xshg], self.cache))
+        registry._registry = None
+
+    def tearDown(self):
+        registry._registry = None
+        shutil.rmtree(self.dir)
+
+    def test_registry(self):
+        ret = registry.registry()
+        self.assertEqual(ret.order_book_ids,
+                         ['000001.XSHE', '000002.XSHE', '600000.XSHG'])
+        self.assertEqual(ret.stockcode_map['600000'], '600000.XSHG')
+        self.assertEqual(ret.exchange_map['XSHE'],
+                         ['000001.XSHE', '000002.XSHE'])
+        self.assertEqual(ret.get('000001.XSHE').listed_date, '1991-04-03')
+        self.assertIsNone(ret.get('000002.XSHE').listed_date)
+        self.assertIsNone(ret.get('600000.XSHG').listed_date)
+        self.assertIs(registry.registry(), ret)
+
+    def test_cache(self):
+        registry.registry()
+        self.assertTrue(os.path.exists(self.cache))
+        registry._registry = None
+        # parsed from cache while the files are not modified
+        parse = registry._parse
+        registry._parse = None
+        try:
+            ret = registry.registry()
+        finally:
+            registry._parse = parse
+        self.assertEqual(len(ret.order_book_ids), 3)
+
+        with open(self.xshg, mode='at') as f:
+            f.write('600004.XSHG,BAIYUN\n')
+        self.assertEqual(len(registry.registry().order_book_ids), 4)
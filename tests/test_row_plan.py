@@ -0,0 +1,42 @@
+import datetime
+from decimal import Decimal
+from unittest import TestCase
+
+from fdhandle.metrics import Income, Indicator
+
+
+class TestRowPlan(TestCase):
+    def setUp(self):
+        self.columns = ('stockcode', 'announce_date', 'end_date', 'comcode',
+                        'rpt_src', 'revenue', 'operating_revenue')
+        self.code_map = {80000001: '000001.XSHE'}
+
+    def test_clear_row(self):
+        plan = Income.row_plan(self.columns)
+        record = plan(('000001', datetime.date(2016, 4, 20),
+                       datetime.datetime(2016, 3, 31), 80000001, '第一季度报',
+                       Decimal('0.00'), Decimal('12.50')), self.code_map)
+        self.assertEqual(record['stockcode'], '000001.XSHE')
+        self.assertEqual(record['comcode'], 80000001)
+        self.assertEqual(record['announce_date'], 20160420)
+        self.assertEqual(record['end_date'], 20160331)
+        self.assertEqual(int(record['rpt_year']), 2016)
+        self.assertEqual(int(record['rpt_quarter']), 1)
+        self.assertEqual(record['rpt_src'], '第一季度报')
+        self.assertEqual(record['operating_revenue'], 12.5)
+        self.assertNotIn('revenue', record)
+
+    def test_uninteresting_comcode(self):
+        plan = Income.row_plan(self.columns)
+        self.assertIsNone(plan(('000002', None, datetime.date(2016, 3, 31),
+                                80000002, None, None, None), self.code_map))
+
+    def test_plan_cache(self):
+        self.assertIs(Income.row_plan(list(self.columns)),
+                      Income.row_plan(self.columns))
+        self.assertIsNot(Income.row_plan(self.columns),
+                         Indicator.row_plan(self.columns))
+
+    def test_missing_comcode(self):
+        with self.assertRaises(ValueError):
+            Indicator.row_plan(('stockcode', 'end_date'))
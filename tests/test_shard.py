@@ -0,0 +1,33 @@
+from unittest import TestCase
+
+from fdhandle.shard import set_shard, in_shard, shard_of, shard_key
+
+_IDS = ['{:06d}.XSHE'.format(i) for i in range(1, 200)]
+
+
+class TestShard(TestCase):
+    def tearDown(self):
+        set_shard()
+
+    def test_partition(self):
+        slices = []
+        for i in range(4):
+            set_shard(i, 4)
+            slices.append({x for x in _IDS if in_shard(x)})
+        self.assertEqual(set().union(*slices), set(_IDS))
+        self.assertEqual(sum(len(s) for s in slices), len(_IDS))
+        self.assertTrue(all(len(s) != 0 for s in slices))
+        self.assertEqual(shard_of('000001.XSHE', 4),
+                         shard_of('000001.XSHE', 4))
+
+    def test_id_list(self):
+        set_shard(order_book_ids=['000001.XSHE'])
+        self.assertEqual([x for x in _IDS if in_shard(x)], ['000001.XSHE'])
+        self.assertNotEqual(shard_key('stk_mkt'), 'stk_mkt')
+
+    def test_key(self):
+        self.assertEqual(shard_key('stk_mkt'), 'stk_mkt')
+        set_shard(1, 4)
+        self.assertEqual(shard_key('stk_mkt'), 'stk_mkt@1of4')
+        with self.assertRaises(ValueError):
+            set_shard(4, 4)
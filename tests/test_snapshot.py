@@ -0,0 +1,65 @@
+import datetime
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import TestCase, mock
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from fdhandle.snapshot import encode, decode, concat, refresh_snapshot, \
+    snapshot
+
+
+class TestSnapshotColumn(TestCase):
+    def test_round_trip(self):
+        for values in ([Decimal('1.25'), None, Decimal('-3')],
+                       [datetime.date(2016, 1, 4), None],
+                       [datetime.datetime(2016, 1, 4, 9, 30), None],
+                       ['000001', None, '600000'],
+                       [1, None, 3],
+                       [None, None]):
+            self.assertEqual(decode(encode(values)), values)
+
+    def test_concat(self):
+        column = concat([encode([Decimal('1.5')]), encode([None]),
+                         encode([Decimal('2.125')])])
+        self.assertEqual(decode(column),
+                         [Decimal('1.5'), None, Decimal('2.125')])
+
+
+class _EmptyCursor(object):
+    column_names = ('tradedate', 'tclose', 'snapshot_seq', 'snapshot_mtime',
+                    'snapshot_partition', 'snapshot_keep')
+
+    def execute(self, sql, params):
+        pass
+
+    @staticmethod
+    def fetchmany(size):
+        return []
+
+    def close(self):
+        pass
+
+
+class TestEmptySnapshot(TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_empty_table(self):
+        connect = mock.MagicMock()
+        connect.cursor.return_value = _EmptyCursor()
+        with mock.patch('fdhandle.snapshot.get_snapshot_conf',
+                        return_value={'dir': self.dir}), \
+                mock.patch('fdhandle.snapshot.get_source_connect',
+                           return_value=connect), \
+                mock.patch('fdhandle.snapshot.max_mtime', return_value=None), \
+                mock.patch.dict('fdhandle.snapshot._snapshots'):
+            refresh_snapshot('stk_mkt')
+            empty = snapshot('stk_mkt')
+        self.assertIsNone(empty.mtime)
+        self.assertEqual(empty.column_names, ('tradedate', 'tclose'))
+        self.assertEqual(empty.records(), [])
+        self.assertEqual(empty.records(1), [])
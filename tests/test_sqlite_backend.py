@@ -0,0 +1,57 @@
+from decimal import Decimal
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from fdhandle.backend import dest_query
+from fdhandle.createtable import create_orig_day, create_recal_day
+from fdhandle.metrics import DAY_COLUMNS, orig_day, recal_day
+from fdhandle.recal import RecalDayMetrics
+from fdhandle.session import Session, DEST
+from fdhandle.templates import insert_template
+from sqlite_helper import SQLiteTestCase
+
+
+class TestSQLiteBackend(SQLiteTestCase):
+    def setUp(self):
+        super().setUp()
+        create_orig_day()
+        create_recal_day()
+
+    def test_upsert(self):
+        columns = ('stockcode', 'tradedate', 'pe_ratio')
+        insert_sql = insert_template(orig_day, columns, ('pe_ratio',))
+        with Session() as session:
+            with session.transaction(DEST):
+                session.execute(DEST, insert_sql,
+                                ('000001.XSHE', 20160104, Decimal('1.5')))
+                session.execute(DEST, insert_sql,
+                                ('000001.XSHE', 20160104, Decimal('2.5')))
+            rows = session.fetchall(
+                DEST, *dest_query().fields(
+                    orig_day.stockcode, orig_day.pe_ratio
+                ).tables(orig_day).select())
+        self.assertEqual(rows, [{'stockcode': '000001.XSHE',
+                                 'pe_ratio': Decimal('2.5')}])
+
+    def test_day_records(self):
+        # missing metrics are written as NULL, whether they are None or
+        # omitted.
+        orig_records = [
+            {'stockcode': '000001.XSHE', 'tradedate': 20160104,
+             'pe_ratio': 10.5, 'pb_ratio': None},
+            {'stockcode': '000001.XSHE', 'tradedate': 20160105,
+             'pe_ratio': 11.0, 'market_cap': 1e10},
+        ]
+        recal_records = [dict(r, pcf_ratio=2.0) for r in orig_records]
+        with Session() as session:
+            RecalDayMetrics.write(session, orig_records, recal_records)
+            # writing again replaces the records of the same dates
+            RecalDayMetrics.write(session, orig_records, recal_records,
+                                  replace=True)
+            for table, records in ((orig_day, orig_records),
+                                   (recal_day, recal_records)):
+                rows = session.fetchall(DEST, *dest_query().fields(
+                    *[getattr(table, column) for column in DAY_COLUMNS]
+                ).tables(table).order_by(table.tradedate).select())
+                self.assertEqual(rows, [
+                    {column: record.get(column) for column in DAY_COLUMNS}
+                    for record in records])
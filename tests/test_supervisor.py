@@ -0,0 +1,106 @@
+import os
+import sqlite3
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from fdhandle.createtable import create_orig_day, create_recal_day, \
+    create_recal_job
+from fdhandle.jobs import DONE, FAILED, PENDING, JobQueue, MemoryJobs, \
+    enqueue, job_stats
+from fdhandle.recal import RecalDayMetrics, _write_job
+from fdhandle.session import Session, DEST
+from fdhandle.supervisor import retry
+from sqlite_helper import SQLiteTestCase
+
+
+class TestSupervisor(SQLiteTestCase):
+    extra_conf = {
+        'job_queue': {'lease': 600},
+        'supervisor': {'retries': 2, 'backoff': 0},
+    }
+
+    def test_retry(self):
+        attempts = []
+
+        def locked(attempt):
+            attempts.append(attempt)
+            if attempt < 2:
+                raise sqlite3.OperationalError('database is locked')
+            return 'written'
+
+        self.assertEqual(retry(locked, 'write'), 'written')
+        self.assertEqual(attempts, [0, 1, 2])
+
+        attempts.clear()
+
+        def broken(attempt):
+            attempts.append(attempt)
+            raise RuntimeError('no inner code')
+
+        self.assertRaises(RuntimeError, retry, broken, 'fetch')
+        self.assertEqual(attempts, [0])
+
+    def test_memory_jobs(self):
+        jobs = MemoryJobs(['000001.XSHE', '000002.XSHE'])
+        pid = os.getpid()
+        first = jobs.get()
+        second = jobs.get()
+        jobs.complete(first, 10)
+        jobs.poll(0)
+        self.assertFalse(jobs.drained())
+
+        # the stock in flight of dead worker is put back, then dead-lettered
+        # after its second dead worker.
+        jobs.release(pid, 2)
+        self.assertEqual(jobs.get(), second)
+        jobs.poll(0)
+        jobs.release(pid, 2)
+        self.assertTrue(jobs.drained())
+        self.assertEqual([letter.order_book_id for letter in jobs.failures()],
+                         [second])
+        jobs.close()
+
+    def test_partly_written(self):
+        create_orig_day()
+        create_recal_day()
+        jobs = MemoryJobs(['000001.XSHE'])
+        claimed = jobs.get()
+        self.assertFalse(jobs.reclaimed(claimed))
+        records = [{'stockcode': claimed, 'tradedate': tradedate,
+                    'pe_ratio': 1.0} for tradedate in (20160104, 20160105)]
+        with Session() as session:
+            # the worker dies after orig_day is written
+            RecalDayMetrics.write(session, records, [])
+        jobs.poll(0)
+        jobs.release(os.getpid(), 2)
+
+        # the released stock replaces its records written partly
+        self.assertEqual(jobs.get(), claimed)
+        self.assertTrue(jobs.reclaimed(claimed))
+        with Session() as session:
+            _write_job(session, jobs, claimed, records, records)
+            for table in ('orig_day', 'recal_day'):
+                rows = session.fetchall(
+                    DEST, 'SELECT COUNT(*) AS n FROM ' + table)
+                self.assertEqual(rows[0]['n'], 2, table)
+        jobs.close()
+
+    def test_job_queue(self):
+        create_recal_job()
+        enqueue('run', ['000001.XSHE', '000002.XSHE'])
+        jobs = JobQueue('run')
+        failed = jobs.get()
+        jobs.fail(failed, 'Traceback')
+        leased = jobs.get()
+        jobs.release(os.getpid(), 2)
+        self.assertEqual(job_stats('run')[PENDING]['jobs'], 1)
+        self.assertEqual(jobs.get(), leased)
+        jobs.complete(leased, 10)
+        self.assertEqual([tuple(letter) for letter in jobs.failures()],
+                         [(failed, 'Traceback')])
+
+        # restarted run retries the failed stock
+        enqueue('run', ['000001.XSHE', '000002.XSHE'])
+        stats = job_stats('run')
+        self.assertNotIn(FAILED, stats)
+        self.assertEqual(stats[DONE]['jobs'], 1)
+        self.assertEqual(jobs.get(), failed)
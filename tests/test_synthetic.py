@@ -0,0 +1,66 @@
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from fdhandle.registry import _parse
+from benchmarks.synthetic import DEFAULT_CONFIG, OverlayConfig, Stock, \
+    stocks, trading_dates, write_instruments
+
+_CONF = {'stocks': 3, 'years': 2, 'start_year': 2015, 'seed': 1}
+
+
+class TestOverlayConfig(TestCase):
+    def test_get(self):
+        class _Base(object):
+            def get(self, path):
+                return {'data.dest': {'backend': 'mysql', 'port': 3306},
+                        'update.timeslot': -1}[path]
+
+        conf = OverlayConfig.__new__(OverlayConfig)
+        conf._base = _Base()
+        conf._overrides = {'data': {'dest': {'backend': 'sqlite'}},
+                           'synthetic': {'stocks': 10}}
+        self.assertEqual(conf.get('data.dest'),
+                         {'backend': 'sqlite', 'port': 3306})
+        self.assertEqual(conf.get('update.timeslot'), -1)
+        self.assertEqual(conf.get('synthetic'), {'stocks': 10})
+        self.assertRaises(KeyError, conf.get, 'progress')
+
+    def test_benchmark_yaml(self):
+        conf = OverlayConfig(DEFAULT_CONFIG)
+        dest = conf.get('data.dest')
+        self.assertEqual(dest['backend'], 'sqlite')
+        self.assertEqual(dest['path'], 'benchmark/fundamentals.db')
+        self.assertEqual(conf.get('update.timeslot'), 0)
+        self.assertEqual(conf.get('synthetic')['stocks'], 100)
+
+
+class TestSynthetic(TestCase):
+    def test_rows(self):
+        dates = trading_dates(datetime.date(2016, 1, 1),
+                              datetime.date(2016, 1, 10))
+        self.assertEqual(len(dates), 6)
+        columns = ('pe', 'pb')
+        rows = list(Stock(1, 1).day_rows(columns, dates, None))
+        self.assertEqual(rows, list(Stock(1, 1).day_rows(columns, dates,
+                                                         None)))
+        self.assertNotEqual(rows, list(Stock(1, 2).day_rows(columns, dates,
+                                                            None)))
+        # a delta is the tail of a full load
+        self.assertEqual(list(Stock(1, 1).day_rows(columns, dates, dates[3])),
+                         rows[4:])
+
+    def test_instruments(self):
+        directory = tempfile.mkdtemp()
+        try:
+            files = [os.path.join(directory, 'XSHE_Instruments.csv'),
+                     os.path.join(directory, 'XSHG_Instruments.csv')]
+            write_instruments(_CONF, files)
+            self.assertEqual(
+                sorted(i.order_book_id for i in _parse(files)),
+                sorted(s.order_book_id for s in stocks(_CONF)))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,48 @@
+import fdhandle  # noqa: F401, config is importable after fdhandle
+from config import get_dest_connect
+from fdhandle.createtable import create_strategy_quarter
+from verify import END_AFTER_ANNOUNCE, MISSING, NOT_DECREASING, \
+    WRONG_ANNOUNCE_TO, verify_declares
+from sqlite_helper import SQLiteTestCase
+
+
+class TestVerifyDeclares(SQLiteTestCase):
+    def setUp(self):
+        super().setUp()
+        create_strategy_quarter()
+
+    @staticmethod
+    def _insert(records):
+        connect = get_dest_connect()
+        connect.cursor().executemany(
+            "INSERT INTO strategy_quarter (stockcode, comcode, end_date, "
+            "announce_date, announce_to) VALUES (?, 1, ?, ?, ?)", records)
+        connect.close()
+
+    def test_valid(self):
+        self._insert([
+            ('000001.XSHE', 20151231, 20160310, 99991231),
+            ('000001.XSHE', 20150930, 20151020, 20160310),
+            ('000002.XSHE', 20151231, 20160320, 99991231),
+        ])
+        self.assertEqual(len(verify_declares(processes=2)), 0)
+
+    def test_violations(self):
+        self._insert([
+            ('000001.XSHE', 20151231, 20160310, 99991231),
+            ('000001.XSHE', 20150930, 20160310, 20160310),
+            ('000002.XSHE', 20151231, 20160320, 99991231),
+            ('000002.XSHE', 20150930, 20151020, 20160301),
+            ('000002.XSHE', 20150630, 20150601, 20151020),
+            ('000003.XSHE', 20151231, None, 99991231),
+            # newest record of a stock is not chained to another stock
+            ('000004.XSHE', 20151231, 20170101, 99991231),
+        ])
+        report = verify_declares(processes=2)
+        self.assertEqual(
+            [(r.stockcode, r.end_date, r.violation)
+             for r in report.itertuples()],
+            [('000001.XSHE', 20150930, NOT_DECREASING),
+             ('000002.XSHE', 20150930, WRONG_ANNOUNCE_TO),
+             ('000002.XSHE', 20150630, END_AFTER_ANNOUNCE),
+             ('000003.XSHE', 20151231, MISSING)])
@@ -1,14 +1,32 @@
+import datetime
+from multiprocessing import Pool
+from typing import List, Tuple
+
+import numpy as np
+from pandas import DataFrame, concat
+from sqlbuilder.smartsql import T
+
 import fdhandle
 
 # declare date & declare to
 from config import get_dest_connect
+from fdhandle.backend import dest_query
 from fdhandle.conn import MySQLDictCursorWrapper
-from fdhandle.metrics import query, strategy_quarter
+from fdhandle.metrics import strategy_quarter, table_name
+
+# violations of verify_declares(), they are checked by verify_declare() too
+MISSING = 'missing'
+NOT_DECREASING = 'announce_date_not_decreasing'
+WRONG_ANNOUNCE_TO = 'wrong_announce_to'
+END_AFTER_ANNOUNCE = 'end_date_not_before_announce_date'
+_VIOLATIONS = (MISSING, NOT_DECREASING, WRONG_ANNOUNCE_TO, END_AFTER_ANNOUNCE)
+_REPORT_COLUMNS = ['stockcode', 'end_date', 'announce_date', 'announce_to',
+                   'pre_announce_date', 'violation']
 
 
 def verify_declare(order_book_id: str):
     src_conn = get_dest_connect()
-    select_sql, select_param = query.fields(
+    select_sql, select_param = dest_query().fields(
         strategy_quarter.announce_date, strategy_quarter.announce_to,
         strategy_quarter.end_date
     ).tables(strategy_quarter).where(
@@ -45,6 +63,103 @@ def verify_declare(order_book_id: str):
     src_conn.close()
 
 
+def _stock_ranges(table: T, processes: int) -> List[Tuple[str, str]]:
+    """split the stocks of table into contiguous ranges of similar size"""
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        cursor.execute(*dest_query().fields(
+            table.stockcode
+        ).tables(table).group_by(table.stockcode).order_by(
+            table.stockcode
+        ).select())
+        stocks = [r['stockcode'] for r in cursor.fetchall()]
+    connect.close()
+    chunks = np.array_split(np.array(stocks, dtype=object),
+                            min(processes, len(stocks)))
+    return [(chunk[0], chunk[-1]) for chunk in chunks if len(chunk) != 0]
+
+
+def _verify_range(args) -> DataFrame:
+    """
+    check the announce chains of the stocks between first and last by one
+    ordered scan. Every record is compared with the newer record of the same
+    stock, which is the previous row.
+    """
+    name, first, last = args
+    table = getattr(T, name)
+    connect = get_dest_connect()
+    with MySQLDictCursorWrapper(connect) as cursor:
+        cursor.execute(*dest_query().fields(
+            table.stockcode, table.end_date, table.announce_date,
+            table.announce_to
+        ).tables(table).where(
+            (table.stockcode >= first) & (table.stockcode <= last)
+        ).order_by(
+            table.stockcode, table.end_date.desc()
+        ).select())
+        df = DataFrame(cursor.fetchall(), columns=_REPORT_COLUMNS[:4])
+    connect.close()
+
+    dates = df[['end_date', 'announce_date', 'announce_to']].astype(float)
+    missing = dates.isna().any(axis=1).to_numpy()
+    stocks = df['stockcode'].to_numpy()
+    announce_date = dates['announce_date'].to_numpy()
+    # announce date of the newer record of the same stock, NaN for the
+    # newest record of every stock.
+    pre_announce_date = np.roll(announce_date, 1)
+    first_row = np.ones(len(df), dtype=bool)
+    first_row[1:] = stocks[1:] != stocks[:-1]
+    pre_announce_date[first_row] = np.nan
+    chained = ~missing & ~np.isnan(pre_announce_date)
+
+    df['pre_announce_date'] = pre_announce_date
+    checks = (
+        (MISSING, missing),
+        (NOT_DECREASING, chained & (announce_date >= pre_announce_date)),
+        (WRONG_ANNOUNCE_TO,
+         chained & (dates['announce_to'].to_numpy() != pre_announce_date)),
+        (END_AFTER_ANNOUNCE,
+         chained & (dates['end_date'].to_numpy() >= announce_date)),
+    )
+    return concat([df[mask].assign(violation=violation)
+                   for violation, mask in checks],
+                  ignore_index=True)
+
+
+def verify_declares(table: T = strategy_quarter, processes=5) -> DataFrame:
+    """
+    check the announce chains of all stocks like verify_declare(), but all
+    violations are reported instead of raising the first one. The stocks are
+    split into ranges which are scanned by processes in parallel.
+
+    :return: one row for every violation, the columns are stockcode,
+             end_date, announce_date, announce_to, pre_announce_date (the
+             announce date of newer record) and violation. It is empty if the
+             table is valid.
+    """
+    name = table_name(table)
+    ranges = [(name, first, last)
+              for first, last in _stock_ranges(table, processes)]
+    if len(ranges) > 1:
+        with Pool(len(ranges)) as pool:
+            reports = pool.map(_verify_range, ranges)
+    else:
+        reports = [_verify_range(r) for r in ranges]
+    if len(reports) == 0:
+        return DataFrame(columns=_REPORT_COLUMNS)
+    ret = concat(reports, ignore_index=True).sort_values(
+        ['stockcode', 'end_date'], ascending=[True, False],
+        ignore_index=True)
+    counts = ret['violation'].value_counts()
+    print(datetime.datetime.now(), 'verified', name, ':',
+          {violation: int(counts.get(violation, 0))
+           for violation in _VIOLATIONS},
+          'in', ret['stockcode'].nunique(), 'stocks.')
+    return ret
+
+
 if __name__ == '__main__':
     fdhandle.init()
-    verify_declare('000001.XSHE')
+    report = verify_declares()
+    if len(report) != 0:
+        print(report.to_string())